@@ -0,0 +1,191 @@
+"""
+Accounts (checking, savings, credit card, cash) and transfers between them.
+
+Expenses and income may name the account they were paid from / into. Every
+write helper that creates or removes one (add_expense, delete_expense,
+add_income, recurring posting, CSV import, transfers) calls record_flow() in
+the same transaction, which keeps two things current:
+
+- Account.balance, the balance today;
+- account_days, one checkpoint per account and day with activity holding
+  that day's net flow and closing balance. A change dated D adds its delta
+  to D's row and to the closing balance of every later row (one indexed
+  UPDATE), so the balance on any date is a single lookup of the latest
+  checkpoint on or before it; there is nothing left to scan.
+
+Accounts are kept in the base currency (amounts use base_amount). Archiving
+moves transactions but leaves balances alone. rebuild_account_balances()
+recomputes everything from the transactions, archive tables and transfers,
+e.g. after FX rates were corrected.
+"""
+from collections import namedtuple
+from decimal import Decimal
+from sqlalchemy import delete, func, insert, select, union_all, update
+from database import db, commit
+from models import Account, AccountDay, ArchivedExpense, ArchivedIncome, Expense, Income, Transfer
+
+KINDS = ("checking", "savings", "credit", "cash")
+
+AccountRow = namedtuple("AccountRow", "id name kind balance current")
+
+
+def all_accounts() -> list:
+    return Account.query.order_by(Account.name).all()
+
+def create_account(name: str, kind: str = "checking", opening_balance=0) -> Account:
+    name = (name or "").strip()
+    if not name:
+        raise ValueError("Account name cannot be empty.")
+    if kind not in KINDS:
+        raise ValueError(f"Unknown account kind: {kind}")
+    account = Account(name=name, kind=kind, opening_balance=Decimal(opening_balance),
+                      balance=Decimal(opening_balance))
+    db.session.add(account)
+    commit()
+    return account
+
+
+def check_account(account_id: int | None) -> Account | None:
+    """The account, or ValueError if there is none; writers call this before adding their row."""
+    if account_id is None:
+        return None
+    account = db.session.get(Account, account_id)
+    if account is None:
+        raise ValueError(f"Unknown account: {account_id}")
+    return account
+
+def record_flow(account_id: int | None, when, delta) -> None:
+    """Money in (+) or out (-) of an account on `when`."""
+    account = check_account(account_id)
+    if account is None:
+        return
+    delta = Decimal(delta)
+    if not delta:
+        return
+    db.session.execute(
+        update(Account).where(Account.id == account_id).values(balance=Account.balance + delta),
+        execution_options={"synchronize_session": False},
+    )
+    db.session.expire(account, ["balance"])
+    if db.session.get(AccountDay, (account_id, when)) is None:
+        db.session.execute(insert(AccountDay).values(
+            account_id=account_id, date=when, flow=0, balance=_balance_before(account, when),
+        ))
+    days = (AccountDay.account_id == account_id)
+    db.session.execute(
+        update(AccountDay).where(days, AccountDay.date == when).values(flow=AccountDay.flow + delta),
+        execution_options={"synchronize_session": False},
+    )
+    db.session.execute(
+        update(AccountDay).where(days, AccountDay.date >= when).values(balance=AccountDay.balance + delta),
+        execution_options={"synchronize_session": False},
+    )
+
+def _balance_before(account: Account, when) -> Decimal:
+    balance = db.session.scalar(
+        select(AccountDay.balance)
+        .where(AccountDay.account_id == account.id, AccountDay.date < when)
+        .order_by(AccountDay.date.desc())
+        .limit(1)
+    )
+    return balance if balance is not None else account.opening_balance
+
+def record_flows(rows) -> None:
+    """record_flow() for many (account_id, date, delta) rows, one call per account and day."""
+    totals = {}
+    for account_id, when, delta in rows:
+        if account_id is not None:
+            totals[(account_id, when)] = totals.get((account_id, when), Decimal(0)) + Decimal(delta)
+    for (account_id, when), delta in sorted(totals.items()):
+        record_flow(account_id, when, delta)
+
+
+def balance_at(account_id: int, when) -> Decimal:
+    """Closing balance of the account on `when`."""
+    balance = db.session.scalar(
+        select(AccountDay.balance)
+        .where(AccountDay.account_id == account_id, AccountDay.date <= when)
+        .order_by(AccountDay.date.desc())
+        .limit(1)
+    )
+    if balance is None:
+        balance = db.session.scalar(select(Account.opening_balance).where(Account.id == account_id))
+    return Decimal(balance or 0)
+
+def account_balances(when=None) -> list:
+    """AccountRow per account, with its balance on `when` (default: today's balance)."""
+    latest = select(AccountDay.account_id, func.max(AccountDay.date).label("date")) \
+        .where(AccountDay.date <= when).group_by(AccountDay.account_id).subquery() if when else None
+    stmt = select(Account.id, Account.name, Account.kind, Account.opening_balance, Account.balance)
+    if latest is not None:
+        stmt = stmt.add_columns(AccountDay.balance) \
+            .outerjoin(latest, latest.c.account_id == Account.id) \
+            .outerjoin(AccountDay, (AccountDay.account_id == Account.id) & (AccountDay.date == latest.c.date))
+    rows = []
+    for id, name, kind, opening, current, *past in db.session.execute(stmt.order_by(Account.name)):
+        if latest is None:
+            balance = current
+        else:
+            balance = past[0] if past[0] is not None else opening
+        rows.append(AccountRow(id, name, kind, balance, current))
+    return rows
+
+
+# =========================
+# Transfers
+# =========================
+def add_transfer(from_account_id: int, to_account_id: int, amount, when, note: str = "") -> Transfer:
+    amount = Decimal(amount)
+    if from_account_id == to_account_id:
+        raise ValueError("Pick two different accounts.")
+    if amount <= 0:
+        raise ValueError("Transfer amount must be positive.")
+    check_account(from_account_id)
+    check_account(to_account_id)
+    t = Transfer(date=when, amount=amount, from_account_id=from_account_id, to_account_id=to_account_id,
+                 note=(note or "").strip())
+    db.session.add(t)
+    record_flow(from_account_id, when, -amount)
+    record_flow(to_account_id, when, amount)
+    commit()
+    return t
+
+def delete_transfer(transfer_id: int) -> None:
+    t = db.session.get(Transfer, transfer_id)
+    if t:
+        record_flow(t.from_account_id, t.date, t.amount)
+        record_flow(t.to_account_id, t.date, -t.amount)
+        db.session.delete(t)
+        commit()
+
+def recent_transfers(limit: int = 50) -> list:
+    return Transfer.query.order_by(Transfer.date.desc(), Transfer.id.desc()).limit(limit).all()
+
+
+def rebuild_account_balances() -> None:
+    """Recompute every balance and checkpoint from the transactions and transfers."""
+    flows = union_all(*(
+        select(model.account_id.label("account_id"), model.date.label("date"),
+               (sign * model.base_amount).label("delta"))
+        .where(model.account_id.is_not(None))
+        for model, sign in ((Expense, -1), (ArchivedExpense, -1), (Income, 1), (ArchivedIncome, 1))
+    ), select(Transfer.from_account_id, Transfer.date, -Transfer.amount),
+       select(Transfer.to_account_id, Transfer.date, Transfer.amount)).subquery()
+    daily = db.session.execute(
+        select(flows.c.account_id, flows.c.date, func.sum(flows.c.delta))
+        .group_by(flows.c.account_id, flows.c.date)
+        .order_by(flows.c.account_id, flows.c.date)
+    ).all()
+
+    db.session.execute(delete(AccountDay))
+    by_account = {}
+    for account_id, when, flow in daily:
+        by_account.setdefault(account_id, []).append((when, Decimal(str(flow or 0))))
+    for account in Account.query.all():
+        balance, rows = Decimal(account.opening_balance), []
+        for when, flow in by_account.get(account.id, ()):
+            balance += flow
+            rows.append({"account_id": account.id, "date": when, "flow": flow, "balance": balance})
+        if rows:
+            db.session.execute(insert(AccountDay), rows)
+        account.balance = balance
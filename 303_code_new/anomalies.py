@@ -0,0 +1,175 @@
+"""
+Spending anomaly detection.
+
+Each expense is compared, as it is written, with running statistics of what
+came before it:
+
+- its category: count, mean and variance of base_amount, kept with
+  Welford's online update (SpendStat n/mean/m2), so no history is re-read;
+- its normalized description (e.g. "netflix com"): the same amount
+  statistics plus the mean gap in days between charges.
+
+An expense is flagged when its amount is more than Z_THRESHOLD spreads above
+either mean (once that baseline has MIN_SAMPLES rows), or when a recurring
+description is charged again far sooner than usual, which is how a
+duplicated subscription shows up. The spread is the standard deviation, but
+at least MIN_SPREAD_RATIO of the mean, so a baseline of identical amounts
+does not flag every cent of difference. Only charges above the baseline are
+flagged.
+
+add_expense (and with it posted recurring items) and CSV imports call
+observe_expenses(), which reads and upserts two SpendStat rows by primary
+key per expense. rebuild_anomalies() replays all live expenses in date order
+to recompute the statistics and flags from scratch, e.g. after deletes or
+changes to the thresholds; it keeps dismissals.
+"""
+import math
+from sqlalchemy import delete, insert, select, tuple_
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from database import db, commit
+from models import Anomaly, Category, Expense, SpendStat, normalize_description
+
+Z_THRESHOLD = 3.0
+MIN_SAMPLES = {"category": 8, "description": 3}
+MIN_SPREAD_RATIO = 0.1
+MIN_SPREAD = 1.0
+# "charged again after 3 days, usually every 30" needs a gap this much shorter
+GAP_RATIO = 4.0
+MIN_USUAL_GAP = 7.0
+
+_STAT_FIELDS = ("n", "mean", "m2", "last_date", "gap_n", "gap_mean")
+
+
+def _keys(category_id, description) -> list:
+    keys = [("category", str(category_id))]
+    text = normalize_description(description)
+    if text:
+        keys.append(("description", text[:255]))
+    return keys
+
+def _load(keys) -> dict:
+    keys = list(set(keys))
+    book = {}
+    for i in range(0, len(keys), 400):
+        rows = db.session.execute(
+            select(SpendStat.scope, SpendStat.key, *(getattr(SpendStat, f) for f in _STAT_FIELDS))
+            .where(tuple_(SpendStat.scope, SpendStat.key).in_(keys[i:i + 400]))
+        )
+        for scope, key, *values in rows:
+            book[(scope, key)] = dict(zip(_STAT_FIELDS, values))
+    return book
+
+def _save(book: dict, keys) -> None:
+    rows = [{"scope": scope, "key": key, **book[(scope, key)]} for scope, key in set(keys)]
+    if not rows:
+        return
+    stmt = sqlite_insert(SpendStat)
+    for i in range(0, len(rows), 500):
+        db.session.execute(
+            stmt.on_conflict_do_update(
+                index_elements=["scope", "key"], set_={f: getattr(stmt.excluded, f) for f in _STAT_FIELDS},
+            ),
+            rows[i:i + 500],
+        )
+
+def _check(scope: str, stat: dict, x: float, when) -> list:
+    """[(score, reason)] for amount `x` on `when` against one baseline (before it is updated)."""
+    found = []
+    n, mean = stat["n"], stat["mean"]
+    if n >= MIN_SAMPLES[scope]:
+        std = math.sqrt(stat["m2"] / (n - 1)) if n > 1 else 0.0
+        spread = max(std, abs(mean) * MIN_SPREAD_RATIO, MIN_SPREAD)
+        z = (x - mean) / spread
+        if z >= Z_THRESHOLD:
+            found.append((z, f"{x:.2f} vs usual {mean:.2f} for this {scope}"))
+    if scope == "description" and stat["gap_n"] >= MIN_SAMPLES[scope] - 1 and stat["last_date"] is not None:
+        usual = stat["gap_mean"]
+        gap = (when - stat["last_date"]).days
+        if usual >= MIN_USUAL_GAP and 0 <= gap <= usual / GAP_RATIO:
+            found.append((usual / max(gap, 1), f"charged again after {gap} days, usually every {usual:.0f}"))
+    return found
+
+def _update(stat: dict, x: float, when) -> None:
+    # Welford: running mean and sum of squared deviations in one pass
+    stat["n"] += 1
+    delta = x - stat["mean"]
+    stat["mean"] += delta / stat["n"]
+    stat["m2"] += delta * (x - stat["mean"])
+    last = stat["last_date"]
+    if last is None or when >= last:
+        if last is not None:
+            stat["gap_n"] += 1
+            stat["gap_mean"] += ((when - last).days - stat["gap_mean"]) / stat["gap_n"]
+        stat["last_date"] = when
+
+def _empty() -> dict:
+    return {"n": 0, "mean": 0.0, "m2": 0.0, "last_date": None, "gap_n": 0, "gap_mean": 0.0}
+
+def _observe(book: dict, rows, dismissed=frozenset()) -> tuple:
+    """Score and fold in rows of (id, date, category_id, description, base_amount); returns (anomalies, keys)."""
+    anomalies, touched = [], []
+    for expense_id, when, category_id, description, amount in rows:
+        x = float(amount)
+        found = []
+        for key in _keys(category_id, description):
+            stat = book.setdefault(key, _empty())
+            found += _check(key[0], stat, x, when)
+            _update(stat, x, when)
+            touched.append(key)
+        if found:
+            score = max(s for s, _ in found)
+            anomalies.append({
+                "expense_id": expense_id, "score": round(score, 2),
+                "reason": "; ".join(r for _, r in found)[:255], "dismissed": expense_id in dismissed,
+            })
+    return anomalies, touched
+
+
+def observe_expenses(rows) -> int:
+    """Flag and fold in new expenses: rows of (id, date, category_id, description, base_amount)."""
+    rows = list(rows)
+    book = _load(k for _, _, cid, desc, _ in rows for k in _keys(cid, desc))
+    anomalies, touched = _observe(book, rows)
+    _save(book, touched)
+    if anomalies:
+        db.session.execute(insert(Anomaly), anomalies)
+    return len(anomalies)
+
+def rebuild_anomalies(batch: int = 5000) -> int:
+    """Recompute all statistics and flags from the live expenses, oldest first."""
+    dismissed = frozenset(db.session.scalars(select(Anomaly.expense_id).where(Anomaly.dismissed)))
+    db.session.execute(delete(Anomaly))
+    db.session.execute(delete(SpendStat))
+    book, flagged = {}, 0
+    stmt = select(Expense.id, Expense.date, Expense.category_id, Expense.description, Expense.base_amount) \
+        .order_by(Expense.date, Expense.id)
+    for rows in db.session.execute(stmt.execution_options(yield_per=batch)).partitions():
+        anomalies, _ = _observe(book, rows, dismissed)
+        if anomalies:
+            db.session.execute(insert(Anomaly), anomalies)
+            flagged += len(anomalies)
+    _save(book, book.keys())
+    commit()
+    return flagged
+
+
+def list_anomalies(include_dismissed: bool = False, limit: int = 200) -> list:
+    """Flagged expenses, newest first, as rows of plain columns."""
+    stmt = (
+        select(Anomaly.id, Anomaly.score, Anomaly.reason, Anomaly.dismissed, Anomaly.expense_id,
+               Expense.date, Expense.amount, Expense.currency, Expense.base_amount, Expense.description,
+               Category.name.label("category"))
+        .join(Expense, Expense.id == Anomaly.expense_id)
+        .join(Category, Category.id == Expense.category_id)
+        .order_by(Expense.date.desc(), Anomaly.id.desc())
+        .limit(limit)
+    )
+    if not include_dismissed:
+        stmt = stmt.where(Anomaly.dismissed.is_(False))
+    return db.session.execute(stmt).all()
+
+def dismiss_anomaly(anomaly_id: int) -> None:
+    a = db.session.get(Anomaly, anomaly_id)
+    if a:
+        a.dismissed = True
+        commit()
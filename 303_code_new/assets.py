@@ -0,0 +1,138 @@
+"""
+Static asset pipeline.
+
+At startup every file under static/ is copied to instance/assets/ under a
+content-hashed name (report.js -> report.3f2a9c1b0d.js) together with a
+gzip variant and, when the optional `brotli` package is installed, a brotli
+variant. Templates call asset_url("report.js"); the hashed URL never changes
+for the same bytes, so it is served with a far-future immutable cache header
+and repeat visits cost no static bytes at all.
+
+Third-party CSS/JS (Bootstrap, Chart.js) is referenced the same way. If a copy
+is dropped into static/vendor/ it is fingerprinted and served locally; until
+then asset_url() falls back to a version-pinned CDN URL.
+
+JSON responses are gzipped on the fly. HTML is not: pages reflect user
+input next to per-request secrets (form keys, session data), and
+compressing the two together leaks the secret through the response size
+(BREACH).
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+from flask import abort, current_app, request, send_file, url_for
+
+try:
+    import brotli
+except ImportError:  # optional: without it only gzip variants are written
+    brotli = None
+
+ONE_YEAR = 365 * 24 * 3600
+COMPRESSIBLE = (".js", ".css", ".svg", ".json", ".map", ".txt", ".html")
+DYNAMIC_GZIP_TYPES = ("application/json",)
+DYNAMIC_GZIP_MIN_BYTES = 500
+
+CDN_FALLBACKS = {
+    "vendor/bootstrap.min.css": "https://cdn.jsdelivr.net/npm/bootstrap@5.3.3/dist/css/bootstrap.min.css",
+    "vendor/bootstrap-icons.min.css": "https://cdn.jsdelivr.net/npm/bootstrap-icons@1.11.3/font/bootstrap-icons.min.css",
+    "vendor/bootstrap.bundle.min.js": "https://cdn.jsdelivr.net/npm/bootstrap@5.3.3/dist/js/bootstrap.bundle.min.js",
+    "vendor/chart.umd.min.js": "https://cdn.jsdelivr.net/npm/chart.js@4.4.1/dist/chart.umd.min.js",
+}
+
+
+def init_assets(app):
+    out_dir = os.path.join(app.instance_path, "assets")
+    app.extensions["assets"] = {
+        "dir": out_dir,
+        "manifest": build_assets(app.static_folder, out_dir),
+    }
+    app.add_url_rule("/assets/<path:filename>", "assets", serve_asset)
+    app.add_template_global(asset_url)
+    app.after_request(gzip_response)
+
+def build_assets(static_dir: str, out_dir: str) -> dict:
+    """Fingerprint and precompress every static file. Returns {name: hashed name}."""
+    manifest = {}
+    for root, _dirs, files in os.walk(static_dir):
+        for fname in files:
+            src = os.path.join(root, fname)
+            name = os.path.relpath(src, static_dir).replace(os.sep, "/")
+            with open(src, "rb") as f:
+                data = f.read()
+            stem, ext = os.path.splitext(name)
+            hashed = f"{stem}.{hashlib.sha256(data).hexdigest()[:10]}{ext}"
+            manifest[name] = hashed
+            _write_variants(os.path.join(out_dir, hashed), data, ext)
+    return manifest
+
+def _write_variants(dest: str, data: bytes, ext: str) -> None:
+    # the hashed name pins the content, so existing outputs are reused
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    if not os.path.exists(dest):
+        _atomic_write(dest, data)
+    if ext not in COMPRESSIBLE:
+        return
+    if not os.path.exists(dest + ".gz"):
+        _atomic_write(dest + ".gz", gzip.compress(data, compresslevel=9, mtime=0))
+    if brotli is not None and not os.path.exists(dest + ".br"):
+        _atomic_write(dest + ".br", brotli.compress(data))
+
+def _atomic_write(path: str, data: bytes) -> None:
+    # several workers may build at the same time
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+def asset_url(name: str) -> str:
+    """URL for a static asset: fingerprinted if built, else CDN or plain /static."""
+    hashed = current_app.extensions["assets"]["manifest"].get(name)
+    if hashed:
+        return url_for("assets", filename=hashed)
+    if name in CDN_FALLBACKS:
+        return CDN_FALLBACKS[name]
+    return url_for("static", filename=name)
+
+def serve_asset(filename):
+    out_dir = current_app.extensions["assets"]["dir"]
+    path = os.path.realpath(os.path.join(out_dir, filename))
+    if not path.startswith(os.path.realpath(out_dir) + os.sep) or not os.path.isfile(path):
+        abort(404)
+
+    mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    accepted = request.accept_encodings
+    encoding = None
+    for enc, suffix in (("br", ".br"), ("gzip", ".gz")):
+        if accepted[enc] and os.path.isfile(path + suffix):
+            encoding, path = enc, path + suffix
+            break
+
+    resp = send_file(path, mimetype=mimetype, conditional=True, etag=True, max_age=ONE_YEAR)
+    resp.cache_control.public = True
+    resp.cache_control.immutable = True
+    resp.vary.add("Accept-Encoding")
+    if encoding:
+        resp.headers["Content-Encoding"] = encoding
+    return resp
+
+def gzip_response(resp):
+    if (
+        resp.status_code != 200
+        or resp.direct_passthrough
+        or resp.mimetype not in DYNAMIC_GZIP_TYPES
+        or "Content-Encoding" in resp.headers
+        or not request.accept_encodings["gzip"]
+    ):
+        return resp
+    data = resp.get_data()
+    if len(data) < DYNAMIC_GZIP_MIN_BYTES:
+        return resp
+    resp.set_data(gzip.compress(data, compresslevel=6))
+    resp.headers["Content-Encoding"] = "gzip"
+    resp.vary.add("Accept-Encoding")
+    # the body changed, so a strong ETag computed on the plain body is now weak
+    etag, weak = resp.get_etag()
+    if etag and not weak:
+        resp.set_etag(etag, weak=True)
+    return resp
@@ -0,0 +1,205 @@
+"""
+Receipt and pay stub attachments for expenses and income.
+
+Files are stored by content. An upload is copied from the request stream to
+a temporary file CHUNK bytes at a time while its SHA-256 is computed, then
+renamed to objects/<ab>/<sha256> under ATTACHMENT_DIR; no more than one chunk
+is ever held in memory, and a receipt uploaded twice is stored once.
+Attachment rows (one per upload: file name, type, and the expense or income
+it belongs to) point at the hash. Files no row refers to any more are removed
+by sweep_store(), so a delete never races a concurrent upload of the same
+content. Every user database (shards.py) has a store of its own under
+users/<database>, so a sweep only has to look at one database's rows.
+
+Downloads go through send_file(conditional=True): Range requests get 206
+partial responses, the hash doubles as the ETag, and the bytes are sent by
+the WSGI server's file wrapper (sendfile where available). Only raster
+images (INLINE_TYPES) are shown inline; anything else, HTML and SVG included,
+is sent as a download with nosniff, so an upload never runs as a page of
+this site.
+
+Thumbnails of images are made after the upload has returned, by a small
+thread pool (THUMBNAIL_WORKERS), with Pillow if it is installed; without it
+attachments simply have no thumbnail.
+"""
+import hashlib
+import os
+import tempfile
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from sqlalchemy import delete, select
+from database import db, commit, current_shard
+from models import Attachment
+
+try:
+    from PIL import Image
+except ImportError:  # optional: without it no thumbnails are made
+    Image = None
+
+CHUNK = 64 * 1024
+THUMBNAIL_SIZE = (320, 320)
+# content types safe to render from this origin
+INLINE_TYPES = frozenset({"image/jpeg", "image/png", "image/gif", "image/webp"})
+# unreferenced files younger than this may belong to an upload in flight
+SWEEP_MIN_AGE = 3600
+
+AttachmentRow = namedtuple("AttachmentRow", "id owner_id filename size content_type")
+
+
+class AttachmentTooLarge(ValueError):
+    pass
+
+
+def store_root() -> str:
+    root, shard = current_app.config["ATTACHMENT_DIR"], current_shard()
+    return os.path.join(root, "users", os.path.splitext(shard)[0]) if shard else root
+
+def object_path(root: str, sha256: str) -> str:
+    return os.path.join(root, "objects", sha256[:2], sha256)
+
+def thumbnail_path(root: str, sha256: str) -> str:
+    return os.path.join(root, "thumbs", sha256[:2], sha256 + ".jpg")
+
+
+def store_stream(stream, root: str, max_bytes: int | None = None) -> tuple:
+    """Copy a binary stream into the store; returns (sha256, size)."""
+    tmp_dir = os.path.join(root, "tmp")
+    os.makedirs(tmp_dir, exist_ok=True)
+    digest, size = hashlib.sha256(), 0
+    fd, tmp = tempfile.mkstemp(dir=tmp_dir)
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while block := stream.read(CHUNK):
+                size += len(block)
+                if max_bytes and size > max_bytes:
+                    raise AttachmentTooLarge(f"file is larger than {max_bytes} bytes")
+                digest.update(block)
+                out.write(block)
+        sha256 = digest.hexdigest()
+        path = object_path(root, sha256)
+        if os.path.exists(path):
+            os.remove(tmp)
+            os.utime(path)  # fresh again, so a running sweep leaves it alone
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return sha256, size
+
+
+def add_attachment(sha256: str, size: int, filename: str, content_type: str | None = None,
+                   expense_id: int | None = None, income_id: int | None = None) -> Attachment:
+    """Attach stored content to one expense or income row; the same content twice returns the first."""
+    if (expense_id is None) == (income_id is None):
+        raise ValueError("Attach to exactly one expense or income.")
+    found = Attachment.query.filter_by(sha256=sha256, expense_id=expense_id, income_id=income_id).first()
+    if found:
+        return found
+    a = Attachment(sha256=sha256, size=size, filename=os.path.basename(filename or "")[:255] or "attachment",
+                   content_type=content_type or "application/octet-stream",
+                   expense_id=expense_id, income_id=income_id)
+    db.session.add(a)
+    commit()
+    return a
+
+def delete_attachment(attachment_id: int) -> None:
+    a = db.session.get(Attachment, attachment_id)
+    if a:
+        db.session.delete(a)
+        commit()
+
+def delete_attachments_of(expense_id: int | None = None, income_id: int | None = None) -> None:
+    """Drop the rows of a deleted transaction (no commit; the files go with the next sweep)."""
+    column, owner = (Attachment.expense_id, expense_id) if expense_id is not None else (Attachment.income_id, income_id)
+    db.session.execute(delete(Attachment).where(column == owner))
+
+def attachments_for(kind: str, ids) -> dict:
+    """{expense or income id: [AttachmentRow]} for the rows on a page, one query."""
+    owner = Attachment.expense_id if kind == "expense" else Attachment.income_id
+    ids = list(ids)
+    found = {}
+    if not ids:
+        return found
+    rows = db.session.execute(
+        select(Attachment.id, owner, Attachment.filename, Attachment.size, Attachment.content_type)
+        .where(owner.in_(ids))
+        .order_by(Attachment.id)
+    )
+    for row in rows:
+        found.setdefault(row[1], []).append(AttachmentRow(*row))
+    return found
+
+
+def sweep_store(root: str, min_age: float = SWEEP_MIN_AGE) -> int:
+    """Remove stored files (and thumbnails) no attachment refers to; returns how many."""
+    referenced = set(db.session.scalars(select(Attachment.sha256).distinct()))
+    cutoff = time.time() - min_age
+    removed = 0
+    for sub in ("objects", "tmp"):
+        for dirpath, _, names in os.walk(os.path.join(root, sub)):
+            for name in names:
+                path = os.path.join(dirpath, name)
+                if name in referenced or os.path.getmtime(path) > cutoff:
+                    continue
+                os.remove(path)
+                if sub == "objects":
+                    removed += 1
+                    if os.path.exists(thumbnail_path(root, name)):
+                        os.remove(thumbnail_path(root, name))
+    return removed
+
+
+def make_thumbnail(root: str, sha256: str) -> str | None:
+    """Write a JPEG thumbnail of a stored image; None if it cannot be read as one."""
+    path = thumbnail_path(root, sha256)
+    if os.path.exists(path):
+        return path
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    try:
+        with Image.open(object_path(root, sha256)) as im:
+            im.thumbnail(THUMBNAIL_SIZE)
+            im.convert("RGB").save(path + ".part", "JPEG", quality=80)
+    except Exception as e:
+        if os.path.exists(path + ".part"):
+            os.remove(path + ".part")
+        if isinstance(e, OSError):
+            return None
+        raise  # e.g. Image.DecompressionBombError; recorded by the Thumbnailer
+    os.replace(path + ".part", path)
+    return path
+
+class Thumbnailer:
+    """Thread pool that makes image thumbnails off the request path."""
+
+    def __init__(self, workers: int = 2):
+        self.failures = 0
+        self.last_error = None
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="thumbnail")
+
+    def _make(self, root: str, sha256: str):
+        try:
+            return make_thumbnail(root, sha256)
+        except Exception as e:
+            self.failures += 1
+            self.last_error = e
+            return None
+
+    def submit(self, root: str, sha256: str, content_type: str):
+        """Queue a thumbnail for an image upload; returns its Future, or None if there is nothing to do."""
+        if Image is None or not (content_type or "").startswith("image/"):
+            return None
+        return self._pool.submit(self._make, root, sha256)
+
+    def shutdown(self):
+        self._pool.shutdown(wait=True)
+
+
+def init_attachments(app):
+    if not app.config.get("ATTACHMENT_DIR"):
+        app.config["ATTACHMENT_DIR"] = os.path.join(app.instance_path, "attachments")
+    app.extensions["thumbnails"] = Thumbnailer(app.config.get("THUMBNAIL_WORKERS", 2))
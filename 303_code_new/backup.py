@@ -0,0 +1,269 @@
+"""
+Online backups of the SQLite database, and restore.
+
+A backup copies the live database with SQLite's backup API, a few hundred
+pages per step with a short sleep in between, inside one read transaction on
+the source. The database runs in WAL mode (see database.py), so that read
+transaction never blocks writers and every step copies the same snapshot:
+the copy does not restart when the app commits meanwhile, and what lands on
+disk is the database as of the moment the backup began.
+
+Each backup is a gzip file, site-YYYYMMDDTHHMMSS.db.gz, next to a .sha256
+file in `sha256sum` format. Only the newest BACKUP_KEEP backups are kept.
+Restoring checks the checksum, decompresses to a temporary file, runs
+PRAGMA integrity_check on it, and only then copies it over the live database
+(again with the backup API, so open connections see the switch atomically).
+Restoring to a point in time picks the newest backup taken at or before it.
+
+In the app (config BACKUP_INTERVAL_MINUTES > 0) a daemon thread takes a
+backup whenever the newest one is older than the interval; a lock file keeps
+worker processes from backing up at the same time. Each user database under
+SHARD_DIR (see shards.py) gets the same treatment in a directory of its own,
+BACKUP_DIR/users/<name>, so one of them is restored with
+--db instance/users/user-2.db --dir instance/backups/users/user-2. From the
+shell:
+
+    python backup.py backup [--db instance/site.db] [--dir instance/backups] [--keep 14]
+    python backup.py list
+    python backup.py verify instance/backups/site-20261019T020000.db.gz
+    python backup.py restore [PATH | --at 2026-10-18T23:00]
+"""
+import argparse
+import fcntl
+import gzip
+import hashlib
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_DB = os.path.join(_HERE, "instance", "site.db")
+DEFAULT_DIR = os.path.join(_HERE, "instance", "backups")
+SUFFIX = ".db.gz"
+_STAMP = "%Y%m%dT%H%M%S"
+
+
+class BackupError(Exception):
+    pass
+
+
+def _sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _taken_at(path: str) -> datetime:
+    name = os.path.basename(path)
+    return datetime.strptime(name[len("site-"):-len(SUFFIX)], _STAMP)
+
+
+def backup_database(db_path: str, backup_dir: str, pages: int = 256, sleep: float = 0.002) -> str:
+    """Copy `db_path` into a new compressed, checksummed backup; returns its path."""
+    os.makedirs(backup_dir, exist_ok=True)
+    name = "site-" + datetime.now().strftime(_STAMP)
+    path = os.path.join(backup_dir, name + SUFFIX)
+    if os.path.exists(path):
+        raise BackupError(f"{path} already exists")
+    raw = os.path.join(backup_dir, f".{name}.db")
+
+    src = sqlite3.connect(db_path, isolation_level=None, timeout=30)
+    dst = sqlite3.connect(raw)
+    try:
+        # pin one snapshot for every step of the copy
+        src.execute("BEGIN")
+        src.execute("SELECT 1 FROM sqlite_master LIMIT 1")
+        src.backup(dst, pages=pages, sleep=sleep)
+        src.execute("COMMIT")
+    finally:
+        dst.close()
+        src.close()
+
+    try:
+        with open(raw, "rb") as f_in, gzip.open(path + ".part", "wb", compresslevel=6) as f_out:
+            shutil.copyfileobj(f_in, f_out, 1 << 20)
+        os.replace(path + ".part", path)
+    finally:
+        os.remove(raw)
+    with open(path + ".sha256", "w") as f:
+        f.write(f"{_sha256(path)}  {os.path.basename(path)}\n")
+    return path
+
+def list_backups(backup_dir: str) -> list:
+    """Backup paths, oldest first."""
+    if not os.path.isdir(backup_dir):
+        return []
+    names = sorted(n for n in os.listdir(backup_dir) if n.startswith("site-") and n.endswith(SUFFIX))
+    return [os.path.join(backup_dir, n) for n in names]
+
+def rotate_backups(backup_dir: str, keep: int) -> list:
+    """Delete all but the newest `keep` backups; returns the deleted paths."""
+    old = list_backups(backup_dir)[:-keep] if keep > 0 else []
+    for path in old:
+        os.remove(path)
+        if os.path.exists(path + ".sha256"):
+            os.remove(path + ".sha256")
+    return old
+
+def find_backup(backup_dir: str, at: datetime | None = None) -> str:
+    """Newest backup taken at or before `at` (default: the newest)."""
+    found = [p for p in list_backups(backup_dir) if at is None or _taken_at(p) <= at]
+    if not found:
+        raise BackupError(f"no backup in {backup_dir}" + (f" at or before {at.isoformat()}" if at else ""))
+    return found[-1]
+
+def verify_backup(path: str) -> None:
+    """Raise BackupError unless the file matches its .sha256."""
+    try:
+        with open(path + ".sha256") as f:
+            expected = f.read().split()[0]
+    except (OSError, IndexError):
+        raise BackupError(f"missing checksum for {path}")
+    if _sha256(path) != expected:
+        raise BackupError(f"checksum mismatch for {path}")
+
+def restore_backup(path: str, db_path: str) -> None:
+    """Verify `path` and copy it over the database at `db_path`."""
+    verify_backup(path)
+    raw = db_path + ".restore"
+    with gzip.open(path, "rb") as f_in, open(raw, "wb") as f_out:
+        shutil.copyfileobj(f_in, f_out, 1 << 20)
+    try:
+        src = sqlite3.connect(raw)
+        try:
+            result = [row[0] for row in src.execute("PRAGMA integrity_check")]
+            if result != ["ok"]:
+                raise BackupError(f"integrity check failed for {path}: {'; '.join(result[:5])}")
+            dst = sqlite3.connect(db_path, timeout=30)
+            try:
+                src.backup(dst)
+            finally:
+                dst.close()
+        finally:
+            src.close()
+    finally:
+        os.remove(raw)
+
+
+class BackupScheduler:
+    """
+    Daemon thread: back up `db_path`, and every user database in `shard_dir`,
+    whenever its newest backup is older than `interval` seconds.
+    """
+
+    def __init__(self, db_path: str, backup_dir: str, interval: float, keep: int = 14,
+                 shard_dir: str | None = None):
+        self.db_path = db_path
+        self.backup_dir = backup_dir
+        self.interval = interval
+        self.keep = keep
+        self.shard_dir = shard_dir
+        self.last_error = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="backup-scheduler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def due(self, backup_dir: str | None = None) -> bool:
+        backups = list_backups(backup_dir or self.backup_dir)
+        return not backups or (datetime.now() - _taken_at(backups[-1])).total_seconds() >= self.interval
+
+    def targets(self) -> list:
+        """(database, backup directory) pairs: the main database, then each user database."""
+        found = [(self.db_path, self.backup_dir)]
+        if self.shard_dir and os.path.isdir(self.shard_dir):
+            for name in sorted(n for n in os.listdir(self.shard_dir) if n.endswith(".db")):
+                found.append((os.path.join(self.shard_dir, name),
+                              os.path.join(self.backup_dir, "users", name[:-len(".db")])))
+        return found
+
+    def run_once(self) -> list:
+        """Back up and rotate whatever is due unless another process is doing it; returns the new backups' paths."""
+        os.makedirs(self.backup_dir, exist_ok=True)
+        with open(os.path.join(self.backup_dir, ".lock"), "w") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return []
+            made = []
+            for db_path, backup_dir in self.targets():
+                if self.due(backup_dir):
+                    made.append(backup_database(db_path, backup_dir))
+                    rotate_backups(backup_dir, self.keep)
+            return made
+
+    def _run(self):
+        while not self._stop.wait(min(self.interval, 60)):
+            try:
+                self.run_once()
+                self.last_error = None
+            except Exception as e:
+                self.last_error = e
+
+
+def init_backups(app):
+    minutes = app.config.get("BACKUP_INTERVAL_MINUTES", 0)
+    if not minutes:
+        return
+    from database import db, is_sqlite_file
+    with app.app_context():
+        if not is_sqlite_file(db.engine):
+            return
+        db_path = db.engine.url.database
+    app.extensions["backups"] = BackupScheduler(
+        db_path,
+        app.config.get("BACKUP_DIR") or os.path.join(app.instance_path, "backups"),
+        interval=minutes * 60,
+        keep=app.config.get("BACKUP_KEEP", 14),
+        shard_dir=app.extensions["shards"].directory if "shards" in app.extensions else None,
+    ).start()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Back up or restore the SQLite database.")
+    parser.add_argument("--db", default=DEFAULT_DB)
+    parser.add_argument("--dir", default=DEFAULT_DIR)
+    sub = parser.add_subparsers(dest="command", required=True)
+    run = sub.add_parser("backup")
+    run.add_argument("--keep", type=int, default=14)
+    sub.add_parser("list")
+    check = sub.add_parser("verify")
+    check.add_argument("path")
+    restore = sub.add_parser("restore")
+    restore.add_argument("path", nargs="?")
+    restore.add_argument("--at", type=datetime.fromisoformat, help="newest backup at or before this time")
+    args = parser.parse_args(argv)
+
+    try:
+        if args.command == "backup":
+            start = time.perf_counter()
+            path = backup_database(args.db, args.dir)
+            removed = rotate_backups(args.dir, args.keep)
+            print(f"{path} ({os.path.getsize(path)} bytes, {time.perf_counter() - start:.1f}s); "
+                  f"removed {len(removed)} old backups")
+        elif args.command == "list":
+            for path in list_backups(args.dir):
+                print(f"{_taken_at(path).isoformat()}  {os.path.getsize(path):>12}  {path}")
+        elif args.command == "verify":
+            verify_backup(args.path)
+            print(f"{args.path}: ok")
+        else:
+            path = args.path or find_backup(args.dir, args.at)
+            restore_backup(path, args.db)
+            print(f"restored {path} into {args.db}")
+    except BackupError as e:
+        parser.exit(1, f"error: {e}\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""
+Throughput benchmark for the auto-categorization matcher.
+
+Builds a few hundred substring/regex/amount rules and classifies synthetic
+bank descriptions (1,000,000 by default).
+
+    python bench_categorize.py [count]
+"""
+import random
+import sys
+import time
+from categorize import Rule, RuleMatcher
+
+MERCHANTS = [f"merchant{i:03d}" for i in range(300)] + [
+    "trader joe", "whole foods", "uber eats", "uber", "lyft", "netflix",
+    "spotify", "costco", "shell oil", "chevron", "amazon prime", "target",
+]
+
+
+def build_rules():
+    rules = [Rule(i, i % 40, "substring", m, None, None, None, 100) for i, m in enumerate(MERCHANTS)]
+    base = len(rules)
+    rules += [
+        Rule(base + 1, 41, "regex", r"amzn\s*mktp", None, None, None, 50),
+        Rule(base + 2, 42, "regex", r"\bpayroll\b", None, None, None, 50),
+        Rule(base + 3, 43, "substring", "costco", 200.0, None, None, 10),
+        Rule(base + 4, 44, None, None, 5000.0, None, None, 900),
+    ]
+    return rules
+
+
+def main(count=1_000_000):
+    rng = random.Random(7)
+    words = ["POS", "PURCHASE", "DEBIT", "CARD", "#1234", "ONLINE", "CA", "NY", "REF"]
+    items = []
+    for _ in range(count):
+        parts = rng.sample(words, 3)
+        if rng.random() < 0.8:
+            parts.insert(rng.randrange(4), rng.choice(MERCHANTS).upper())
+        items.append((" ".join(parts), round(rng.uniform(1, 400), 2), None))
+
+    t0 = time.perf_counter()
+    matcher = RuleMatcher(build_rules())
+    t1 = time.perf_counter()
+    results = matcher.classify_many(items)
+    t2 = time.perf_counter()
+
+    matched = sum(1 for r in results if r is not None)
+    print(f"compiled {len(matcher.rules)} rules in {(t1 - t0) * 1000:.1f} ms")
+    print(f"classified {count:,} descriptions in {t2 - t1:.2f} s "
+          f"({count / (t2 - t1):,.0f}/s, {matched:,} matched)")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
@@ -0,0 +1,56 @@
+"""
+Startup-time benchmark for create_app().
+
+Each run starts a fresh interpreter (so imports are cold), builds the app
+against a throwaway SQLite file and reports the median time. Compares the
+first boot (schema has to be created) with later boots (schema version
+already matches), for all features and for a single feature.
+
+    python bench_startup.py [runs]
+"""
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+SNIPPET = """
+import time
+t0 = time.perf_counter()
+from app import create_app
+t1 = time.perf_counter()
+create_app(features={features!r}, config={{"SQLALCHEMY_DATABASE_URI": {uri!r}, "SECRET_KEY": "bench"}})
+t2 = time.perf_counter()
+print((t1 - t0) * 1000, (t2 - t1) * 1000)
+"""
+
+
+def time_boot(uri, features=None):
+    """Return (import ms, create_app ms) for one fresh interpreter."""
+    code = SNIPPET.format(features=features, uri=uri)
+    out = subprocess.run(
+        [sys.executable, "-c", code], cwd=HERE, check=True,
+        capture_output=True, text=True,
+    ).stdout
+    imp, create = out.strip().splitlines()[-1].split()
+    return float(imp), float(create)
+
+
+def main(runs=5):
+    cases = (("all features", None), ("report only", ("report",)))
+    for label, features in cases:
+        cold, warm = [], []
+        for _ in range(runs):
+            with tempfile.TemporaryDirectory() as tmp:
+                uri = "sqlite:///" + os.path.join(tmp, "bench.db")
+                cold.append(time_boot(uri, features))
+                warm.append(time_boot(uri, features))
+        med = lambda xs, i: statistics.median(x[i] for x in xs)
+        print(f"{label:>14}: import {med(warm, 0):6.1f} ms | create_app first boot "
+              f"{med(cold, 1):6.1f} ms, schema current {med(warm, 1):6.1f} ms")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
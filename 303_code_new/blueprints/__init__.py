@@ -0,0 +1,18 @@
+# Per-feature blueprints. create_app() imports only the features it registers,
+# so a worker or test fixture that needs a subset skips the rest.
+
+# feature name -> module in this package (each defines `bp`)
+FEATURES = (
+    "categories",
+    "expenses",
+    "income",
+    "budgets",
+    "goals",
+    "recurring",
+    "report",
+    "api",
+    "fx",
+    "anomalies",
+    "accounts",
+    "attachments",
+)
@@ -0,0 +1,54 @@
+# Accounts, balances and transfers (see accounts.py)
+from datetime import date, datetime
+from decimal import Decimal
+from flask import Blueprint, render_template, request, redirect, url_for, flash
+from accounts import KINDS, account_balances, create_account, add_transfer, delete_transfer, recent_transfers
+from writequeue import write
+from idempotency import idempotent
+from blueprints.auth import login_required
+
+bp = Blueprint("accounts", __name__)
+
+
+@bp.route("/accounts", methods=["GET", "POST"])
+@login_required
+@idempotent
+def accounts():
+    if request.method == "POST":
+        try:
+            opening = Decimal(request.form.get("opening_balance") or 0)
+            write(create_account, request.form.get("name"), request.form.get("kind", "checking"), opening)
+            flash("Account added.", "success")
+        except Exception as e:
+            flash(f"Failed to add account: {e}", "error")
+        return redirect(url_for("accounts.accounts"))
+
+    as_of = None
+    if request.args.get("as_of"):
+        try:
+            as_of = datetime.strptime(request.args["as_of"], "%Y-%m-%d").date()
+        except ValueError:
+            flash("Invalid date.", "error")
+    rows = account_balances(as_of)
+    return render_template("accounts.html", rows=rows, as_of=as_of, kinds=KINDS, transfers=recent_transfers(),
+                           names={r.id: r.name for r in rows}, today=date.today())
+
+@bp.post("/accounts/transfers")
+@login_required
+@idempotent
+def transfer():
+    try:
+        when = datetime.strptime(request.form["date"], "%Y-%m-%d").date()
+        write(add_transfer, int(request.form["from_account_id"]), int(request.form["to_account_id"]),
+              Decimal(request.form["amount"]), when, request.form.get("note"))
+        flash("Transfer saved.", "success")
+    except Exception as e:
+        flash(f"Failed to save transfer: {e}", "error")
+    return redirect(url_for("accounts.accounts"))
+
+@bp.post("/accounts/transfers/<int:id>/delete")
+@login_required
+def remove_transfer(id):
+    write(delete_transfer, id)
+    flash("Transfer deleted.", "success")
+    return redirect(url_for("accounts.accounts"))
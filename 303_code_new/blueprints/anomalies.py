@@ -0,0 +1,31 @@
+# Spending anomalies flagged at write time (see anomalies.py)
+from flask import Blueprint, render_template, request, redirect, url_for, flash
+from anomalies import list_anomalies, dismiss_anomaly, rebuild_anomalies
+from writequeue import write
+from blueprints.auth import login_required
+
+bp = Blueprint("anomalies", __name__)
+
+
+@bp.get("/anomalies")
+@login_required
+def anomalies():
+    show_all = request.args.get("all") == "1"
+    return render_template("anomalies.html", items=list_anomalies(include_dismissed=show_all), show_all=show_all)
+
+@bp.post("/anomalies/<int:id>/dismiss")
+@login_required
+def dismiss(id):
+    write(dismiss_anomaly, id)
+    flash("Anomaly dismissed.", "success")
+    return redirect(request.referrer or url_for("anomalies.anomalies"))
+
+@bp.post("/tasks/anomalies/rebuild")
+@login_required
+def rebuild():
+    try:
+        flagged = write(rebuild_anomalies)
+        flash(f"Rebuilt spending baselines; {flagged} expenses flagged.", "success")
+    except Exception as e:
+        flash(f"Failed to rebuild anomalies: {e}", "error")
+    return redirect(url_for("anomalies.anomalies"))
@@ -0,0 +1,172 @@
+# JSON API (v1). Uses the same session login as the pages, but answers
+# 401/400 with a JSON body instead of redirecting and flashing.
+from datetime import date
+from decimal import Decimal, InvalidOperation
+from functools import wraps
+from flask import Blueprint, current_app, jsonify, request, session, url_for
+from models import Expense, Income
+from functions import add_expense, add_income, get_or_create_category
+from queries import TransactionFilter, query_transactions, transaction_json, transaction_row
+from idempotency import idempotent
+from writequeue import write
+from changes import changes_since, MAX_CHANGES
+from anomalies import list_anomalies
+
+bp = Blueprint("api", __name__, url_prefix="/api/v1")
+
+
+def api_login_required(view_func):
+    @wraps(view_func)
+    def wrapped_view(*args, **kwargs):
+        if not session.get("logged_in"):
+            return jsonify(error="login required"), 401
+        return view_func(*args, **kwargs)
+    return wrapped_view
+
+
+@bp.get("/transactions")
+@api_login_required
+def transactions():
+    """
+    ?kind=expense|income plus the filters of queries.TransactionFilter,
+    page, per_page (max 500) and totals=1 for the amount total and an exact
+    count. Without totals the count is estimated beyond queries.COUNT_CAP.
+    """
+    try:
+        filters = TransactionFilter.from_args(request.args)
+        page = int(request.args.get("page", 1))
+        per_page = int(request.args.get("per_page", 50))
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    result = query_transactions(filters, page=page, per_page=per_page,
+                                with_totals=request.args.get("totals") == "1")
+    return jsonify(
+        items=[transaction_json(row) for row in result.items],
+        page=result.page,
+        per_page=result.per_page,
+        count=result.count,
+        count_exact=result.count_exact,
+        total=float(result.total) if result.total is not None else None,
+        next=url_for("api.transactions", kind=filters.kind, page=result.page + 1, per_page=result.per_page,
+                     **filters.query_args()) if result.has_next else None,
+    )
+
+
+@bp.get("/changes")
+@api_login_required
+def changes():
+    """
+    ?since=<cursor>&limit=<n> (max 1000): inserts, updates and deletes of
+    categories, expenses, income, budgets, goals and recurring items after
+    the cursor, oldest first. since=0 (the default) replays everything.
+    Keep the returned cursor and pass it as `since` next time.
+    """
+    try:
+        since = int(request.args.get("since", 0))
+        limit = int(request.args.get("limit", MAX_CHANGES))
+    except ValueError:
+        return jsonify(error="since and limit must be integers"), 400
+    items, cursor, has_more = changes_since(since, limit)
+    return jsonify(
+        changes=items,
+        cursor=cursor,
+        has_more=has_more,
+        next=url_for("api.changes", since=cursor, limit=limit) if has_more else None,
+    )
+
+
+@bp.get("/anomalies")
+@api_login_required
+def anomalies():
+    """Flagged expenses, newest first; ?all=1 includes dismissed ones."""
+    rows = list_anomalies(include_dismissed=request.args.get("all") == "1")
+    return jsonify(items=[
+        {
+            "id": a.id, "expense_id": a.expense_id, "date": a.date.isoformat(), "amount": float(a.amount),
+            "currency": a.currency, "base_amount": float(a.base_amount), "description": a.description or "",
+            "category": a.category, "score": a.score, "reason": a.reason, "dismissed": a.dismissed,
+        }
+        for a in rows
+    ])
+
+
+
+@bp.get("/events/stats")
+@api_login_required
+def event_stats():
+    """Queue depth and counters of the post-commit event bus (see events.py)."""
+    bus = current_app.extensions.get("events")
+    return jsonify(bus.stats() if bus else {})
+
+
+# amounts are Numeric(12, 2) columns
+MAX_AMOUNT = Decimal("9999999999.99")
+TEXT_FIELDS = ("category", "description", "currency", "source")
+
+def _json_fields(*required) -> dict:
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        raise ValueError("expected a JSON object")
+    missing = [f for f in required if body.get(f) in (None, "")]
+    if missing:
+        raise ValueError(f"missing {', '.join(missing)}")
+    for field in TEXT_FIELDS:
+        if body.get(field) is not None and not isinstance(body[field], str):
+            raise ValueError(f"{field} must be a string")
+    tags = body.get("tags")
+    if tags is not None and not (isinstance(tags, str)
+                                 or isinstance(tags, list) and all(isinstance(t, str) for t in tags)):
+        raise ValueError("tags must be a string or a list of strings")
+    account_id = body.get("account_id")
+    if account_id is not None and (isinstance(account_id, bool) or not isinstance(account_id, int)):
+        raise ValueError("account_id must be an integer")
+    if isinstance(body["amount"], bool) or not isinstance(body["amount"], (str, int, float)):
+        raise ValueError("amount must be a number or a numeric string")
+    try:
+        body["date"] = date.fromisoformat(body["date"])
+        body["amount"] = Decimal(str(body["amount"]))
+    except (TypeError, ValueError, InvalidOperation) as e:
+        raise ValueError(f"invalid date or amount: {e}")
+    if not body["amount"].is_finite() or abs(body["amount"]) > MAX_AMOUNT:
+        raise ValueError(f"amount must be a finite number of at most {MAX_AMOUNT}")
+    return body
+
+def _created(model, row_id: int):
+    resp = jsonify(transaction_json(transaction_row(model, row_id)))
+    resp.status_code = 201
+    return resp
+
+
+@bp.post("/expenses")
+@api_login_required
+@idempotent
+def create_expense():
+    """
+    JSON {date, amount, category, description?, currency?, tags?, account_id?}.
+    Send an Idempotency-Key header so a retried request returns the first
+    response instead of adding the expense twice.
+    """
+    try:
+        f = _json_fields("date", "amount", "category")
+        expense_id = write(lambda: add_expense(
+            f["date"], f["amount"], get_or_create_category(f["category"].strip()), f.get("description") or "",
+            tags=f.get("tags"), currency=f.get("currency"), account_id=f.get("account_id"),
+        ).id)
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    return _created(Expense, expense_id)
+
+@bp.post("/income")
+@api_login_required
+@idempotent
+def create_income():
+    """JSON {date, amount, source?, currency?, tags?, account_id?}; see create_expense."""
+    try:
+        f = _json_fields("date", "amount")
+        income_id = write(lambda: add_income(
+            f["amount"], f["date"], f.get("source") or "Other", tags=f.get("tags"), currency=f.get("currency"),
+            account_id=f.get("account_id"),
+        ).id)
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    return _created(Income, income_id)
@@ -0,0 +1,79 @@
+# Receipt / pay stub attachments (see attachments.py)
+import os
+from flask import Blueprint, abort, current_app, request, redirect, send_file, url_for, flash
+from models import Attachment, Expense, Income
+from attachments import (
+    store_root, store_stream, add_attachment, delete_attachment, sweep_store, object_path, thumbnail_path,
+    INLINE_TYPES,
+)
+from writequeue import write
+from idempotency import idempotent
+from blueprints.auth import login_required
+
+bp = Blueprint("attachments", __name__)
+
+
+def _upload(expense_id=None, income_id=None):
+    try:
+        upload = request.files["file"]
+        # streamed to the store here, in the request thread; only the row goes through the writer
+        sha256, size = store_stream(upload.stream, store_root(), current_app.config.get("ATTACHMENT_MAX_BYTES"))
+        write(add_attachment, sha256, size, upload.filename, upload.mimetype,
+              expense_id=expense_id, income_id=income_id)
+        current_app.extensions["thumbnails"].submit(store_root(), sha256, upload.mimetype)
+        flash("Attachment saved.", "success")
+    except Exception as e:
+        flash(f"Failed to save attachment: {e}", "error")
+    return redirect(request.referrer or url_for("expenses.expenses" if expense_id else "income.income"))
+
+@bp.post("/expenses/<int:id>/attachments")
+@login_required
+@idempotent
+def attach_to_expense(id):
+    Expense.query.get_or_404(id)
+    return _upload(expense_id=id)
+
+@bp.post("/income/<int:id>/attachments")
+@login_required
+@idempotent
+def attach_to_income(id):
+    Income.query.get_or_404(id)
+    return _upload(income_id=id)
+
+def _send(a: Attachment, path: str, mimetype: str):
+    if not os.path.exists(path):
+        abort(404)
+    # Range, If-None-Match and If-Modified-Since are handled by send_file
+    resp = send_file(path, mimetype=mimetype, download_name=a.filename, conditional=True,
+                     etag=a.sha256, max_age=3600, as_attachment=mimetype not in INLINE_TYPES)
+    resp.cache_control.private = True
+    resp.headers["X-Content-Type-Options"] = "nosniff"
+    return resp
+
+@bp.get("/attachments/<int:id>")
+@login_required
+def download(id):
+    a = Attachment.query.get_or_404(id)
+    return _send(a, object_path(store_root(), a.sha256), a.content_type)
+
+@bp.get("/attachments/<int:id>/thumbnail")
+@login_required
+def thumbnail(id):
+    a = Attachment.query.get_or_404(id)
+    return _send(a, thumbnail_path(store_root(), a.sha256), "image/jpeg")
+
+@bp.post("/attachments/<int:id>/delete")
+@login_required
+def remove(id):
+    write(delete_attachment, id)
+    flash("Attachment deleted.", "success")
+    return redirect(request.referrer or url_for("expenses.expenses"))
+
+@bp.post("/tasks/attachments/sweep")
+@login_required
+def sweep():
+    try:
+        flash(f"Removed {sweep_store(store_root())} unused files.", "success")
+    except Exception as e:
+        flash(f"Failed to sweep attachments: {e}", "error")
+    return redirect(request.referrer or url_for("expenses.expenses"))
@@ -0,0 +1,85 @@
+from functools import wraps
+from flask import Blueprint, current_app, render_template, request, redirect, url_for, flash, session
+
+bp = Blueprint("auth", __name__)
+
+
+def login_required(view_func):
+    @wraps(view_func)
+    def wrapped_view(*args, **kwargs):
+        if not session.get("logged_in"):
+            flash("Please log in first.", "error")
+            return redirect(url_for("auth.login"))
+        return view_func(*args, **kwargs)
+    return wrapped_view
+
+def admin_required(view_func):
+    # the bootstrap admin (whose data is the main database) manages the other users
+    @wraps(view_func)
+    def wrapped_view(*args, **kwargs):
+        if not session.get("logged_in") or session.get("shard") is not None:
+            flash("Only the administrator can do that.", "error")
+            return redirect(url_for("auth.login"))
+        return view_func(*args, **kwargs)
+    return wrapped_view
+
+def home_url():
+    # the dashboard when it is registered, otherwise the first feature page
+    for endpoint in ("report.view_report", "expenses.expenses", "income.income"):
+        if endpoint in current_app.view_functions:
+            return url_for(endpoint)
+    return url_for("auth.login")
+
+
+@bp.route("/login", methods=["GET", "POST"])
+def login():
+    if session.get("logged_in"):
+        return redirect(home_url())
+
+    if request.method == "POST":
+        # imported here so that importing app (for login_required) stays light
+        from shards import authenticate
+        from writequeue import write
+        username = (request.form.get("username") or "").strip()
+        password = request.form.get("password") or ""
+
+        user = write(authenticate, username, password)
+        if user is not None:
+            session.clear()
+            session["logged_in"] = True
+            session["username"] = user.username
+            session["user_id"] = user.id
+            # which database this user's requests are routed to (see shards.py)
+            session["shard"] = user.db_file
+            flash("Logged in successfully.", "success")
+            return redirect(home_url())
+        else:
+            flash("Invalid username or password.", "error")
+
+    return render_template("login.html")
+
+@bp.get("/logout")
+def logout():
+    session.clear()
+    flash("You have been logged out.", "success")
+    return redirect(url_for("auth.login"))
+
+@bp.route("/users", methods=["GET", "POST"])
+@admin_required
+def users():
+    from shards import all_users, create_user
+    from writequeue import write
+    if request.method == "POST":
+        username = request.form.get("username", "")
+        password = request.form.get("password", "")
+        try:
+            user = write(create_user, username, password)
+            flash(f"User {user.username} created.", "success")
+        except Exception as e:
+            flash(f"Failed to create user: {e}", "error")
+        return redirect(url_for("auth.users"))
+    return render_template("users.html", users=all_users())
+
+@bp.route("/")
+def index():
+    return redirect(home_url())
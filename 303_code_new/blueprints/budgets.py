@@ -0,0 +1,62 @@
+# US4: Budgeting
+from datetime import date
+from decimal import Decimal
+from flask import Blueprint, render_template, request, redirect, url_for, flash
+from models import Category
+from functions import all_categories, set_budget, month_key_from_date, budget_actuals, category_paths
+from queries import budget_rows
+from envelopes import envelope_balances, start_envelope, stop_envelope
+from writequeue import write
+from idempotency import idempotent
+from blueprints.auth import login_required
+
+bp = Blueprint("budgets", __name__)
+
+
+@bp.route("/budgets", methods=["GET", "POST"])
+@login_required
+@idempotent
+def budgets():
+    if request.method == "POST":
+        try:
+            # HTML month input like "2025-10"
+            month_str = request.form["month"]
+            y, m = map(int, month_str.split("-"))
+            key = month_key_from_date(date(y, m, 1))
+            amount = Decimal(request.form["amount"])
+            category_id = request.form.get("category_id") or None
+            write(lambda: set_budget(key, amount, Category.query.get(int(category_id)) if category_id else None))
+            flash("Budget saved.", "success")
+        except Exception as e:
+            flash(f"Failed to save budget: {e}", "error")
+        return redirect(url_for("budgets.budgets"))
+
+    items = budget_rows()
+    month = request.args.get("month") or month_key_from_date(date.today())
+    return render_template("budgets.html", items=items, categories=all_categories(),
+                           actuals=budget_actuals(items), paths=category_paths(),
+                           month=month, envelopes=envelope_balances(month))
+
+# =========================
+# Envelopes (rollover budgets)
+# =========================
+@bp.post("/budgets/envelopes")
+@login_required
+@idempotent
+def add_envelope():
+    try:
+        category_id = int(request.form["category_id"])
+        y, m = map(int, request.form["start"].split("-"))
+        write(start_envelope, category_id, month_key_from_date(date(y, m, 1)))
+        flash("Envelope started.", "success")
+    except Exception as e:
+        flash(f"Failed to start envelope: {e}", "error")
+    return redirect(url_for("budgets.budgets"))
+
+@bp.post("/budgets/envelopes/<int:category_id>/stop")
+@login_required
+@idempotent
+def remove_envelope(category_id):
+    write(stop_envelope, category_id)
+    flash("Envelope stopped; the category's budgets are monthly again.", "success")
+    return redirect(url_for("budgets.budgets"))
@@ -0,0 +1,90 @@
+# US2: Categorization
+from decimal import Decimal
+from flask import Blueprint, render_template, request, redirect, url_for, flash
+from models import Category, CategoryRule
+from functions import (
+    get_or_create_category, set_category_parent, category_paths,
+    add_category_rule, delete_category_rule, recategorize_uncategorized,
+)
+from writequeue import write
+from idempotency import idempotent
+from blueprints.auth import login_required
+
+bp = Blueprint("categories", __name__)
+
+
+@bp.route("/categories", methods=["GET", "POST"])
+@login_required
+@idempotent
+def categories():
+    if request.method == "POST":
+        name = (request.form.get("name") or "").strip()
+        parent_id = request.form.get("parent_id")
+        if not name:
+            flash("Category name cannot be empty.", "error")
+        else:
+            write(lambda: get_or_create_category(
+                name, parent=Category.query.get(int(parent_id)) if parent_id else None))
+            flash("Category added (or already exists).", "success")
+        return redirect(url_for("categories.categories"))
+    paths = category_paths()
+    return render_template(
+        "categories.html",
+        # tree order: every category right after its parent
+        items=sorted(Category.query.all(), key=lambda c: paths.get(c.id, c.name).lower().split(" > ")),
+        paths=paths,
+        rules=CategoryRule.query.order_by(CategoryRule.priority, CategoryRule.id).all(),
+    )
+
+@bp.post("/categories/<int:id>/parent")
+@login_required
+@idempotent
+def move_category(id):
+    try:
+        parent_id = request.form.get("parent_id")
+        write(lambda: set_category_parent(Category.query.get_or_404(id),
+                                          Category.query.get(int(parent_id)) if parent_id else None))
+        flash("Category moved.", "success")
+    except Exception as e:
+        flash(f"Failed to move category: {e}", "error")
+    return redirect(url_for("categories.categories"))
+
+# =========================
+# Auto-categorization rules
+# =========================
+@bp.post("/categories/rules")
+@login_required
+@idempotent
+def add_rule():
+    try:
+        f = request.form
+        category_name = f["category"]
+        min_amount = f.get("min_amount")
+        max_amount = f.get("max_amount")
+        rule = dict(
+            pattern=f.get("pattern"),
+            match_type=f.get("match_type") or "substring",
+            min_amount=Decimal(min_amount) if min_amount else None,
+            max_amount=Decimal(max_amount) if max_amount else None,
+            source=f.get("source"),
+            priority=int(f.get("priority") or 100),
+        )
+        write(lambda: add_category_rule(get_or_create_category(category_name), **rule))
+        flash("Rule added.", "success")
+    except Exception as e:
+        flash(f"Failed to add rule: {e}", "error")
+    return redirect(url_for("categories.categories"))
+
+@bp.get("/categories/rules/<int:id>/delete")
+@login_required
+def delete_rule(id):
+    write(delete_category_rule, id)
+    flash("Rule deleted.", "success")
+    return redirect(url_for("categories.categories"))
+
+@bp.get("/tasks/categorize")
+@login_required
+def run_categorize_task():
+    moved = write(recategorize_uncategorized)
+    flash(f"Categorized {moved} expenses.", "success")
+    return redirect(url_for("categories.categories"))
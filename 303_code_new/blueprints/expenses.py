@@ -0,0 +1,106 @@
+# US1: Expense Tracking
+import io
+from datetime import datetime
+from decimal import Decimal
+from flask import Blueprint, Response, render_template, request, redirect, url_for, flash, stream_with_context
+from models import Expense
+from functions import (
+    all_categories, get_or_create_category, add_expense, delete_expense,
+    import_expenses_csv, find_duplicate_clusters, set_tags, export_csv,
+)
+from tags import all_tags
+from fx import currencies
+from accounts import all_accounts
+from attachments import attachments_for
+from queries import TransactionFilter, empty_filter, query_transactions
+from writequeue import write
+from idempotency import idempotent
+from blueprints.auth import login_required
+
+bp = Blueprint("expenses", __name__)
+
+
+@bp.route("/expenses", methods=["GET", "POST"])
+@login_required
+@idempotent
+def expenses():
+    if request.method == "POST":
+        try:
+            when = datetime.strptime(request.form["date"], "%Y-%m-%d").date()
+            amount = Decimal(request.form["amount"])
+            category_name = request.form["category"].strip()
+            desc = (request.form.get("description") or "").strip()
+            allow_duplicate = bool(request.form.get("allow_duplicate"))
+            tags = request.form.get("tags")
+            currency = request.form.get("currency")
+            account_id = request.form.get("account_id", type=int)
+            write(lambda: add_expense(when, amount, get_or_create_category(category_name), desc,
+                                      allow_duplicate=allow_duplicate, tags=tags, currency=currency,
+                                      account_id=account_id))
+            flash("Expense added.", "success")
+        except Exception as e:
+            flash(f"Failed to add expense: {e}", "error")
+        return redirect(url_for("expenses.expenses"))
+
+    try:
+        filters = TransactionFilter.from_args(request.args, "expense")
+    except ValueError as e:
+        flash(f"Invalid filter: {e}", "error")
+        filters = empty_filter("expense")
+    # the pager only needs the (estimated) count; exact count and total on request
+    result = query_transactions(filters, page=request.args.get("page", 1, type=int),
+                                with_totals=request.args.get("totals") == "1")
+    return render_template("expenses.html", items=result.items, result=result, filters=filters,
+                           categories=all_categories(), tags=all_tags(), currencies=currencies(),
+                           accounts=all_accounts(), attachments=attachments_for("expense", (e.id for e in result.items)))
+
+@bp.post("/expenses/<int:id>/tags")
+@login_required
+def expense_tags_route(id):
+    Expense.query.get_or_404(id)
+    tags = request.form.get("tags")
+    write(lambda: set_tags(Expense.query.get(id), tags))
+    flash("Tags saved.", "success")
+    return redirect(request.referrer or url_for("expenses.expenses"))
+
+@bp.get("/expenses/export")
+@login_required
+def export_expenses():
+    try:
+        filters = TransactionFilter.from_args(request.args, "expense")
+    except ValueError as e:
+        flash(f"Invalid filter: {e}", "error")
+        return redirect(url_for("expenses.expenses"))
+    chunks = export_csv(filters)
+    return Response(stream_with_context(chunks), mimetype="text/csv",
+                    headers={"Content-Disposition": "attachment; filename=expenses.csv"})
+
+@bp.get("/expenses/<int:id>/delete")
+@login_required
+def delete_expense_route(id):
+    write(delete_expense, id)
+    flash("Expense deleted.", "success")
+    return redirect(url_for("expenses.expenses"))
+
+@bp.post("/expenses/import")
+@login_required
+@idempotent
+def import_expenses_route():
+    try:
+        # read up front: a write-queue retry has to be able to parse it again
+        text = request.files["file"].stream.read().decode("utf-8-sig")
+        source = request.form.get("source")
+        account_id = request.form.get("account_id", type=int)
+        result = write(lambda: import_expenses_csv(io.StringIO(text, newline=""), source=source,
+                                                   account_id=account_id))
+        flash(f"Imported {result['imported']} expenses "
+              f"({result['auto_categorized']} categorized by rules, "
+              f"{result['duplicates']} duplicates skipped).", "success")
+    except Exception as e:
+        flash(f"Failed to import expenses: {e}", "error")
+    return redirect(url_for("expenses.expenses"))
+
+@bp.get("/duplicates")
+@login_required
+def duplicates():
+    return render_template("duplicates.html", clusters=find_duplicate_clusters())
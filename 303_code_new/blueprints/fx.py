@@ -0,0 +1,61 @@
+# Multi-currency: FX rates and re-conversion (see fx.py)
+import io
+from datetime import datetime
+from decimal import Decimal
+from flask import Blueprint, render_template, request, redirect, url_for, flash
+from models import FxRate
+from fx import import_fx_rates, set_fx_rate, reconvert, normalize_currency
+from writequeue import write
+from idempotency import idempotent
+from blueprints.auth import login_required
+
+bp = Blueprint("fx", __name__)
+
+
+def _save_and_reconvert(save, *args):
+    saved = save(*args)
+    return saved, reconvert(saved["since"])
+
+def _flash_result(saved, updated):
+    flash(f"Saved {saved['rates']} rates; re-converted {updated['expense']} expenses "
+          f"and {updated['income']} income rows.", "success")
+
+
+@bp.route("/fx", methods=["GET", "POST"])
+@login_required
+@idempotent
+def fx():
+    if request.method == "POST":
+        try:
+            when = datetime.strptime(request.form["date"], "%Y-%m-%d").date()
+            currency = normalize_currency(request.form["currency"])
+            rate = Decimal(request.form["rate"])
+            _flash_result(*write(_save_and_reconvert, set_fx_rate, currency, when, rate))
+        except Exception as e:
+            flash(f"Failed to save rate: {e}", "error")
+        return redirect(url_for("fx.fx"))
+    rates = FxRate.query.order_by(FxRate.currency, FxRate.date.desc()).limit(500).all()
+    return render_template("fx.html", rates=rates)
+
+@bp.post("/fx/import")
+@login_required
+@idempotent
+def import_rates():
+    try:
+        # read here: the upload stream belongs to the request, not the writer thread
+        text = io.TextIOWrapper(request.files["file"].stream, encoding="utf-8-sig", newline="").read()
+        _flash_result(*write(_save_and_reconvert, import_fx_rates, io.StringIO(text)))
+    except Exception as e:
+        flash(f"Failed to import rates: {e}", "error")
+    return redirect(url_for("fx.fx"))
+
+@bp.post("/fx/reconvert")
+@login_required
+@idempotent
+def reconvert_all():
+    try:
+        updated = write(reconvert)
+        flash(f"Re-converted {updated['expense']} expenses and {updated['income']} income rows.", "success")
+    except Exception as e:
+        flash(f"Failed to re-convert: {e}", "error")
+    return redirect(url_for("fx.fx"))
@@ -0,0 +1,49 @@
+# US5: Savings Goal
+from datetime import date
+from decimal import Decimal
+from flask import Blueprint, render_template, request, redirect, url_for, flash
+from functions import create_savings_goal, goal_progress_for_month
+from writequeue import write
+from idempotency import idempotent
+from blueprints.auth import login_required
+
+bp = Blueprint("goals", __name__)
+
+
+@bp.route("/goals", methods=["GET", "POST"])
+@login_required
+@idempotent
+def goals():
+    # choose which year/month to look at (default: current)
+    today = date.today()
+    year = int(request.args.get("year", today.year))
+    month = int(request.args.get("month", today.month))
+
+    # Handle form submit: create/update savings goal
+    if request.method == "POST":
+        name = (request.form.get("name") or "").strip()
+        target_amount_str = request.form.get("target_amount") or "0"
+
+        try:
+            target_amount = Decimal(target_amount_str)
+            write(create_savings_goal, name, target_amount)
+            flash("Savings goal saved.", "success")
+        except Exception as e:
+            flash(f"Failed to save savings goal: {e}", "error")
+
+        # redirect so refresh doesn't resubmit the form
+        return redirect(url_for("goals.goals", year=year, month=month))
+
+    # For GET: compute progress for this month
+    progress = goal_progress_for_month(year, month)
+
+    return render_template(
+        "goals.html",
+        year=year,
+        month=month,
+        active_goal=progress["goal"],
+        target=progress["target"],
+        current_savings=progress["current_savings"],
+        percent=progress["percent"],
+        reached=progress["reached"],
+    )
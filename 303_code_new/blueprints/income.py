@@ -0,0 +1,66 @@
+# US3: Income Tracking
+from datetime import datetime
+from decimal import Decimal
+from flask import Blueprint, Response, render_template, request, redirect, url_for, flash, stream_with_context
+from models import Income
+from functions import add_income, set_tags, export_csv
+from tags import all_tags
+from fx import currencies
+from accounts import all_accounts
+from attachments import attachments_for
+from queries import TransactionFilter, empty_filter, query_transactions
+from writequeue import write
+from idempotency import idempotent
+from blueprints.auth import login_required
+
+bp = Blueprint("income", __name__)
+
+
+@bp.route("/income", methods=["GET", "POST"])
+@login_required
+@idempotent
+def income():
+    if request.method == "POST":
+        try:
+            when = datetime.strptime(request.form["date"], "%Y-%m-%d").date()
+            amount = Decimal(request.form["amount"])
+            source = (request.form.get("source") or "Other").strip()
+            write(add_income, amount=amount, when=when, source=source, tags=request.form.get("tags"),
+                  currency=request.form.get("currency"), account_id=request.form.get("account_id", type=int))
+            flash("Income added.", "success")
+        except Exception as e:
+            flash(f"Failed to add income: {e}", "error")
+        return redirect(url_for("income.income"))
+
+    try:
+        filters = TransactionFilter.from_args(request.args, "income")
+    except ValueError as e:
+        flash(f"Invalid filter: {e}", "error")
+        filters = empty_filter("income")
+    # the pager only needs the (estimated) count; exact count and total on request
+    result = query_transactions(filters, page=request.args.get("page", 1, type=int),
+                                with_totals=request.args.get("totals") == "1")
+    return render_template("income.html", items=result.items, result=result, filters=filters, tags=all_tags(),
+                           currencies=currencies(), accounts=all_accounts(),
+                           attachments=attachments_for("income", (i.id for i in result.items)))
+
+@bp.post("/income/<int:id>/tags")
+@login_required
+def income_tags_route(id):
+    Income.query.get_or_404(id)
+    tags = request.form.get("tags")
+    write(lambda: set_tags(Income.query.get(id), tags))
+    flash("Tags saved.", "success")
+    return redirect(request.referrer or url_for("income.income"))
+
+@bp.get("/income/export")
+@login_required
+def export_income():
+    try:
+        filters = TransactionFilter.from_args(request.args, "income")
+    except ValueError as e:
+        flash(f"Invalid filter: {e}", "error")
+        return redirect(url_for("income.income"))
+    chunks = export_csv(filters)
+    return Response(stream_with_context(chunks), mimetype="text/csv",
+                    headers={"Content-Disposition": "attachment; filename=income.csv"})
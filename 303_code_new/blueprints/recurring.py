@@ -0,0 +1,126 @@
+# US8: Recurring (subscriptions/bills & paychecks)
+from datetime import datetime
+from decimal import Decimal
+from flask import Blueprint, render_template, request, redirect, url_for, flash
+from database import commit
+from models import RecurringItem
+from functions import (
+    all_categories, get_or_create_category,
+    add_recurring_item, post_due_recurring, _advance_date, _post_single,
+)
+from accounts import all_accounts
+from recurring_mining import mine_recurring_candidates, accept_recurring_candidate
+from writequeue import write
+from idempotency import idempotent
+from blueprints.auth import login_required
+
+bp = Blueprint("recurring", __name__)
+
+
+@bp.route("/recurring", methods=["GET", "POST"])
+@login_required
+@idempotent
+def recurring():
+    if request.method == "POST":
+        try:
+            name = (request.form.get("name") or "").strip()
+            kind = request.form.get("kind")             # "expense" | "income"
+            amount = Decimal(request.form["amount"])
+            start_date = datetime.strptime(request.form["start_date"], "%Y-%m-%d").date()
+            freq = request.form.get("freq")
+            every_n_days = int(request.form["every_n_days"]) if request.form.get("every_n_days") else None
+            day_of_month = int(request.form["day_of_month"]) if request.form.get("day_of_month") else None
+            end_date = datetime.strptime(request.form["end_date"], "%Y-%m-%d").date() if request.form.get("end_date") else None
+            auto_post = bool(request.form.get("auto_post"))
+            notes = (request.form.get("notes") or "").strip()
+            account_id = request.form.get("account_id", type=int)
+
+            # category/income source
+            cat_name = (request.form.get("category") or "General").strip()
+            income_source = None
+            if kind != "expense":
+                income_source = (request.form.get("income_source") or "Recurring").strip()
+
+            write(lambda: add_recurring_item(
+                name=name, kind=kind, amount=amount,
+                category_id=get_or_create_category(cat_name).id if kind == "expense" else None,
+                income_source=income_source,
+                freq=freq, every_n_days=every_n_days, day_of_month=day_of_month,
+                start_date=start_date, next_run_date=start_date,
+                end_date=end_date, auto_post=auto_post, active=True, notes=notes,
+                account_id=account_id,
+            ))
+            flash("Recurring item saved.", "success")
+        except Exception as e:
+            flash(f"Failed to save recurring item: {e}", "error")
+        return redirect(url_for("recurring.recurring"))
+
+    items = RecurringItem.query.order_by(RecurringItem.next_run_date.asc()).all()
+    return render_template("recurring.html", items=items, categories=all_categories(), accounts=all_accounts())
+
+def _toggle(id):
+    it = RecurringItem.query.get(id)
+    it.active = not it.active
+    commit()
+
+def _run_now(id):
+    it = RecurringItem.query.get(id)
+    _post_single(it, when=it.next_run_date)
+    it.next_run_date = _advance_date(it.next_run_date, it.freq, it.every_n_days, it.day_of_month)
+    commit()
+
+@bp.get("/recurring/<int:id>/toggle")
+@login_required
+@idempotent
+def recurring_toggle(id):
+    RecurringItem.query.get_or_404(id)
+    write(_toggle, id)
+    flash("Recurring item toggled.", "success")
+    return redirect(url_for("recurring.recurring"))
+
+@bp.get("/recurring/<int:id>/run")
+@login_required
+@idempotent
+def recurring_run_now(id):
+    RecurringItem.query.get_or_404(id)
+    write(_run_now, id)
+    flash("Recurring item posted.", "success")
+    return redirect(url_for("recurring.recurring"))
+
+@bp.get("/tasks/run-recurring")
+@login_required
+def run_recurring_task():
+    count = write(post_due_recurring)
+    flash(f"Posted {count} due recurring items.", "success")
+    return redirect(url_for("recurring.recurring"))
+
+@bp.route("/recurring/suggestions", methods=["GET", "POST"])
+@login_required
+@idempotent
+def recurring_suggestions():
+    if request.method == "POST":
+        try:
+            f = request.form
+            candidate = {
+                "name": f["name"].strip(),
+                "kind": f["kind"],
+                "amount": Decimal(f["amount"]),
+                "freq": f["freq"],
+                "every_n_days": int(f["every_n_days"]) if f.get("every_n_days") else None,
+                "category_id": int(f["category_id"]) if f.get("category_id") else None,
+                "income_source": f.get("income_source") or None,
+                "next_run_date": datetime.strptime(f["next_run_date"], "%Y-%m-%d").date(),
+                "occurrences": int(f.get("occurrences") or 0),
+            }
+            write(accept_recurring_candidate, candidate, auto_post=bool(f.get("auto_post")))
+            flash("Recurring item added from suggestion.", "success")
+        except Exception as e:
+            flash(f"Failed to add suggestion: {e}", "error")
+        return redirect(url_for("recurring.recurring_suggestions"))
+
+    min_confidence = float(request.args.get("min_confidence", 0.5))
+    return render_template(
+        "recurring_suggestions.html",
+        candidates=mine_recurring_candidates(min_confidence=min_confidence),
+        min_confidence=min_confidence,
+    )
@@ -0,0 +1,275 @@
+# Report (US1–US4 summary)
+#
+# /report only renders the page shell. Each chart fetches its own panel from
+# /report/data/<panel> in parallel, so the slowest aggregate no longer holds
+# back the first paint.
+import itertools
+import threading
+import time
+from collections import OrderedDict
+from datetime import date
+from flask import Blueprint, abort, current_app, jsonify, render_template, request, redirect, url_for, flash
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from models import Expense
+from database import current_shard
+from events import on, ExpenseAdded, ExpenseDeleted, IncomeAdded, BudgetSet
+from queries import budget_rows, recent_expenses
+from tags import TagFilter, NO_TAG_FILTER, tag_totals
+from functions import (
+    month_bounds, month_key_from_date,
+    monthly_spend_by_category, spend_by_subtree, monthly_total_spend,
+    monthly_total_income, monthly_trend, daily_totals, all_categories,
+    archive_cutoff, archive_transactions,
+)
+from writequeue import write
+from idempotency import idempotent
+from blueprints.auth import login_required
+
+bp = Blueprint("report", __name__)
+
+
+def _year_month():
+    today = date.today()
+    return int(request.args.get("year", today.year)), int(request.args.get("month", today.month))
+
+def _tag_filter():
+    return TagFilter.from_args(request.args)
+
+@bp.route("/report", methods=["GET"])
+@login_required
+def view_report():
+    year, month = _year_month()
+    tag_filter = _tag_filter()
+
+    # Get recent expenses for activity feed
+    start, end = month_bounds(year, month)
+    return render_template(
+        "report.html",
+        year=year,
+        month=month,
+        recent_expenses=recent_expenses(start, end),
+        tag_filter=tag_filter,
+        panels={name: url_for("report.panel_data", panel=name, year=year, month=month, **tag_filter.query_args())
+                for name in PANELS} | {"heatmap": url_for("report.heatmap_data", year=year)},
+        categories=all_categories(),
+    )
+
+
+# =========================
+# Chart panels
+# =========================
+# Panels take the report's tag filter; budgets are per category and ignore it.
+def _categories_panel(year, month, tags):
+    # subcategories are rolled up into their top-level category
+    return [{"category": row.category, "spent": float(row.spent)}
+            for row in monthly_spend_by_category(year, month, level=0, tag_filter=tags)]
+
+def _summary_panel(year, month, tags):
+    total_income = monthly_total_income(year, month, tag_filter=tags)
+    total_spend = monthly_total_spend(year, month, tag_filter=tags)
+    return {"total_income": total_income, "total_spend": total_spend, "net": total_income - total_spend}
+
+def _trends_panel(year, month, tags):
+    return monthly_trend(year, month, months=6, tag_filter=tags)
+
+def _tags_panel(year, month, tags):
+    start, end = month_bounds(year, month)
+    return [{"tag": name, "spent": total, "count": count}
+            for name, total, count in tag_totals(Expense, start, end, tags)]
+
+def _budgets_panel(year, month, tags):
+    month_key = month_key_from_date(date(year, month, 1))
+    budgets_list = budget_rows(month_key)
+    if not budgets_list:
+        return []
+    # a budget on a category covers its subcategories too
+    spent = spend_by_subtree(year, month, [b.category_id for b in budgets_list if b.category_id])
+    budget_data = []
+    for budget in budgets_list:
+        if budget.category_id:
+            budget_data.append({
+                "category": budget.category,
+                "budget": float(budget.amount),
+                "actual": spent.get(budget.category_id, 0.0)
+            })
+        else:
+            # Overall budget
+            budget_data.append({
+                "category": "Overall",
+                "budget": float(budget.amount),
+                "actual": _cached_panel("summary", year, month)["total_spend"]
+            })
+    return budget_data
+
+PANELS = {
+    "categories": _categories_panel,
+    "summary": _summary_panel,
+    "trends": _trends_panel,
+    "budgets": _budgets_panel,
+    "tags": _tags_panel,
+}
+
+# Per-app cache of (user database, panel, year, month, tags) -> (generation, computed_at, payload).
+# A commit that changed data bumps the generation of its user database;
+# commits that wrote nothing or only bookkeeping tables (idempotency keys,
+# users) do not. The TTL bounds staleness from writes made by other worker
+# processes.
+UNKNOWN_TABLE = "*"   # a statement whose target we can't tell, e.g. text()
+BOOKKEEPING_TABLES = frozenset({"idempotency_keys", "users"})
+_commits = itertools.count(1)
+_generations = {}   # user database -> generation
+
+def _generation() -> int:
+    return _generations.get(current_shard(), 0)
+
+def _note_tables(session, *tables):
+    session.info.setdefault("changed_tables", set()).update(tables)
+
+@event.listens_for(Session, "after_flush")
+def _note_flushed(session, flush_context):
+    _note_tables(session, *(obj.__table__.name for obj in (*session.new, *session.dirty, *session.deleted)))
+
+@event.listens_for(Session, "do_orm_execute")
+def _note_executed(state):
+    if state.is_insert or state.is_update or state.is_delete:
+        _note_tables(state.session, state.statement.table.name)
+    elif not state.is_select:
+        _note_tables(state.session, UNKNOWN_TABLE)
+
+# inserted first, so event handlers delivered on this commit (events.py)
+# already see the new generation and their warmed panels stay valid
+@event.listens_for(Session, "after_commit", insert=True)
+def _invalidate_panels(session):
+    if session.in_nested_transaction():
+        return    # a write-queue job's SAVEPOINT; the batch commits later
+    tables = session.info.pop("changed_tables", set())
+    # the write queue commits batches whose jobs wrote nothing
+    if tables <= BOOKKEEPING_TABLES:
+        return
+    _generations[current_shard()] = next(_commits)
+
+@event.listens_for(Session, "after_soft_rollback")
+def _forget_tables(session, previous_transaction):
+    # a savepoint rolled back inside a write-queue batch keeps what the other jobs noted
+    if not previous_transaction.nested:
+        session.info.pop("changed_tables", None)
+
+class PanelCache:
+    """
+    LRU of at most `size` panels. Keys start with the user database; entries
+    of an older generation than that database's are dropped, not kept.
+    """
+
+    def __init__(self, size: int = 256):
+        self.size = size
+        self.stats = {"hits": 0, "misses": 0}
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, generation, ttl):
+        with self._lock:
+            hit = self._entries.get(key)
+            if hit is not None and hit[0] == generation and time.monotonic() - hit[1] < ttl:
+                self._entries.move_to_end(key)
+                self.stats["hits"] += 1
+                return hit
+            if hit is not None:
+                del self._entries[key]
+            self.stats["misses"] += 1
+            return None
+
+    def put(self, key, generation, payload) -> None:
+        with self._lock:
+            for stale in [k for k, hit in self._entries.items() if k[0] == key[0] and hit[0] != generation]:
+                del self._entries[stale]
+            self._entries[key] = (generation, time.monotonic(), payload)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+def _panel_cache() -> PanelCache:
+    cache = current_app.extensions.get("report_panels")
+    if cache is None:
+        cache = current_app.extensions.setdefault(
+            "report_panels", PanelCache(current_app.config.get("REPORT_CACHE_ENTRIES", 256)))
+    return cache
+
+def _cached(key, compute):
+    cache = _panel_cache()
+    ttl = current_app.config["REPORT_CACHE_SECONDS"]
+    key = (current_shard(),) + key
+    generation = _generation()
+    hit = cache.get(key, generation, ttl)
+    if hit:
+        return hit[2]
+    payload = compute()
+    # a commit while computing means the payload may already be out of date
+    if generation == _generation():
+        cache.put(key, generation, payload)
+    return payload
+
+def _cached_panel(panel, year, month, tags=NO_TAG_FILTER):
+    return _cached((panel, year, month, tags), lambda: PANELS[panel](year, month, tags))
+
+def _conditional_json(payload):
+    resp = jsonify(payload)
+    # let the browser revalidate cheaply instead of re-downloading
+    resp.cache_control.private = True
+    resp.cache_control.no_cache = True
+    resp.add_etag()
+    return resp.make_conditional(request)
+
+def _event_month(ev):
+    if isinstance(ev, BudgetSet):
+        year, month = map(int, ev.month_key.split("-"))
+        return year, month
+    return ev.date.year, ev.date.month
+
+@on(ExpenseAdded, ExpenseDeleted, IncomeAdded, BudgetSet, background=True, coalesce=_event_month)
+def _warm_panels(events):
+    # after a write, recompute that month's untagged panels on the event
+    # workers, so the next dashboard load is a cache hit instead of a recompute
+    for year, month in {_event_month(e) for e in events}:
+        for panel in ("summary", "categories", "budgets"):
+            _cached_panel(panel, year, month)
+
+@bp.get("/report/data/<panel>")
+@login_required
+def panel_data(panel):
+    if panel not in PANELS:
+        abort(404)
+    year, month = _year_month()
+    return _conditional_json(_cached_panel(panel, year, month, _tag_filter()))
+
+@bp.get("/report/data/heatmap")
+@login_required
+def heatmap_data():
+    """
+    ?year=&category_id=: daily spend (and, without a category, income) of a
+    year as arrays indexed by day of year, starting at `start` (Jan 1).
+    """
+    year = request.args.get("year", date.today().year, type=int)
+    category_id = request.args.get("category_id", type=int)
+
+    def compute():
+        return {
+            "year": year,
+            "start": date(year, 1, 1).isoformat(),
+            "spend": daily_totals(year, "expense", category_id),
+            "income": daily_totals(year, "income") if category_id is None else None,
+        }
+    return _conditional_json(_cached(("heatmap", year, category_id), compute))
+
+
+@bp.post("/tasks/archive")
+@login_required
+@idempotent
+def run_archive_task():
+    cutoff = archive_cutoff(current_app.config["ARCHIVE_AFTER_MONTHS"])
+    moved = write(archive_transactions, cutoff)
+    flash(f"Archived {moved['expenses']} expenses and {moved['income']} income entries before {cutoff}.", "success")
+    return redirect(url_for("report.view_report"))
@@ -0,0 +1,176 @@
+"""
+Rule-based auto-categorization.
+
+All substring rules are folded into one trie and emitted as a single
+regular expression inside a lookahead, so one pass of the C regex engine
+finds the longest literal starting at every position, overlapping ones
+included. Every literal that is a prefix of such a hit matches there too
+("uber" inside "uber eats"), so each literal maps to the rules of all its
+prefixes. Regex rules are compiled one by one (so backreferences, inline
+flags and named groups behave as written) and each is searched on its own.
+
+A rule matches when every condition it sets holds: description pattern,
+amount range (inclusive) and import source. Rules without a pattern are
+checked for every description. The lowest priority number wins; among equal
+priorities a longer substring beats a shorter one ("uber eats" over "uber"),
+then the older rule wins.
+"""
+import re
+from collections import namedtuple
+from flask import current_app, has_app_context
+from sqlalchemy import event, func
+from sqlalchemy.orm import Session
+from database import db, current_shard
+from models import CategoryRule
+
+# a compiled rule; amounts are floats, source is lower-cased
+Rule = namedtuple("Rule", "id category_id match_type pattern min_amount max_amount source priority")
+
+
+def _trie_pattern(words) -> str:
+    trie = {}
+    for word in words:
+        node = trie
+        for ch in word:
+            node = node.setdefault(ch, {})
+        node[""] = True
+
+    def build(node):
+        branches = [re.escape(ch) + build(child) for ch, child in sorted(node.items()) if ch]
+        if not branches:
+            return ""
+        if len(branches) == 1 and "" not in node:
+            return branches[0]
+        group = "(?:" + "|".join(branches) + ")"
+        # optional tail, tried first, so the longest literal wins
+        return group + "?" if "" in node else group
+
+    return build(trie)
+
+
+def _rank(rule):
+    specificity = -len(rule.pattern) if rule.match_type == "substring" and rule.pattern else 0
+    return rule.priority, specificity, rule.id
+
+
+def _compile(pattern: str):
+    return re.compile(pattern, re.IGNORECASE)
+
+
+class RuleMatcher:
+    def __init__(self, rules):
+        rules = sorted(rules, key=_rank)
+        self.rules = rules
+        literal_rules = {}         # lower-cased literal -> [rule, ...]
+        self._regex_rules = []     # (compiled pattern, rule)
+        self._always = []          # rules without a pattern
+        for rule in rules:
+            if not rule.pattern:
+                self._always.append(rule)
+            elif rule.match_type == "regex":
+                self._regex_rules.append((_compile(rule.pattern), rule))
+            else:
+                literal_rules.setdefault(rule.pattern.lower(), []).append(rule)
+        # longest literal at a position -> rules of it and of every literal that is its prefix
+        self._literal_rules = {
+            lit: [r for other, found in literal_rules.items() if lit.startswith(other) for r in found]
+            for lit in literal_rules
+        }
+        self._literals = re.compile(f"(?=({_trie_pattern(literal_rules)}))") if literal_rules else None
+        self._plain = not any(r.min_amount is not None or r.max_amount is not None or r.source for r in rules)
+
+    @classmethod
+    def from_models(cls, rows):
+        return cls(
+            Rule(
+                r.id, r.category_id, r.match_type, r.pattern,
+                float(r.min_amount) if r.min_amount is not None else None,
+                float(r.max_amount) if r.max_amount is not None else None,
+                r.source.strip().lower() if r.source else None,
+                r.priority,
+            )
+            for r in rows
+        )
+
+    def classify(self, description: str, amount: float | None = None, source: str | None = None) -> int | None:
+        """Category id of the best matching rule, or None."""
+        candidates = []
+        text = description or ""
+        if self._literals is not None:
+            literal_rules = self._literal_rules
+            for hit in set(self._literals.findall(text.lower())):
+                candidates += literal_rules[hit]
+        for pattern, rule in self._regex_rules:
+            if pattern.search(text):
+                candidates.append(rule)
+        if self._always:
+            candidates += self._always
+        if not candidates:
+            return None
+        if len(candidates) > 1:
+            candidates.sort(key=_rank)
+        if self._plain:
+            return candidates[0].category_id
+
+        source = source.strip().lower() if source else None
+        for rule in candidates:
+            if rule.min_amount is not None and (amount is None or amount < rule.min_amount):
+                continue
+            if rule.max_amount is not None and (amount is None or amount > rule.max_amount):
+                continue
+            if rule.source and rule.source != source:
+                continue
+            return rule.category_id
+        return None
+
+    def classify_many(self, items) -> list:
+        """Classify (description, amount, source) tuples in bulk."""
+        classify = self.classify
+        return [classify(desc, amount, source) for desc, amount, source in items]
+
+
+def validate_rule(match_type: str, pattern: str | None) -> None:
+    if match_type not in ("substring", "regex"):
+        raise ValueError(f"Unknown match type: {match_type}")
+    if match_type == "regex" and pattern:
+        try:
+            _compile(pattern)
+        except re.error as e:
+            raise ValueError(f"Invalid regex: {e}") from e
+
+def rules_changed() -> None:
+    """Called by rule writers: drop this user's matcher once the transaction commits."""
+    db.session.info["rules_changed"] = True
+
+@event.listens_for(Session, "after_commit")
+def _forget_matcher(session):
+    # a write-queue job's SAVEPOINT is not the commit yet
+    if session.in_nested_transaction() or not session.info.pop("rules_changed", False):
+        return
+    if has_app_context():
+        current_app.extensions.get("category_rules", {}).pop(current_shard(), None)
+
+@event.listens_for(Session, "after_soft_rollback")
+def _keep_matcher(session, previous_transaction):
+    if not previous_transaction.nested:
+        session.info.pop("rules_changed", None)
+
+def load_rule_matcher() -> RuleMatcher:
+    """
+    Compiled matcher for the current rules, rebuilt only when they change:
+    after a rule write in this process commits (rules_changed), or when the
+    rule ids (count, max, sum) show another process changed them. SQLite
+    reuses the rowid of a deleted newest rule, so the ids alone can miss a
+    replacement.
+    """
+    signature = db.session.query(
+        func.count(CategoryRule.id), func.max(CategoryRule.id), func.total(CategoryRule.id)
+    ).one()
+    # one matcher per user database (see shards.py)
+    cache = current_app.extensions.setdefault("category_rules", {})
+    cached = cache.get(current_shard())
+    if cached and cached[0] == tuple(signature):
+        return cached[1]
+    matcher = RuleMatcher.from_models(CategoryRule.query.all())
+    cache[current_shard()] = (tuple(signature), matcher)
+    return matcher
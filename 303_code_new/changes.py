@@ -0,0 +1,113 @@
+"""
+Change log for delta sync (GET /api/v1/changes).
+
+Every insert, update and delete of the synced tables (models.SYNCED_MODELS)
+appends a ChangeLog row in the same transaction as the change, so a rolled
+back write leaves no entry. ORM writes are picked up by an after_flush hook;
+helpers that write with bulk statements call log_changes() with the ids they
+touch. The log id is the sync cursor: a client keeps the last cursor it saw
+and asks for what came after it, so a sync costs in proportion to the changes
+since then, not to the size of the tables.
+
+Within one page, several entries for the same row collapse into the last
+one, and inserts/updates carry the row as it is now.
+"""
+from datetime import date, datetime
+from decimal import Decimal
+from sqlalchemy import event, insert, literal, select
+from sqlalchemy.orm import Session
+from database import db
+from models import ChangeLog, SYNCED_MODELS
+
+MODELS = {m.__tablename__: m for m in SYNCED_MODELS}
+MAX_CHANGES = 1000
+
+
+@event.listens_for(Session, "after_flush")
+def _record_flushed_changes(session, flush_context):
+    rows = []
+    for op, objs in (("insert", session.new), ("update", session.dirty), ("delete", session.deleted)):
+        for obj in objs:
+            if isinstance(obj, SYNCED_MODELS) and (op != "update" or session.is_modified(obj)):
+                rows.append({"table_name": obj.__tablename__, "row_id": obj.id, "op": op})
+    if rows:
+        session.connection().execute(insert(ChangeLog), rows)
+
+def log_changes(model, op: str, ids) -> None:
+    """Log `op` for rows written with a bulk statement: `ids` is a list of ids or a SELECT of them."""
+    if isinstance(ids, (list, tuple, set)):
+        if ids:
+            db.session.execute(insert(ChangeLog), [
+                {"table_name": model.__tablename__, "row_id": i, "op": op} for i in ids
+            ])
+        return
+    ids = ids.subquery()
+    db.session.execute(insert(ChangeLog).from_select(
+        ["table_name", "row_id", "op"],
+        select(literal(model.__tablename__), ids.c[0], literal(op)),
+    ))
+
+
+def _jsonable(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    return value
+
+def row_json(obj) -> dict:
+    data = {attr.key: _jsonable(getattr(obj, attr.key)) for attr in db.inspect(obj).mapper.column_attrs}
+    if hasattr(obj, "tags"):
+        data["tags"] = [t.name for t in obj.tags]
+    return data
+
+def latest_cursor() -> int:
+    return db.session.scalar(select(db.func.max(ChangeLog.id))) or 0
+
+def changes_since(cursor: int, limit: int = MAX_CHANGES) -> tuple:
+    """
+    ([change, ...], next cursor, has_more) for log entries after `cursor`.
+    A change is {"cursor", "table", "id", "op", "data"}; data is the current
+    row for inserts/updates and None for deletes.
+    """
+    limit = max(1, min(limit, MAX_CHANGES))
+    entries = db.session.execute(
+        select(ChangeLog.id, ChangeLog.table_name, ChangeLog.row_id, ChangeLog.op)
+        .where(ChangeLog.id > cursor)
+        .order_by(ChangeLog.id)
+        .limit(limit + 1)
+    ).all()
+    has_more = len(entries) > limit
+    entries = entries[:limit]
+
+    # last entry per row wins; an insert followed by updates is still an insert
+    latest = {}
+    for entry in entries:
+        key = (entry.table_name, entry.row_id)
+        op = entry.op
+        if op == "update" and key in latest and latest[key][1] == "insert":
+            op = "insert"
+        latest.pop(key, None)
+        latest[key] = (entry.id, op)
+
+    wanted = {}
+    for (table, row_id), (_, op) in latest.items():
+        if op != "delete" and table in MODELS:
+            wanted.setdefault(table, []).append(row_id)
+    rows = {}
+    for table, ids in wanted.items():
+        model = MODELS[table]
+        rows.update(((table, obj.id), obj) for obj in model.query.filter(model.id.in_(ids)))
+
+    changes = []
+    for (table, row_id), (entry_id, op) in sorted(latest.items(), key=lambda kv: kv[1][0]):
+        obj = rows.get((table, row_id))
+        if obj is None:
+            # deleted since; its delete entry follows, but say so now
+            op = "delete"
+        changes.append({
+            "cursor": entry_id, "table": table, "id": row_id, "op": op,
+            "data": row_json(obj) if obj is not None else None,
+        })
+    next_cursor = entries[-1].id if entries else cursor
+    return changes, next_cursor, has_more
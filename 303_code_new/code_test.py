@@ -5,7 +5,7 @@ from decimal import Decimal
 
 from flask import Flask
 from database import db
-from models import Category, Expense, Income, Budget, SavingsGoal, RecurringItem
+from models import Category, Expense, Income, Budget, SavingsGoal, RecurringItem, ArchivedExpense, MonthRollup, CategoryRule
 from functions import (
     # from logic tests
     month_bounds,
@@ -30,6 +30,21 @@ from functions import (
     _post_single,
     post_due_recurring,
     predicted_totals_for_month,
+    archive_cutoff,
+    archive_transactions,
+    monthly_trend,
+    add_category_rule,
+    import_expenses,
+    import_expenses_csv,
+    recategorize_uncategorized,
+    DuplicateExpenseError,
+    find_duplicate_clusters,
+    set_category_parent,
+    category_paths,
+    spend_by_subtree,
+    budget_actuals,
+    set_tags,
+    export_csv,
 )
 
 
@@ -44,8 +59,7 @@ def app_routes():
     and reset the database to keep tests isolated.
     """
     from app import create_app  # app.py
-    app = create_app()
-    app.config.update(TESTING=True)
+    app = create_app(config={"TESTING": True})
 
     with app.app_context():
         db.drop_all()
@@ -210,6 +224,26 @@ def test_expenses_requires_login(client_routes):
     assert "/login" in resp.headers.get("Location", "")
 
 
+def test_anonymous_delete_is_refused(client_routes, app_routes):
+    with app_routes.app_context():
+        exp_id = add_expense(date(2025, 1, 1), Decimal("5"), get_or_create_category("Food"), "kept").id
+    resp = client_routes.get(f"/expenses/{exp_id}/delete")
+    assert resp.status_code == 302 and "/login" in resp.headers["Location"]
+    with app_routes.app_context():
+        assert db.session.get(Expense, exp_id) is not None
+
+
+def test_create_app_requires_a_secret_key(monkeypatch):
+    from app import create_app
+    monkeypatch.delenv("SECRET_KEY", raising=False)
+    with pytest.raises(RuntimeError, match="SECRET_KEY"):
+        create_app(config={"SQLALCHEMY_DATABASE_URI": "sqlite://"})
+    # tests get a random one
+    assert len(create_app(config={"TESTING": True, "SQLALCHEMY_DATABASE_URI": "sqlite://"}).secret_key) == 64
+    monkeypatch.setenv("SECRET_KEY", "from-the-environment")
+    assert create_app(config={"SQLALCHEMY_DATABASE_URI": "sqlite://"}).secret_key == "from-the-environment"
+
+
 def test_add_income_via_route(client_routes, app_routes):
     login_as_admin(client_routes)
 
@@ -285,6 +319,11 @@ def test_view_report_with_expenses_income_and_budgets(client_routes, app_routes)
     resp = client_routes.get("/report?year=2025&month=1")
     assert resp.status_code == 200
 
+    # archiving changes data, so only the page's form button (a POST) runs it
+    assert b'action="/tasks/archive"' in resp.data
+    assert client_routes.get("/tasks/archive").status_code == 405
+    assert client_routes.post("/tasks/archive", data={"idempotency_key": "archive-1"}).status_code == 302
+
 
 def test_recurring_create_toggle_run_and_task(client_routes, app_routes):
     login_as_admin(client_routes)
@@ -716,3 +755,1571 @@ def test_predicted_totals_for_month_basic(app_db):
     totals = predicted_totals_for_month(2025, 1)
     assert totals["predicted_expense"] == pytest.approx(200.00)
     assert totals["predicted_income"] == pytest.approx(1000.00)
+
+
+
+def test_archive_cutoff_rounds_to_month_start():
+    assert archive_cutoff(24, today=date(2025, 3, 15)) == date(2023, 3, 1)
+    assert archive_cutoff(3, today=date(2025, 2, 1)) == date(2024, 11, 1)
+
+
+def test_archive_transactions_keeps_report_totals(app_db):
+    food = get_or_create_category("Food")
+    rent = get_or_create_category("Rent")
+    add_expense(date(2023, 1, 5), Decimal("10.00"), food, "Lunch")
+    add_expense(date(2023, 1, 20), Decimal("15.00"), food, "Dinner")
+    add_expense(date(2023, 1, 1), Decimal("500.00"), rent, "January rent")
+    add_income(amount=Decimal("900.00"), when=date(2023, 1, 3), source="Salary")
+    add_expense(date(2025, 1, 5), Decimal("7.00"), food, "Coffee")
+
+    moved = archive_transactions(date(2023, 2, 14))
+    assert moved["cutoff"] == date(2023, 2, 1)
+    assert moved["expenses"] == 3
+    assert moved["income"] == 1
+
+    # hot tables only keep the recent rows
+    assert Expense.query.count() == 1
+    assert Income.query.count() == 0
+    assert ArchivedExpense.query.count() == 3
+    assert MonthRollup.query.filter_by(month_key="2023-01").count() == 3
+
+    # report helpers union the archived rollups transparently
+    assert monthly_total_spend(2023, 1) == pytest.approx(525.00)
+    assert monthly_total_income(2023, 1) == pytest.approx(900.00)
+    assert monthly_net_flow(2023, 1) == pytest.approx(375.00)
+    rows = {r.category: float(r.spent) for r in monthly_spend_by_category(2023, 1)}
+    assert rows == {"Rent": pytest.approx(500.00), "Food": pytest.approx(25.00)}
+
+    # a late, backdated expense is folded into the existing rollup
+    add_expense(date(2023, 1, 25), Decimal("5.00"), food, "Snack")
+    assert monthly_total_spend(2023, 1) == pytest.approx(530.00)
+    archive_transactions(date(2023, 2, 1))
+    food_rollup = MonthRollup.query.filter_by(month_key="2023-01", category_id=food.id).one()
+    assert float(food_rollup.total) == pytest.approx(30.00)
+    assert food_rollup.count == 3
+    assert monthly_total_spend(2023, 1) == pytest.approx(530.00)
+    assert monthly_total_spend(2025, 1) == pytest.approx(7.00)
+
+
+def test_create_app_registers_selected_features_only(tmp_path):
+    from app import create_app
+    app = create_app(
+        features=("expenses",),
+        config={"TESTING": True, "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'f.db'}"},
+    )
+    assert "expenses" in app.blueprints
+    assert "report" not in app.blueprints
+
+    client = app.test_client()
+    login_as_admin(client)
+    assert client.get("/expenses").status_code == 200
+    assert client.get("/report").status_code == 404
+
+    with pytest.raises(ValueError):
+        create_app(features=("nope",), config={"TESTING": True, "SQLALCHEMY_DATABASE_URI": "sqlite://"})
+
+
+def test_optional_subsystems_are_imported_lazily():
+    import os
+    import subprocess
+    import sys
+    # a fresh interpreter, since this one has imported everything by now
+    out = subprocess.run(
+        [sys.executable, "-c", "import sys, app; print(sorted(m for m in "
+         "('backup', 'queryplan', 'attachments', 'writequeue', 'fx', 'events') if m in sys.modules))"],
+        capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__)),
+    ).stdout
+    assert out.strip() == "[]"
+
+
+def test_schema_version_is_stamped_and_missing_columns_added(tmp_path):
+    import sqlite3
+    from app import create_app
+    from database import SCHEMA_VERSION, schema_is_current
+
+    path = tmp_path / "old.db"
+    conn = sqlite3.connect(path)
+    # an older database that predates Expense.description
+    conn.execute("CREATE TABLE category (id INTEGER PRIMARY KEY, name VARCHAR(64) NOT NULL UNIQUE)")
+    conn.execute(
+        "CREATE TABLE expense (id INTEGER PRIMARY KEY, date DATE NOT NULL, "
+        "amount NUMERIC(12, 2) NOT NULL, category_id INTEGER NOT NULL)"
+    )
+    conn.commit()
+    conn.close()
+
+    app = create_app(config={"TESTING": True, "SQLALCHEMY_DATABASE_URI": f"sqlite:///{path}"})
+    with app.app_context():
+        assert schema_is_current()
+        food = get_or_create_category("Food")
+        add_expense(date(2025, 1, 10), Decimal("3.00"), food, "Tea")
+        assert Expense.query.one().description == "Tea"
+        db.session.remove()
+
+    conn = sqlite3.connect(path)
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION
+    conn.close()
+
+
+
+def test_panel_cache_is_bounded_and_drops_stale_generations():
+    from blueprints.report import PanelCache
+    cache = PanelCache(size=3)
+    for month in range(1, 6):
+        cache.put(("summary", 2025, month), 1, {"month": month})
+    assert len(cache) == 3 and cache.get(("summary", 2025, 1), 1, ttl=60) is None
+    assert cache.get(("summary", 2025, 5), 1, ttl=60)[2] == {"month": 5}
+    # a newer generation evicts everything computed before it
+    cache.put(("summary", 2025, 6), 2, {"month": 6})
+    assert len(cache) == 1 and cache.get(("summary", 2025, 5), 2, ttl=60) is None
+
+
+def test_warmed_panel_is_a_cache_hit_after_a_post(tmp_path):
+    from app import create_app
+    from blueprints.report import _generation
+    from datetime import timedelta
+    from idempotency import claim_key
+    app = create_app(config={
+        "TESTING": True, "WRITE_QUEUE": True,
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'warm.db'}",
+    })
+    client = app.test_client()
+    login_as_admin(client)
+    form = {"date": "2025-05-01", "amount": "12.50", "category": "Food", "description": "lunch",
+            "idempotency_key": "warm-1"}
+    assert client.post("/expenses", data=form).status_code == 302
+    assert app.extensions["events"].wait_idle()
+
+    cache = app.extensions["report_panels"]
+    before = dict(cache.stats)
+    summary = client.get("/report/data/summary?year=2025&month=5").json
+    assert summary["total_spend"] == 12.5
+    assert cache.stats == {"hits": before["hits"] + 1, "misses": before["misses"]}
+    # a commit that only stores an idempotency key leaves the panels valid
+    with app.test_request_context():
+        generation = _generation()
+        claim_key("warm-2", "fingerprint", timedelta(hours=1))
+        assert _generation() == generation
+        # in a write-queue batch, one job's savepoint rolling back does not hide the others' writes
+        db.session.info["group_commit"] = True
+        get_or_create_category("Travel")
+        savepoint = db.session.begin_nested()
+        get_or_create_category("Rent")
+        savepoint.rollback()
+        db.session.commit()
+        assert _generation() > generation
+
+
+def test_queued_writes_invalidate_panels_when_the_batch_commits(tmp_path):
+    import events
+    from app import create_app
+    from events import on, ExpenseAdded
+    from writequeue import write
+    app = create_app(config={
+        "TESTING": True, "WRITE_QUEUE": True, "EVENT_WORKERS": 0,
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'queued.db'}",
+    })
+    client = app.test_client()
+    login_as_admin(client)
+    url = "/report/data/summary?year=2025&month=5"
+    assert client.get(url).json["total_spend"] == 0
+    form = {"date": "2025-05-01", "amount": "42", "category": "Food", "description": "lunch"}
+    assert client.post("/expenses", data=form).status_code == 302
+    assert client.get(url).json["total_spend"] == 42
+
+    # events leave only with the batch's commit: none for a rolled-back job, none twice
+    seen = []
+    handler = on(ExpenseAdded)(lambda evs: seen.extend(e.base_amount for e in evs))
+    try:
+        with app.app_context():
+            with pytest.raises(ZeroDivisionError):
+                write(lambda: (add_expense(date(2025, 5, 2), Decimal("1"), get_or_create_category("Food"), "a"),
+                               1 / 0))
+            write(lambda: add_expense(date(2025, 5, 3), Decimal("2"), get_or_create_category("Food"), "b"))
+        assert seen == [Decimal("2")]
+    finally:
+        events._handlers.remove(next(h for h in events._handlers if h.fn is handler))
+    assert client.get(url).json["total_spend"] == 44
+
+
+def test_report_panels_serve_json_with_etag(client_routes, app_routes):
+    login_as_admin(client_routes)
+
+    with app_routes.app_context():
+        food = get_or_create_category("Food")
+        add_expense(date(2025, 1, 10), Decimal("20.00"), food, "Groceries")
+        add_income(amount=Decimal("200.00"), when=date(2025, 1, 5), source="Salary")
+        set_budget("2025-01", Decimal("100.00"), food)
+        set_budget("2025-01", Decimal("300.00"), None)
+
+    shell = client_routes.get("/report?year=2025&month=1")
+    assert shell.status_code == 200
+    assert b"/report/data/trends?year=2025" in shell.data
+
+    summary = client_routes.get("/report/data/summary?year=2025&month=1")
+    assert summary.get_json() == {"total_income": 200.0, "total_spend": 20.0, "net": 180.0}
+
+    cats = client_routes.get("/report/data/categories?year=2025&month=1").get_json()
+    assert cats == [{"category": "Food", "spent": 20.0}]
+
+    budgets = client_routes.get("/report/data/budgets?year=2025&month=1").get_json()
+    assert {b["category"]: b["actual"] for b in budgets} == {"Food": 20.0, "Overall": 20.0}
+
+    trends = client_routes.get("/report/data/trends?year=2025&month=1").get_json()
+    assert [t["month"] for t in trends] == ["Aug 2024", "Sep 2024", "Oct 2024", "Nov 2024", "Dec 2024", "Jan 2025"]
+    assert trends[-1] == {"month": "Jan 2025", "spend": 20.0, "income": 200.0}
+
+    # revalidation with the ETag is a 304
+    etag = summary.headers["ETag"]
+    again = client_routes.get("/report/data/summary?year=2025&month=1", headers={"If-None-Match": etag})
+    assert again.status_code == 304
+
+    # a write invalidates the cached panel
+    with app_routes.app_context():
+        add_expense(date(2025, 1, 11), Decimal("5.00"), get_or_create_category("Food"), "Snack")
+    fresh = client_routes.get("/report/data/summary?year=2025&month=1", headers={"If-None-Match": etag})
+    assert fresh.status_code == 200
+    assert fresh.get_json()["total_spend"] == 25.0
+
+    assert client_routes.get("/report/data/nope").status_code == 404
+
+
+def test_monthly_trend_spans_year_boundary(app_db):
+    food = get_or_create_category("Food")
+    add_expense(date(2024, 11, 3), Decimal("4.00"), food, "")
+    add_expense(date(2025, 2, 3), Decimal("6.00"), food, "")
+    add_income(amount=Decimal("50.00"), when=date(2024, 12, 1), source="Gift")
+
+    trend = monthly_trend(2025, 2, months=4)
+    assert trend == [
+        {"month": "Nov 2024", "spend": 4.0, "income": 0.0},
+        {"month": "Dec 2024", "spend": 0.0, "income": 50.0},
+        {"month": "Jan 2025", "spend": 0.0, "income": 0.0},
+        {"month": "Feb 2025", "spend": 6.0, "income": 0.0},
+    ]
+
+
+def test_static_assets_are_fingerprinted_and_precompressed(client_routes, app_routes):
+    import gzip
+
+    with app_routes.app_context():
+        manifest = app_routes.extensions["assets"]["manifest"]
+    hashed = manifest["report.js"]
+    assert hashed.startswith("report.") and hashed.endswith(".js") and hashed != "report.js"
+
+    login_as_admin(client_routes)
+    page = client_routes.get("/report")
+    assert f"/assets/{hashed}".encode() in page.data
+    # third-party assets fall back to pinned CDN URLs
+    assert b"chart.js@4.4.1" in page.data
+
+    with open("static/report.js", "rb") as f:
+        original = f.read()
+
+    plain = client_routes.get(f"/assets/{hashed}")
+    assert plain.status_code == 200
+    assert plain.data == original
+    assert "immutable" in plain.headers["Cache-Control"]
+    assert "max-age=31536000" in plain.headers["Cache-Control"]
+    assert "javascript" in plain.headers["Content-Type"]
+
+    packed = client_routes.get(f"/assets/{hashed}", headers={"Accept-Encoding": "gzip"})
+    assert packed.headers["Content-Encoding"] == "gzip"
+    assert gzip.decompress(packed.data) == original
+
+    assert client_routes.get("/assets/../site.db").status_code == 404
+
+
+def test_json_responses_are_gzipped_but_html_is_not(client_routes):
+    import gzip
+
+    login_as_admin(client_routes)
+    resp = client_routes.get("/report/data/heatmap?year=2025", headers={"Accept-Encoding": "gzip"})
+    assert resp.headers["Content-Encoding"] == "gzip"
+    assert b'"start":"2025-01-01"' in gzip.decompress(resp.data).replace(b" ", b"")
+
+    plain = client_routes.get("/report/data/heatmap?year=2025")
+    assert "Content-Encoding" not in plain.headers
+    # pages carry form keys next to reflected input (BREACH)
+    page = client_routes.get("/expenses", headers={"Accept-Encoding": "gzip"})
+    assert "Content-Encoding" not in page.headers and b"Expense Tracking" in page.data
+
+
+
+def test_rule_matcher_priority_longest_match_and_conditions():
+    from categorize import Rule, RuleMatcher
+
+    matcher = RuleMatcher([
+        Rule(1, 10, "substring", "uber", None, None, None, 100),
+        Rule(2, 20, "substring", "Uber Eats", None, None, None, 100),
+        Rule(3, 30, "regex", r"amzn\s*mktp", None, None, None, 50),
+        Rule(4, 40, "substring", "costco", 200.0, None, None, 10),
+        Rule(5, 50, "substring", "costco", None, None, None, 20),
+        Rule(6, 60, None, None, None, None, "amex", 500),
+    ])
+    assert matcher.classify("UBER TRIP 123") == 10
+    assert matcher.classify("uber eats order") == 20
+    assert matcher.classify("AMZN Mktp US*1A2B") == 30
+    assert matcher.classify("COSTCO WHOLESALE", 250.0) == 40
+    assert matcher.classify("COSTCO WHOLESALE", 20.0) == 50
+    assert matcher.classify("corner shop", 5.0, "AMEX") == 60
+    assert matcher.classify("corner shop", 5.0, "chase") is None
+    assert matcher.classify_many([("uber", 1.0, None), ("nothing", 1.0, None)]) == [10, None]
+
+
+def test_rule_matcher_considers_every_overlapping_match():
+    from categorize import Rule, RuleMatcher, validate_rule
+
+    # a higher-priority shorter literal inside a longer one still wins
+    matcher = RuleMatcher([
+        Rule(1, 10, "substring", "uber", None, None, None, 1),
+        Rule(2, 20, "substring", "uber eats", None, None, None, 100),
+    ])
+    assert matcher.classify("UBER EATS order") == 10
+    # a hit ruled out by its amount no longer hides an overlapping one
+    matcher = RuleMatcher([
+        Rule(1, 10, "substring", "ab", 100.0, None, None, 1),
+        Rule(2, 20, "substring", "bc", None, None, None, 2),
+        Rule(3, 30, "regex", "coffee", 100.0, None, None, 1),
+        Rule(4, 40, "regex", "coff", None, None, None, 2),
+    ])
+    assert matcher.classify("abc", 5.0) == 20
+    assert matcher.classify("coffee", 5.0) == 40
+    # regexes are compiled on their own: backreferences, inline flags and named groups work
+    for pattern in (r"(\d)\1", r"(?i)x(?P<n>y)"):
+        validate_rule("regex", pattern)
+    matcher = RuleMatcher([
+        Rule(1, 10, "regex", r"(\d)\1", None, None, None, 1),
+        Rule(2, 20, "regex", r"(?i)x(?P<n>y)", None, None, None, 1),
+    ])
+    assert matcher.classify("77") == 10 and matcher.classify("XY") == 20
+    with pytest.raises(ValueError):
+        validate_rule("regex", "a(?i)b")
+
+
+def test_import_expenses_applies_rules_in_bulk(app_db):
+    groceries = get_or_create_category("Groceries")
+    transport = get_or_create_category("Transport")
+    add_category_rule(groceries, "trader joe")
+    add_category_rule(transport, r"^(lyft|uber)\b", match_type="regex")
+
+    with pytest.raises(ValueError):
+        add_category_rule(transport, "(", match_type="regex")
+    with pytest.raises(ValueError):
+        add_category_rule(transport)
+
+    result = import_expenses([
+        {"date": date(2025, 1, 2), "amount": Decimal("40.00"), "description": "TRADER JOE'S #123"},
+        {"date": date(2025, 1, 3), "amount": Decimal("12.00"), "description": "Lyft ride"},
+        {"date": date(2025, 1, 4), "amount": Decimal("9.00"), "description": "Mystery"},
+        {"date": date(2025, 1, 5), "amount": Decimal("3.00"), "description": "Tea", "category": "Cafe"},
+    ])
+    assert result == {"imported": 4, "auto_categorized": 2, "duplicates": 0}
+    by_desc = {e.description: e.category.name for e in Expense.query.all()}
+    assert by_desc == {
+        "TRADER JOE'S #123": "Groceries",
+        "Lyft ride": "Transport",
+        "Mystery": "General",
+        "Tea": "Cafe",
+    }
+
+
+def test_replaced_rule_is_not_served_from_the_matcher_cache(app_db):
+    from categorize import load_rule_matcher
+    from functions import delete_category_rule
+    food, travel = get_or_create_category("Food"), get_or_create_category("Travel")
+    rule = add_category_rule(food, "uber")
+    assert load_rule_matcher().classify("uber trip") == food.id
+    delete_category_rule(rule.id)
+    # SQLite hands the freed rowid to the next rule
+    assert add_category_rule(travel, "uber").id == rule.id
+    assert load_rule_matcher().classify("uber trip") == travel.id
+
+
+def test_import_expenses_csv_and_recategorize(app_db):
+    import io
+
+    fun = get_or_create_category("Fun")
+    csv_text = "date,amount,description,category\n2025-02-01,15.50,NETFLIX.COM,\n2025-02-02,4.00,Coffee,Cafe\n"
+    assert import_expenses_csv(io.StringIO(csv_text))["imported"] == 2
+    netflix = Expense.query.filter_by(description="NETFLIX.COM").one()
+    assert netflix.category.name == "General"
+
+    with pytest.raises(ValueError):
+        import_expenses_csv(io.StringIO("date,amount\nnot-a-date,1\n"))
+
+    add_category_rule(fun, "netflix")
+    assert recategorize_uncategorized() == 1
+    assert db.session.get(Expense, netflix.id).category_id == fun.id
+
+
+def test_post_single_uses_rules_before_general(app_db):
+    health = get_or_create_category("Health")
+    add_category_rule(health, "gym")
+    item = add_recurring_item(
+        name="Downtown Gym", kind="expense", amount=Decimal("30.00"),
+        category_id=None, income_source=None, freq="monthly",
+        every_n_days=None, day_of_month=None,
+        start_date=date(2025, 1, 1), next_run_date=date(2025, 1, 1),
+        end_date=None, auto_post=True, active=True, notes="",
+    )
+    _post_single(item, when=date(2025, 1, 1))
+    assert Expense.query.one().category.name == "Health"
+
+
+def test_rules_and_import_routes(client_routes, app_routes):
+    import io
+
+    login_as_admin(client_routes)
+    resp = client_routes.post("/categories/rules", data={
+        "category": "Transport", "match_type": "substring", "pattern": "metro",
+        "min_amount": "", "max_amount": "", "source": "", "priority": "5",
+    }, follow_redirects=True)
+    assert resp.status_code == 200
+    assert b"metro" in resp.data
+
+    resp = client_routes.post("/expenses/import", data={
+        "file": (io.BytesIO(b"date,amount,description\n2025-03-01,2.75,METRO CARD\n"), "bank.csv"),
+        "source": "",
+    }, content_type="multipart/form-data", follow_redirects=True)
+    assert resp.status_code == 200
+
+    with app_routes.app_context():
+        assert Expense.query.one().category.name == "Transport"
+        rule_id = CategoryRule.query.one().id
+
+    assert client_routes.get("/tasks/categorize", follow_redirects=True).status_code == 200
+    client_routes.get(f"/categories/rules/{rule_id}/delete", follow_redirects=True)
+    with app_routes.app_context():
+        assert CategoryRule.query.count() == 0
+
+
+
+def test_add_expense_rejects_duplicates_unless_allowed(app_db):
+    food = get_or_create_category("Food")
+    first = add_expense(date(2025, 1, 10), Decimal("12.50"), food, "Lunch  at Joe's")
+    assert first.fingerprint
+
+    # same day/amount/category, description differs only in case and punctuation
+    with pytest.raises(DuplicateExpenseError):
+        add_expense(date(2025, 1, 10), Decimal("12.5"), food, "lunch at joes")
+    assert Expense.query.count() == 1
+
+    add_expense(date(2025, 1, 11), Decimal("12.50"), food, "Lunch at Joe's")
+    second = add_expense(date(2025, 1, 10), Decimal("12.50"), food, "Lunch at Joe's", allow_duplicate=True)
+    assert second.fingerprint == first.fingerprint
+
+    clusters = find_duplicate_clusters()
+    assert len(clusters) == 1
+    assert sorted(e.id for e in clusters[0]) == [first.id, second.id]
+
+
+def test_import_expenses_skips_existing_and_in_batch_duplicates(app_db):
+    food = get_or_create_category("Food")
+    add_expense(date(2025, 1, 2), Decimal("40.00"), food, "Market")
+
+    row = {"date": date(2025, 1, 2), "amount": Decimal("40.00"), "description": "MARKET", "category": "Food"}
+    other = {"date": date(2025, 1, 3), "amount": Decimal("5.00"), "description": "Bakery", "category": "Food"}
+    result = import_expenses([row, other, dict(other)])
+    assert result["imported"] == 1
+    assert result["duplicates"] == 2
+    assert Expense.query.count() == 2
+
+    # re-importing the same statement is a no-op
+    assert import_expenses([row, other])["imported"] == 0
+
+
+def test_fingerprints_backfilled_on_upgrade(tmp_path):
+    import sqlite3
+    from app import create_app
+
+    path = tmp_path / "v3.db"
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE category (id INTEGER PRIMARY KEY, name VARCHAR(64) NOT NULL UNIQUE)")
+    conn.execute(
+        "CREATE TABLE expense (id INTEGER PRIMARY KEY, date DATE NOT NULL, amount NUMERIC(12, 2) NOT NULL, "
+        "description VARCHAR(255), category_id INTEGER NOT NULL)"
+    )
+    conn.execute("INSERT INTO category VALUES (1, 'Food')")
+    conn.execute("INSERT INTO expense VALUES (1, '2025-01-10', 3.00, 'Tea', 1)")
+    conn.execute("INSERT INTO expense VALUES (2, '2025-01-10', 3.00, 'tea!', 1)")
+    conn.commit()
+    conn.close()
+
+    app = create_app(config={"TESTING": True, "SQLALCHEMY_DATABASE_URI": f"sqlite:///{path}"})
+    with app.app_context():
+        assert Expense.query.filter(Expense.fingerprint.is_(None)).count() == 0
+        assert [len(c) for c in find_duplicate_clusters()] == [2]
+        db.session.remove()
+
+
+def test_double_submitted_expense_form_creates_one_row(client_routes, app_routes):
+    login_as_admin(client_routes)
+    form = {"date": "2025-01-10", "amount": "12.50", "category": "Food", "description": "Lunch"}
+    client_routes.post("/expenses", data=form, follow_redirects=True)
+    resp = client_routes.post("/expenses", data=form, follow_redirects=True)
+    assert b"Failed to add expense" in resp.data
+
+    with app_routes.app_context():
+        assert Expense.query.count() == 1
+
+    client_routes.post("/expenses", data=dict(form, allow_duplicate="on"), follow_redirects=True)
+    page = client_routes.get("/duplicates")
+    assert page.status_code == 200
+    assert page.data.count(b"Lunch") == 2
+
+
+
+def test_mine_recurring_candidates_finds_periodic_patterns(app_db):
+    from datetime import timedelta
+    from recurring_mining import mine_recurring_candidates, accept_recurring_candidate
+
+    fun = get_or_create_category("Fun")
+    food = get_or_create_category("Food")
+    # monthly subscription with two price tiers from the same merchant
+    for m in range(1, 7):
+        add_expense(date(2025, m, 3), Decimal("15.49"), fun, "NETFLIX.COM")
+        add_expense(date(2025, m, 20), Decimal("4.99"), fun, "NETFLIX.COM")
+    # weekly class, slightly different amounts
+    start = date(2025, 4, 1)
+    for w in range(10):
+        add_expense(start + timedelta(days=7 * w), Decimal("20.00") + w % 2, fun, "Yoga Studio")
+    # irregular grocery runs are not recurring
+    for d in (1, 2, 9, 30, 33, 60, 61):
+        add_expense(date(2025, 1, 1) + timedelta(days=d), Decimal("50") + d, food, "Market")
+    # biweekly paycheck
+    for p in range(8):
+        add_income(amount=Decimal("1500.00"), when=date(2025, 3, 7) + timedelta(days=14 * p), source="ACME Payroll")
+
+    found = mine_recurring_candidates(today=date(2025, 6, 10))
+    by_key = {(c["name"], c["amount"]): c for c in found}
+
+    tier_a = by_key[("NETFLIX.COM", Decimal("15.49"))]
+    assert tier_a["freq"] == "monthly"
+    assert tier_a["next_run_date"] == date(2025, 7, 3)
+    assert by_key[("NETFLIX.COM", Decimal("4.99"))]["freq"] == "monthly"
+    yoga = [c for c in found if c["name"] == "Yoga Studio"][0]
+    assert yoga["freq"] == "weekly"
+    pay = [c for c in found if c["kind"] == "income"][0]
+    assert pay["freq"] == "biweekly"
+    assert pay["income_source"] == "ACME Payroll"
+    assert not [c for c in found if c["name"] == "Market"]
+    assert all(0 < c["confidence"] <= 1 for c in found)
+
+    item = accept_recurring_candidate(pay)
+    assert item.kind == "income" and item.auto_post is False
+    # tracked patterns are no longer proposed
+    again = mine_recurring_candidates(today=date(2025, 6, 10))
+    assert not [c for c in again if c["kind"] == "income"]
+
+
+def test_recurring_suggestions_route(client_routes, app_routes):
+    login_as_admin(client_routes)
+    with app_routes.app_context():
+        gym = get_or_create_category("Health")
+        for m in range(1, 5):
+            add_expense(date(2025, m, 15), Decimal("30.00"), gym, "City Gym")
+
+    resp = client_routes.get("/recurring/suggestions?min_confidence=0")
+    assert resp.status_code == 200
+    assert b"City Gym" in resp.data
+
+    resp = client_routes.post("/recurring/suggestions", data={
+        "name": "City Gym", "kind": "expense", "amount": "30.00", "freq": "monthly",
+        "every_n_days": "", "category_id": "1", "income_source": "",
+        "next_run_date": "2025-05-15", "occurrences": "4", "auto_post": "on",
+    }, follow_redirects=True)
+    assert resp.status_code == 200
+    with app_routes.app_context():
+        item = RecurringItem.query.one()
+        assert item.name == "City Gym" and item.auto_post is True
+
+
+def test_loadtest_percentiles():
+    from loadtest import percentile, _summary
+    values = [i / 1000 for i in range(1, 101)]
+    assert percentile(values, 50) == 0.05
+    assert percentile(values, 99) == 0.099
+    assert percentile([], 95) == 0.0
+    s = _summary(values, 2.0, errors=1, locked=0)
+    assert s["requests"] == 100 and s["throughput"] == 50.0 and s["p95_ms"] == 95.0
+
+
+def test_write_queue_group_commits_and_isolates_failures(tmp_path):
+    import threading
+    from app import create_app
+    app = create_app(config={
+        "TESTING": True, "WRITE_QUEUE": True, "WRITE_QUEUE_WINDOW_MS": 50,
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'wq.db'}",
+    })
+    wq = app.extensions["write_queue"]
+    errors = []
+
+    def post(i):
+        with app.app_context():
+            from writequeue import write
+            try:
+                write(lambda: add_expense(date(2025, 1, 1), Decimal("5.00"),
+                                          get_or_create_category("Food"), f"item {i % 10}"))
+            except DuplicateExpenseError as e:
+                errors.append(e)
+
+    threads = [threading.Thread(target=post, args=(i,)) for i in range(20)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    with app.app_context():
+        assert Expense.query.count() == 10
+        assert Category.query.count() == 1
+    # the ten repeats fail on their own without rolling back the rest
+    assert len(errors) == 10
+    assert wq.stats["jobs"] == 20 and wq.stats["batches"] < 20
+
+    client = app.test_client()
+    login_as_admin(client)
+    resp = client.post("/income", data={"date": "2025-01-02", "amount": "10", "source": "Job"},
+                       follow_redirects=True)
+    assert b"Income added." in resp.data
+    with app.app_context():
+        assert Income.query.count() == 1
+
+    # every form that writes goes through the writer thread
+    import io
+    jobs = wq.stats["jobs"]
+    client.post("/categories", data={"name": "Transit"})
+    client.post("/categories/rules", data={"category": "Transit", "pattern": "metro"})
+    client.post("/goals", data={"name": "Trip", "target_amount": "500"})
+    client.post("/expenses/import", data={
+        "file": (io.BytesIO(b"date,amount,description\n2025-03-01,2.75,METRO CARD\n"), "bank.csv"),
+    }, content_type="multipart/form-data")
+    client.get("/tasks/categorize")
+    assert wq.stats["jobs"] == jobs + 5
+    with app.app_context():
+        assert Expense.query.filter_by(description="METRO CARD").one().category.name == "Transit"
+
+
+def test_hot_queries_do_not_scan_big_tables(tmp_path):
+    from sqlalchemy import func
+    from app import create_app
+    from queryplan import plan_recorder, FullScanError
+    app = create_app(config={
+        "TESTING": True, "QUERY_PLAN_GUARD": True, "QUERY_PLAN_MAX_SCAN_ROWS": 0,
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'plans.db'}",
+    })
+    with app.app_context():
+        food = get_or_create_category("Food")
+        for d in range(1, 28, 3):
+            add_expense(date(2025, 3, d), Decimal("4.00"), food, f"lunch {d}")
+            add_income(Decimal("50.00"), date(2025, 3, d), "Job")
+        add_recurring_item(
+            name="Gym", kind="expense", amount=Decimal("30"), category_id=food.id, income_source=None,
+            freq="monthly", every_n_days=None, day_of_month=None, start_date=date(2025, 3, 1),
+            next_run_date=date(2025, 3, 1), end_date=None, auto_post=True, active=True, notes="",
+        )
+        set_budget("2025-03", Decimal("100"), food)
+        plan_recorder().reset()
+
+    client = app.test_client()
+    login_as_admin(client)
+    for url in ("/report?year=2025&month=3", "/report/data/summary?year=2025&month=3",
+                "/report/data/categories?year=2025&month=3", "/report/data/trends?year=2025&month=3",
+                "/report/data/budgets?year=2025&month=3", "/report/data/heatmap?year=2025",
+                "/expenses", "/budgets", "/tasks/run-recurring"):
+        assert client.get(url).status_code in (200, 302)
+    client.post("/expenses", data={"date": "2025-03-30", "amount": "2", "category": "Food", "description": "tea"})
+
+    with app.app_context():
+        predicted_totals_for_month(2025, 4)
+        archive_transactions(date(2025, 3, 10))
+        recorder = plan_recorder()
+        recorder.assert_no_full_scans()
+        assert "report.panel_data" in recorder.report()
+
+        # a month filter on strftime(date) cannot use the index
+        Expense.query.filter(func.strftime("%Y-%m", Expense.date) == "2025-03").all()
+        with pytest.raises(FullScanError, match="SCAN expense"):
+            recorder.assert_no_full_scans()
+        recorder.close()
+
+
+def test_category_tree_rollups_and_moves(app_db):
+    costco = get_or_create_category("Food > Groceries > Costco")
+    groceries = costco.parent
+    food = groceries.parent
+    dining = get_or_create_category("Dining", parent=food)
+    fun = get_or_create_category("Fun")
+    assert (food.level, groceries.level, costco.level, dining.level) == (0, 1, 2, 1)
+    assert category_paths()[costco.id] == "Food > Groceries > Costco"
+
+    add_expense(date(2025, 4, 2), Decimal("100.00"), costco, "bulk")
+    add_expense(date(2025, 4, 3), Decimal("20.00"), groceries, "market")
+    add_expense(date(2025, 4, 4), Decimal("15.00"), dining, "lunch")
+    add_expense(date(2025, 4, 5), Decimal("5.00"), food, "snack")
+    add_expense(date(2025, 4, 6), Decimal("30.00"), fun, "movie")
+
+    flat = {r.category: float(r.spent) for r in monthly_spend_by_category(2025, 4)}
+    assert flat == {"Costco": 100.0, "Groceries": 20.0, "Dining": 15.0, "Food": 5.0, "Fun": 30.0}
+    top = {r.category: float(r.spent) for r in monthly_spend_by_category(2025, 4, level=0)}
+    assert top == {"Food": 140.0, "Fun": 30.0}
+    mid = {r.category: float(r.spent) for r in monthly_spend_by_category(2025, 4, level=1)}
+    assert mid == {"Groceries": 120.0, "Dining": 15.0, "Food": 5.0, "Fun": 30.0}
+    assert spend_by_subtree(2025, 4, [food.id, groceries.id]) == {food.id: 140.0, groceries.id: 120.0}
+
+    b = set_budget("2025-04", Decimal("130"), food)
+    assert budget_actuals([b]) == {b.id: 140.0}
+
+    # move Groceries (with Costco) under Fun
+    set_category_parent(groceries, fun)
+    assert (groceries.level, costco.level) == (1, 2)
+    assert category_paths()[costco.id] == "Fun > Groceries > Costco"
+    top = {r.category: float(r.spent) for r in monthly_spend_by_category(2025, 4, level=0)}
+    assert top == {"Food": 20.0, "Fun": 150.0}
+
+    with pytest.raises(ValueError):
+        set_category_parent(fun, costco)
+    set_category_parent(groceries, None)
+    assert groceries.level == 0 and costco.level == 1
+    assert category_paths()[costco.id] == "Groceries > Costco"
+
+
+def test_categories_page_shows_tree(client_routes, app_routes):
+    login_as_admin(client_routes)
+    client_routes.post("/categories", data={"name": "Food > Groceries"})
+    with app_routes.app_context():
+        food = Category.query.filter_by(name="Food").one()
+        client_routes.post("/categories", data={"name": "Dining", "parent_id": str(food.id)})
+        dining = Category.query.filter_by(name="Dining").one()
+        assert dining.parent_id == food.id and dining.level == 1
+    resp = client_routes.post(f"/categories/{food.id}/parent", data={"parent_id": str(dining.id)},
+                              follow_redirects=True)
+    assert b"Failed to move category" in resp.data
+    resp = client_routes.get("/categories")
+    assert b"Food &gt; Groceries" in resp.data
+
+
+def test_tag_filters_and_totals(app_db):
+    from tags import TagFilter, filter_by_tags, tag_totals, parse_tags
+    assert parse_tags("Vacation 2026, reimbursable, vacation-2026") == ["vacation-2026", "reimbursable"]
+
+    food = get_or_create_category("Food")
+    a = add_expense(date(2025, 5, 1), Decimal("10.00"), food, "a", tags="trip, work")
+    b = add_expense(date(2025, 5, 2), Decimal("20.00"), food, "b", tags="trip")
+    c = add_expense(date(2025, 5, 3), Decimal("40.00"), food, "c", tags="work, refunded")
+    d = add_expense(date(2025, 5, 4), Decimal("80.00"), food, "d")
+
+    def ids(**kw):
+        tf = TagFilter(*(tuple(parse_tags(kw.get(k, ""))) for k in TagFilter._fields))
+        return {e.id for e in filter_by_tags(Expense.query, Expense, tf)}
+
+    assert ids(all="trip, work") == {a.id}
+    assert ids(any="trip, work") == {a.id, b.id, c.id}
+    assert ids(all="work", none="refunded") == {a.id}
+    assert ids(all="trip", any="work, refunded") == {a.id}
+    assert ids(any="trip, work", none="refunded") == {a.id, b.id}
+    assert ids(all="trip, work", none="refunded") == {a.id}
+    assert ids(none="trip") == {c.id, d.id}
+    assert ids(all="nope") == set() and ids(any="nope") == set()
+    assert ids(none="nope") == {a.id, b.id, c.id, d.id}
+
+    totals = {t: (s, n) for t, s, n in tag_totals(Expense, date(2025, 5, 1), date(2025, 5, 31))}
+    assert totals == {"work": (50.0, 2), "trip": (30.0, 2), "refunded": (40.0, 1)}
+    work = TagFilter(("work",), (), ())
+    assert monthly_total_spend(2025, 5, tag_filter=work) == 50.0
+    assert monthly_total_spend(2025, 5) == 150.0
+    assert [float(r.spent) for r in monthly_spend_by_category(2025, 5, tag_filter=work)] == [50.0]
+
+    set_tags(d, "work")
+    assert monthly_total_spend(2025, 5, tag_filter=work) == 130.0
+
+    from queries import empty_filter
+    lines = "".join(export_csv(empty_filter("expense")._replace(tags=work))).splitlines()
+    assert lines[0] == "date,amount,currency,description,category,tags"
+    assert [line.split(",")[3] for line in lines[1:]] == ["a", "c", "d"]
+    assert lines[-1] == "2025-05-04,80.00,USD,d,Food,work"
+
+    # archiving drops the tag links along with the live rows
+    archive_transactions(date(2025, 6, 1))
+    assert tag_totals(Expense) == []
+
+
+def test_tag_routes(client_routes, app_routes):
+    login_as_admin(client_routes)
+    client_routes.post("/expenses", data={"date": "2025-05-01", "amount": "12", "category": "Food",
+                                          "description": "flight snack", "tags": "Vacation 2026"})
+    client_routes.post("/expenses", data={"date": "2025-05-02", "amount": "7", "category": "Food",
+                                          "description": "lunch"})
+    resp = client_routes.get("/expenses?tag_all=vacation-2026")
+    assert b"flight snack" in resp.data and b"lunch" not in resp.data
+    assert b"1 matching, <a" in resp.data  # the total is only summed on request
+    assert b"1 matching, total $12.00" in client_routes.get("/expenses?tag_all=vacation-2026&totals=1").data
+
+    resp = client_routes.get("/expenses/export?tag_none=vacation-2026")
+    assert resp.mimetype == "text/csv"
+    body = resp.get_data(as_text=True)
+    assert "lunch" in body and "flight snack" not in body
+
+    with app_routes.app_context():
+        lunch = Expense.query.filter_by(description="lunch").one()
+    client_routes.post(f"/expenses/{lunch.id}/tags", data={"tags": "work"})
+    resp = client_routes.get("/report/data/tags?year=2025&month=5")
+    assert {r["tag"] for r in resp.get_json()} == {"vacation-2026", "work"}
+    resp = client_routes.get("/report/data/summary?year=2025&month=5&tag_all=work")
+    assert resp.get_json()["total_spend"] == 7.0
+
+
+def test_transaction_query_service(app_db):
+    from werkzeug.datastructures import MultiDict
+    from queries import TransactionFilter, query_transactions, count_transactions
+
+    food = get_or_create_category("Food")
+    groceries = get_or_create_category("Groceries", parent=food)
+    fun = get_or_create_category("Fun")
+    for d in range(1, 31):
+        cat = (food, groceries, fun)[d % 3]
+        add_expense(date(2025, 6, d), Decimal(d), cat, f"shop {d}" if d % 2 else f"cafe {d}",
+                    tags="weekend" if d % 7 == 0 else None)
+
+    def run(**args):
+        return TransactionFilter.from_args(MultiDict(args), "expense")
+
+    f = run(start="2025-06-10", end="2025-06-19", category="Food", min="12", q="shop")
+    page = query_transactions(f)
+    # Food includes Groceries; days 10..19 not in Fun (d % 3 != 2), >= 12, odd
+    assert [e.date.day for e in page.items] == [19, 15, 13]
+    assert page.count == 3 and page.count_exact and page.total == Decimal("47")
+
+    f = run(category=str(fun.id), tag_all="weekend")
+    assert [e.date.day for e in query_transactions(f).items] == [14]
+
+    page1 = query_transactions(run(), per_page=12)
+    page3 = query_transactions(run(), page=3, per_page=12)
+    assert page1.has_next and not page3.has_next
+    assert [e.date.day for e in page3.items] == list(range(6, 0, -1))
+
+    # past the cap the count is estimated from the indexed part and a sample
+    count, exact = count_transactions(run(q="shop"), cap=5)
+    assert not exact and count == 15
+    assert count_transactions(run(start="2025-06-01"), cap=5) == (30, True)
+
+    with pytest.raises(ValueError):
+        run(category="Nope")
+    with pytest.raises(ValueError):
+        run(min="abc")
+
+
+def test_transactions_api(client_routes, app_routes):
+    assert client_routes.get("/api/v1/transactions").status_code == 401
+    login_as_admin(client_routes)
+    with app_routes.app_context():
+        food = get_or_create_category("Food")
+        for d in range(1, 6):
+            add_expense(date(2025, 7, d), Decimal("10.00"), food, f"lunch {d}", tags="work" if d > 3 else None)
+        add_income(Decimal("500"), date(2025, 7, 1), "Salary")
+
+    data = client_routes.get("/api/v1/transactions?per_page=2&totals=1").get_json()
+    assert [i["description"] for i in data["items"]] == ["lunch 5", "lunch 4"]
+    assert data["count"] == 5 and data["count_exact"] and data["total"] == 50.0
+    assert data["items"][0]["tags"] == ["work"]
+    nxt = client_routes.get(data["next"]).get_json()
+    assert [i["description"] for i in nxt["items"]] == ["lunch 3", "lunch 2"]
+
+    data = client_routes.get("/api/v1/transactions?kind=income&source=salary").get_json()
+    assert data["items"][0]["amount"] == 500.0 and data["total"] is None
+
+    resp = client_routes.get("/api/v1/transactions?start=July")
+    assert resp.status_code == 400 and "error" in resp.get_json()
+
+    resp = client_routes.get("/expenses?tag_any=work&min=5")
+    assert b"lunch 4" in resp.data and b"lunch 3" not in resp.data
+
+
+def test_foreign_currency_amounts_and_reconvert(app_db):
+    import io
+    from fx import import_fx_rates, reconvert, rate_on
+    from queries import empty_filter, query_transactions
+    from models import FxRate
+
+    import_fx_rates(io.StringIO("date,currency,rate\n2025-01-01,EUR,1.10\n2025-03-01,eur,1.20\n"))
+    assert rate_on("EUR", date(2025, 2, 15)) == Decimal("1.10")
+    assert rate_on("USD", date(2025, 2, 15)) == 1
+
+    food = get_or_create_category("Food")
+    e = add_expense(date(2025, 3, 5), Decimal("10.00"), food, "croissant", currency="eur")
+    add_expense(date(2025, 3, 6), Decimal("5.00"), food, "bagel")
+    add_income(Decimal("100"), date(2025, 3, 1), "Refund", currency="EUR")
+    assert (e.currency, e.base_amount) == ("EUR", Decimal("12.00"))
+    assert monthly_total_spend(2025, 3) == 17.0
+    assert monthly_total_income(2025, 3) == 120.0
+    assert query_transactions(empty_filter("expense")).total == Decimal("17.00")
+    # no rate yet for that date or currency
+    with pytest.raises(ValueError):
+        add_expense(date(2024, 12, 31), Decimal("1"), food, "old", currency="EUR")
+    with pytest.raises(ValueError):
+        add_income(Decimal("1"), date(2025, 3, 1), currency="GBP")
+
+    # imports convert with the preloaded table, and a euro row is not a dup of a dollar row
+    result = import_expenses([
+        {"date": date(2025, 3, 6), "amount": Decimal("5.00"), "description": "bagel", "category": "Food",
+         "currency": "EUR"},
+        {"date": date(2025, 3, 6), "amount": Decimal("5.00"), "description": "bagel", "category": "Food"},
+    ])
+    assert result["imported"] == 1 and result["duplicates"] == 1
+    assert monthly_total_spend(2025, 3) == 23.0
+
+    # a rate correction re-converts the affected rows in place
+    fixed = import_fx_rates(io.StringIO("date,currency,rate\n2025-03-01,EUR,1.50\n"))
+    assert fixed["since"] == {"EUR": date(2025, 3, 1)}
+    assert reconvert(fixed["since"]) == {"expense": 2, "income": 1}
+    assert FxRate.query.count() == 2
+    assert monthly_total_spend(2025, 3) == 27.5
+    assert monthly_total_income(2025, 3) == 150.0
+
+    lines = "".join(export_csv(empty_filter("expense"))).splitlines()
+    assert "2025-03-05,10.00,EUR,croissant,Food," in lines
+
+
+def test_fx_routes(client_routes, app_routes):
+    login_as_admin(client_routes)
+    client_routes.post("/expenses", data={"date": "2025-04-02", "amount": "20", "category": "Travel",
+                                          "description": "taxi", "currency": "EUR"})
+    with app_routes.app_context():
+        assert Expense.query.count() == 0   # no EUR rate yet
+
+    client_routes.post("/fx", data={"date": "2025-04-01", "currency": "eur", "rate": "1.1"})
+    client_routes.post("/expenses", data={"date": "2025-04-02", "amount": "20", "category": "Travel",
+                                          "description": "taxi", "currency": "EUR"})
+    resp = client_routes.get("/expenses")
+    assert b"20.00 EUR" in resp.data and b"($22.00)" in resp.data
+
+    import io
+    resp = client_routes.post("/fx/import", data={
+        "file": (io.BytesIO(b"date,currency,rate\n2025-04-01,EUR,1.25\n"), "rates.csv"),
+    }, content_type="multipart/form-data", follow_redirects=True)
+    assert b"re-converted 1 expenses" in resp.data
+    assert client_routes.get("/report/data/summary?year=2025&month=4").get_json()["total_spend"] == 25.0
+    item = client_routes.get("/api/v1/transactions").get_json()["items"][0]
+    assert (item["currency"], item["amount"], item["base_amount"]) == ("EUR", 20.0, 25.0)
+
+
+def test_change_log_cursors(app_db):
+    from changes import changes_since, latest_cursor
+
+    food = get_or_create_category("Food")
+    e = add_expense(date(2025, 8, 1), Decimal("4.50"), food, "coffee")
+    cursor = latest_cursor()
+    changes, cur, more = changes_since(0)
+    assert [(c["table"], c["op"]) for c in changes] == [("category", "insert"), ("expense", "insert")]
+    assert changes[1]["data"]["amount"] == 4.5 and cur == cursor and not more
+    assert changes_since(cursor) == ([], cursor, False)
+
+    # updates (including tag changes) and deletes after the cursor, nothing else
+    set_tags(e, "work")
+    set_budget("2025-08", Decimal("300"), food)
+    delete_expense(e.id)
+    changes, cur, _ = changes_since(cursor)
+    assert [(c["table"], c["op"], c["data"]) for c in changes if c["table"] == "expense"] == \
+        [("expense", "delete", None)]
+    assert [c["table"] for c in changes] == ["budget", "expense"]
+
+    # bulk writes log too
+    import_expenses([{"date": date(2025, 8, 2), "amount": Decimal("9"), "description": "x", "category": ""}])
+    recategorize_uncategorized()
+    archive_transactions(date(2025, 9, 1))
+    changes, _, _ = changes_since(cur)
+    assert changes and changes[-1]["op"] == "delete"
+    changes, _, more = changes_since(0, limit=2)
+    assert len(changes) == 2 and more
+
+
+def test_changes_api(client_routes, app_routes):
+    assert client_routes.get("/api/v1/changes").status_code == 401
+    login_as_admin(client_routes)
+    client_routes.post("/income", data={"date": "2025-08-01", "amount": "100", "source": "Salary"})
+    data = client_routes.get("/api/v1/changes?since=0").get_json()
+    assert [(c["table"], c["op"], c["data"]["source"]) for c in data["changes"]] == [("income", "insert", "Salary")]
+    assert data["has_more"] is False and data["next"] is None
+
+    client_routes.post("/income", data={"date": "2025-08-02", "amount": "5", "source": "Refund"})
+    later = client_routes.get(f"/api/v1/changes?since={data['cursor']}").get_json()
+    assert [c["data"]["source"] for c in later["changes"]] == ["Refund"]
+    assert client_routes.get("/api/v1/changes?since=abc").status_code == 400
+
+
+def test_online_backup_and_restore(tmp_path):
+    import gzip, sqlite3, threading, time
+    from datetime import datetime
+    from app import create_app
+    from backup import (backup_database, find_backup, list_backups, restore_backup, rotate_backups,
+                        verify_backup, BackupError, BackupScheduler)
+
+    db_path = tmp_path / "live.db"
+    backups = str(tmp_path / "backups")
+    app = create_app(config={"TESTING": True, "SQLALCHEMY_DATABASE_URI": f"sqlite:///{db_path}"})
+    with app.app_context():
+        food = get_or_create_category("Food")
+        for d in range(1, 29):
+            add_expense(date(2025, 2, d), Decimal(d), food, f"meal {d}")
+
+    # a writer keeps committing while the copy runs in small steps
+    stop = threading.Event()
+    def writer():
+        conn = sqlite3.connect(db_path, timeout=5)
+        while not stop.is_set():
+            conn.execute("INSERT INTO tag (name) VALUES (?)", (f"t{time.perf_counter_ns()}",))
+            conn.commit()
+        conn.close()
+    thread = threading.Thread(target=writer)
+    thread.start()
+    try:
+        first = backup_database(str(db_path), backups, pages=1, sleep=0)
+    finally:
+        stop.set()
+        thread.join()
+    verify_backup(first)
+    with gzip.open(first) as f:
+        assert f.read(16) == b"SQLite format 3\x00"
+
+    with app.app_context():
+        add_expense(date(2025, 3, 1), Decimal("99"), get_or_create_category("Food"), "after backup")
+        assert Expense.query.count() == 29
+    restore_backup(find_backup(backups), str(db_path))
+    with app.app_context():
+        db.session.remove()
+        assert Expense.query.count() == 28
+
+    # corruption is caught before anything is overwritten
+    with open(first, "r+b") as f:
+        f.seek(40)
+        f.write(b"\x00\x01")
+    with pytest.raises(BackupError):
+        restore_backup(first, str(db_path))
+    with pytest.raises(BackupError):
+        find_backup(backups, at=datetime(2000, 1, 1))
+
+    time.sleep(1.05)
+    scheduler = BackupScheduler(str(db_path), backups, interval=0, keep=1)
+    assert len(scheduler.run_once()) == 1
+    assert rotate_backups(backups, 1) == [] and len(list_backups(backups)) == 1
+
+
+def test_listings_use_slotted_rows(app_db):
+    from queries import (ExpenseRow, IncomeRow, BudgetRow, budget_rows, empty_filter, query_transactions,
+                         recent_expenses)
+
+    food = get_or_create_category("Food")
+    add_expense(date(2025, 9, 1), Decimal("3.00"), food, "tea", tags="work, morning")
+    add_income(Decimal("50"), date(2025, 9, 2), "Gift")
+    set_budget("2025-09", Decimal("100"), food)
+    set_budget("2025-09", Decimal("900"), None)
+    db.session.expunge_all()
+
+    (row,) = query_transactions(empty_filter("expense")).items
+    assert isinstance(row, ExpenseRow) and not hasattr(row, "__dict__")
+    assert (row.category, row.tags, row.amount) == ("Food", ("morning", "work"), Decimal("3.00"))
+    assert isinstance(query_transactions(empty_filter("income")).items[0], IncomeRow)
+    assert [e.description for e in recent_expenses(date(2025, 9, 1), date(2025, 9, 30))] == ["tea"]
+    assert {(b.category, b.amount) for b in budget_rows("2025-09")} == {("Food", 100), (None, 900)}
+    assert all(isinstance(b, BudgetRow) for b in budget_rows())
+    # nothing was loaded into the session
+    assert len(db.session.identity_map) == 0
+
+
+def test_spending_anomalies_flagged_at_write_time(app_db):
+    from anomalies import list_anomalies, rebuild_anomalies, dismiss_anomaly
+    from models import Anomaly, SpendStat
+
+    groceries = get_or_create_category("Groceries")
+    subs = get_or_create_category("Subscriptions")
+    for d in range(1, 21):
+        add_expense(date(2025, 1, d), Decimal(40 + d % 5), groceries, f"market {d}")
+    for m in range(1, 6):
+        add_expense(date(2025, m, 3), Decimal("15.99"), subs, "NETFLIX.COM")
+    assert Anomaly.query.count() == 0
+
+    big = add_expense(date(2025, 1, 25), Decimal("480"), groceries, "market big")
+    dup = add_expense(date(2025, 5, 5), Decimal("15.99"), subs, "Netflix.com")
+    pricier = add_expense(date(2025, 6, 3), Decimal("31.98"), subs, "Netflix com")
+    rows = {a.expense_id: a for a in list_anomalies()}
+    assert set(rows) == {big.id, dup.id, pricier.id}
+    assert "usual" in rows[big.id].reason and "category" in rows[big.id].reason
+    assert "charged again after 2 days" in rows[dup.id].reason
+
+    stat = db.session.get(SpendStat, ("category", str(groceries.id)))
+    assert stat.n == 21 and round(stat.mean, 2) == round((sum(40 + d % 5 for d in range(1, 21)) + 480) / 21, 2)
+
+    # replaying history gives the same flags and keeps dismissals
+    dismiss_anomaly(rows[dup.id].id)
+    assert rebuild_anomalies() == 3
+    assert {a.expense_id for a in list_anomalies()} == {big.id, pricier.id}
+    assert len(list_anomalies(include_dismissed=True)) == 3
+    assert db.session.get(SpendStat, ("category", str(groceries.id))).n == 21
+
+    delete_expense(big.id)
+    assert Anomaly.query.count() == 2
+
+
+def test_anomaly_routes(client_routes, app_routes):
+    login_as_admin(client_routes)
+    with app_routes.app_context():
+        food = get_or_create_category("Food")
+        for d in range(1, 11):
+            add_expense(date(2025, 2, d), Decimal("10"), food, f"lunch {d}")
+        add_expense(date(2025, 2, 20), Decimal("250"), food, "banquet")
+    resp = client_routes.get("/anomalies")
+    assert b"banquet" in resp.data and b"lunch 3" not in resp.data
+    (item,) = client_routes.get("/api/v1/anomalies").get_json()["items"]
+    assert item["description"] == "banquet" and item["score"] >= 3
+
+    client_routes.post(f"/anomalies/{item['id']}/dismiss")
+    assert client_routes.get("/api/v1/anomalies").get_json()["items"] == []
+    resp = client_routes.post("/tasks/anomalies/rebuild", follow_redirects=True)
+    assert b"1 expenses flagged" in resp.data
+
+
+def test_envelope_balances_roll_over(app_db):
+    from envelopes import envelope_balances, start_envelope, rebuild_envelopes
+    from models import EnvelopeMonth
+
+    food = get_or_create_category("Food")
+    groceries = get_or_create_category("Groceries", parent=food)
+    set_budget("2025-01", Decimal("300"), food)
+    add_expense(date(2025, 1, 10), Decimal("200"), groceries, "jan shop")
+    start_envelope(food.id, "2025-01")
+
+    # written after the envelope started: maintained incrementally
+    set_budget("2025-02", Decimal("300"), food)
+    add_expense(date(2025, 2, 5), Decimal("350"), food, "feb dinner")
+    add_expense(date(2025, 3, 1), Decimal("50"), groceries, "mar shop")
+    set_budget("2025-02", Decimal("250"), food)
+
+    def balances(month):
+        (row,) = envelope_balances(month)
+        return row.carried, row.budgeted, row.spent, row.available
+
+    assert balances("2025-01") == (0, 300, 200, 100)
+    assert balances("2025-02") == (100, 250, 350, 0)
+    assert balances("2025-03") == (0, 0, 50, -50)
+    # backdated spend moves every later month
+    e = add_expense(date(2025, 1, 20), Decimal("10"), groceries, "late receipt")
+    assert balances("2025-03")[3] == -60
+    delete_expense(e.id)
+    assert balances("2025-03")[3] == -50
+    # a month past the last row carries the last balance
+    assert balances("2099-01") == (-50, 0, 0, -50)
+    assert envelope_balances("2024-12") == []
+
+    incremental = [(r.month_key, r.cum_budgeted, r.cum_spent)
+                   for r in EnvelopeMonth.query.order_by(EnvelopeMonth.month_key)]
+    rebuild_envelopes()
+    db.session.commit()
+    assert [(r.month_key, r.cum_budgeted, r.cum_spent)
+            for r in EnvelopeMonth.query.order_by(EnvelopeMonth.month_key)] == incremental
+
+    # archiving keeps the balances (rollups stand in for the moved rows)
+    archive_transactions(date(2025, 2, 1))
+    rebuild_envelopes()
+    assert balances("2025-03")[3] == -50
+
+
+def test_envelope_routes(client_routes, app_routes):
+    login_as_admin(client_routes)
+    with app_routes.app_context():
+        food = get_or_create_category("Food")
+        set_budget("2025-04", Decimal("100"), food)
+        add_expense(date(2025, 4, 2), Decimal("30"), food, "snacks")
+        food_id = food.id
+    client_routes.post("/budgets/envelopes", data={"category_id": food_id, "start": "2025-04"})
+    resp = client_routes.get("/budgets?month=2025-05")
+    assert b"$70.00" in resp.data
+    client_routes.post(f"/budgets/envelopes/{food_id}/stop")
+    assert b"No envelopes for 2025-05" in client_routes.get("/budgets?month=2025-05").data
+
+
+def test_account_balances_and_checkpoints(app_db):
+    from accounts import (create_account, add_transfer, delete_transfer, balance_at, account_balances,
+                          rebuild_account_balances)
+    from functions import add_income, add_recurring_item, post_due_recurring
+    from models import Account, AccountDay
+
+    checking = create_account("Checking", "checking", Decimal("1000"))
+    savings = create_account("Savings", "savings")
+    food = get_or_create_category("Food")
+
+    add_income(Decimal("500"), date(2025, 1, 1), "Salary", account_id=checking.id)
+    e = add_expense(date(2025, 1, 10), Decimal("120"), food, "groceries", account_id=checking.id)
+    add_expense(date(2025, 1, 11), Decimal("5"), food, "no account")
+    t = add_transfer(checking.id, savings.id, Decimal("300"), date(2025, 1, 15), "rainy day")
+    add_recurring_item(name="Rent", kind="expense", amount=Decimal("400"), category_id=food.id, freq="monthly",
+                       start_date=date(2025, 2, 1), next_run_date=date(2025, 2, 1), auto_post=True, active=True,
+                       account_id=checking.id)
+    post_due_recurring(today=date(2025, 2, 1))
+
+    assert checking.balance == Decimal("680")
+    assert savings.balance == Decimal("300")
+    assert balance_at(checking.id, date(2024, 12, 31)) == Decimal("1000")
+    assert balance_at(checking.id, date(2025, 1, 12)) == Decimal("1380")
+    assert balance_at(checking.id, date(2025, 1, 31)) == Decimal("1080")
+    # a backdated expense moves every later checkpoint
+    late = add_expense(date(2025, 1, 5), Decimal("20"), food, "late receipt", account_id=checking.id)
+    assert balance_at(checking.id, date(2025, 1, 31)) == Decimal("1060")
+    delete_expense(late.id)
+    delete_expense(e.id)
+    assert balance_at(checking.id, date(2025, 1, 12)) == Decimal("1500")
+    assert [(r.name, r.balance) for r in account_balances(date(2025, 1, 20))] == \
+        [("Checking", Decimal("1200")), ("Savings", Decimal("300"))]
+
+    delete_transfer(t.id)
+    def checkpoints():
+        # days whose activity was deleted keep a zero-flow row until a rebuild
+        return [(d.account_id, d.date, d.balance)
+                for d in AccountDay.query.order_by(AccountDay.account_id, AccountDay.date) if d.flow]
+    incremental = checkpoints()
+    rebuild_account_balances()
+    db.session.commit()
+    assert checkpoints() == incremental
+    assert {a.name: a.balance for a in Account.query} == {"Checking": Decimal("1100"), "Savings": 0}
+
+    # archiving moves the rows but keeps the balances
+    archive_transactions(date(2025, 2, 1))
+    rebuild_account_balances()
+    db.session.commit()
+    assert balance_at(checking.id, date(2025, 1, 31)) == Decimal("1500")
+
+    with pytest.raises(ValueError):
+        add_transfer(checking.id, checking.id, Decimal("1"), date(2025, 1, 1))
+    # an unknown account is rejected before anything is added
+    expenses, incomes = Expense.query.count(), Income.query.count()
+    food = get_or_create_category("Food")
+    with pytest.raises(ValueError, match="Unknown account"):
+        add_expense(date(2025, 3, 1), Decimal("5"), food, "x", account_id=999)
+    with pytest.raises(ValueError, match="Unknown account"):
+        add_income(Decimal("5"), date(2025, 3, 1), "Job", account_id=999)
+    with pytest.raises(ValueError, match="Unknown account"):
+        import_expenses([{"date": date(2025, 3, 2), "amount": Decimal("1"), "category": "Food"}], account_id=999)
+    db.session.commit()
+    assert (Expense.query.count(), Income.query.count()) == (expenses, incomes)
+
+
+def test_account_routes(client_routes, app_routes):
+    login_as_admin(client_routes)
+    client_routes.post("/accounts", data={"name": "Wallet", "kind": "cash", "opening_balance": "50"})
+    client_routes.post("/accounts", data={"name": "Bank", "kind": "checking", "opening_balance": "200"})
+    with app_routes.app_context():
+        from models import Account
+        wallet, bank = (Account.query.filter_by(name=n).one().id for n in ("Wallet", "Bank"))
+    client_routes.post("/expenses", data={"date": "2025-03-02", "amount": "20", "category": "Food",
+                                          "account_id": wallet})
+    client_routes.post("/accounts/transfers", data={"date": "2025-03-03", "from_account_id": bank,
+                                                    "to_account_id": wallet, "amount": "40"})
+    page = client_routes.get("/accounts").data
+    assert b"$70.00" in page and b"$160.00" in page
+    assert b"$30.00" in client_routes.get("/accounts?as_of=2025-03-02").data
+
+
+def test_attachment_store_dedupes_and_sweeps(app_db, tmp_path):
+    from attachments import store_stream, add_attachment, delete_attachment, sweep_store, object_path, \
+        AttachmentTooLarge
+    import hashlib
+    import io
+    import os
+
+    root = str(tmp_path)
+    body = b"receipt " * 50_000  # several chunks
+    sha, size = store_stream(io.BytesIO(body), root)
+    assert (sha, size) == (hashlib.sha256(body).hexdigest(), len(body))
+    assert store_stream(io.BytesIO(body), root) == (sha, size)
+    assert open(object_path(root, sha), "rb").read() == body
+    with pytest.raises(AttachmentTooLarge):
+        store_stream(io.BytesIO(b"x" * 100), root, max_bytes=10)
+    assert os.listdir(tmp_path / "tmp") == []
+
+    e = add_expense(date(2025, 1, 3), Decimal("9.99"), get_or_create_category("Food"), "lunch")
+    a = add_attachment(sha, size, "/tmp/receipt.pdf", "application/pdf", expense_id=e.id)
+    assert a.filename == "receipt.pdf"
+    assert add_attachment(sha, size, "again.pdf", expense_id=e.id).id == a.id
+
+    assert sweep_store(root, min_age=0) == 0
+    delete_attachment(a.id)
+    assert sweep_store(root) == 0  # too recent: could be an upload in flight
+    assert sweep_store(root, min_age=0) == 1
+    assert not os.path.exists(object_path(root, sha))
+
+
+def test_attachment_routes_stream_and_serve_ranges(client_routes, app_routes, tmp_path):
+    import io
+    app_routes.config["ATTACHMENT_DIR"] = str(tmp_path)
+    login_as_admin(client_routes)
+    with app_routes.app_context():
+        expense_id = add_expense(date(2025, 2, 1), Decimal("12"), get_or_create_category("Food"), "taxi").id
+    body = bytes(range(256)) * 40
+    client_routes.post(f"/expenses/{expense_id}/attachments",
+                       data={"file": (io.BytesIO(body), "stub.bin", "application/octet-stream")},
+                       content_type="multipart/form-data")
+    page = client_routes.get("/expenses").data.decode()
+    assert "stub.bin" in page
+    with app_routes.app_context():
+        from models import Attachment
+        attachment_id = Attachment.query.one().id
+
+    full = client_routes.get(f"/attachments/{attachment_id}")
+    assert full.status_code == 200 and full.data == body
+    part = client_routes.get(f"/attachments/{attachment_id}", headers={"Range": "bytes=100-199"})
+    assert part.status_code == 206 and part.data == body[100:200]
+    assert client_routes.get(f"/attachments/{attachment_id}",
+                             headers={"If-None-Match": full.headers["ETag"]}).status_code == 304
+    assert client_routes.get(f"/attachments/{attachment_id}/thumbnail").status_code == 404
+    # only raster images are shown inline; anything else is a nosniff download
+    assert full.headers["Content-Disposition"].startswith("attachment")
+    assert full.headers["X-Content-Type-Options"] == "nosniff"
+    client_routes.post(f"/expenses/{expense_id}/attachments",
+                       data={"file": (io.BytesIO(b"<script>alert(1)</script>"), "x.html", "text/html")},
+                       content_type="multipart/form-data")
+    with app_routes.app_context():
+        html_id = Attachment.query.filter_by(filename="x.html").one().id
+    assert client_routes.get(f"/attachments/{html_id}").headers["Content-Disposition"].startswith("attachment")
+
+
+def test_thumbnail_failures_are_recorded_and_cleaned_up(tmp_path, monkeypatch):
+    import os
+    import attachments
+
+    class Bomb:
+        @staticmethod
+        def open(path):
+            open(attachments.thumbnail_path(str(tmp_path), "ab" * 32) + ".part", "wb").close()
+            raise ValueError("decompression bomb")
+
+    monkeypatch.setattr(attachments, "Image", Bomb)
+    thumbs = attachments.Thumbnailer(workers=1)
+    assert thumbs.submit(str(tmp_path), "ab" * 32, "image/png").result() is None
+    thumbs.shutdown()
+    assert thumbs.failures == 1 and "bomb" in str(thumbs.last_error)
+    assert os.listdir(tmp_path / "thumbs" / "ab") == []
+
+
+def test_idempotency_keys_replay_form_posts_and_run_now(client_routes, app_routes):
+    import re
+    login_as_admin(client_routes)
+    form = {"date": "2025-05-01", "amount": "12.50", "category": "Food", "description": "lunch",
+            "allow_duplicate": "y", "idempotency_key": "form-1"}
+    first = client_routes.post("/expenses", data=form)
+    again = client_routes.post("/expenses", data=form)
+    assert again.status_code == first.status_code == 302
+    assert again.headers["Idempotent-Replayed"] == "true"
+    assert client_routes.post("/expenses", data={**form, "amount": "13"}).status_code == 422
+
+    with app_routes.app_context():
+        item = add_recurring_item(name="Gym", kind="expense", amount=Decimal("30"), freq="monthly",
+                                  start_date=date(2025, 1, 1), next_run_date=date(2025, 1, 1),
+                                  auto_post=True, active=True)
+        item_id = item.id
+    page = client_routes.get("/recurring").data.decode()
+    link = re.search(rf'/recurring/{item_id}/run\?idempotency_key=\w+', page).group(0)
+    client_routes.get(link)
+    client_routes.get(link)  # retried
+    client_routes.get(f"/recurring/{item_id}/run?idempotency_key=another")
+    with app_routes.app_context():
+        assert Expense.query.filter(Expense.description == "[Recurring] Gym").count() == 2
+        assert Expense.query.filter(Expense.description == "lunch").count() == 1
+        assert RecurringItem.query.get(item_id).next_run_date == date(2025, 3, 1)
+
+    # the budget, category, rule and goal forms carry a key too
+    assert b'name="idempotency_key"' in client_routes.get("/categories").data
+    rule = {"category": "Food", "pattern": "cafe", "idempotency_key": "rule-1"}
+    client_routes.post("/categories/rules", data=rule)
+    assert client_routes.post("/categories/rules", data=rule).headers["Idempotent-Replayed"] == "true"
+    with app_routes.app_context():
+        assert CategoryRule.query.filter_by(pattern="cafe").count() == 1
+
+
+def test_api_writes_with_idempotency_key_and_sweep(client_routes, app_routes):
+    from datetime import datetime
+    from idempotency import sweep_expired
+    from models import IdempotencyKey
+
+    login_as_admin(client_routes)
+    body = {"date": "2025-06-02", "amount": "40", "category": "Travel", "currency": "USD"}
+    headers = {"Idempotency-Key": "api-1"}
+    first = client_routes.post("/api/v1/expenses", json=body, headers=headers)
+    assert first.status_code == 201 and first.json["category"] == "Travel"
+    replay = client_routes.post("/api/v1/expenses", json=body, headers=headers)
+    assert replay.status_code == 201 and replay.json == first.json
+    assert client_routes.post("/api/v1/expenses", json={**body, "amount": "41"}, headers=headers).status_code == 422
+    assert client_routes.post("/api/v1/income", json={"amount": "5"}).status_code == 400
+    for bad in ({"amount": "NaN"}, {"amount": "1e30"}, {"amount": {"x": 1}}, {"category": {"name": "x"}},
+                {"account_id": "1"}, {"tags": [1]}):
+        assert client_routes.post("/api/v1/expenses", json={**body, **bad}).status_code == 400
+    assert client_routes.post("/api/v1/income", json={"date": "2025-06-03", "amount": "5"},
+                              headers={"Idempotency-Key": "api-2"}).status_code == 201
+
+    # a rejected request leaves nothing behind, through the API or the form
+    assert client_routes.post("/api/v1/expenses", json={**body, "account_id": 999},
+                              headers={"Idempotency-Key": "api-3"}).status_code == 400
+    client_routes.post("/expenses", data={"date": "2025-06-04", "amount": "3", "category": "Food",
+                                          "account_id": "999", "idempotency_key": "form-3"})
+
+    with app_routes.app_context():
+        assert Expense.query.count() == 1
+        IdempotencyKey.query.filter_by(key="api-1").one().expires_at = datetime(2000, 1, 1)
+        db.session.commit()
+        assert sweep_expired() == 1
+        assert sorted(k.key for k in IdempotencyKey.query) == ["api-2", "api-3", "form-3"]
+    # an expired key can be used again
+    assert client_routes.post("/api/v1/expenses", json={**body, "amount": "41"}, headers=headers).status_code == 201
+
+
+def test_daily_totals_for_heatmap(app_db):
+    from functions import daily_totals
+    food = get_or_create_category("Food")
+    groceries = get_or_create_category("Groceries", parent=food)
+    rent = get_or_create_category("Rent")
+    add_expense(date(2024, 1, 1), Decimal("10"), groceries, "a")
+    add_expense(date(2024, 1, 1), Decimal("5.25"), food, "b")
+    add_expense(date(2024, 12, 31), Decimal("900"), rent, "c")
+    add_expense(date(2025, 1, 1), Decimal("1"), food, "next year")
+    add_income(Decimal("100"), date(2024, 3, 1), "Job")
+    archive_transactions(date(2024, 2, 1))  # Jan 1 now lives in the archive
+
+    spend = daily_totals(2024, "expense")
+    assert len(spend) == 366 and spend[0] == 15.25 and spend[365] == 900 and sum(spend) == 915.25
+    assert daily_totals(2024, "expense", food.id)[0] == 15.25
+    assert sum(daily_totals(2024, "expense", groceries.id)) == 10
+    assert daily_totals(2024, "income")[31 + 29] == 100
+    assert len(daily_totals(2025)) == 365
+
+
+def test_heatmap_route(client_routes, app_routes):
+    login_as_admin(client_routes)
+    with app_routes.app_context():
+        food = get_or_create_category("Food")
+        add_expense(date(2025, 2, 3), Decimal("7"), food, "snack")
+        food_id = food.id
+    data = client_routes.get("/report/data/heatmap?year=2025").json
+    assert data["start"] == "2025-01-01" and data["spend"][33] == 7 and len(data["income"]) == 365
+    by_category = client_routes.get(f"/report/data/heatmap?year=2025&category_id={food_id}").json
+    assert by_category["income"] is None and sum(by_category["spend"]) == 7
+    assert b"heatmapCategory" in client_routes.get("/report?year=2025&month=2").data
+
+
+def test_event_bus_delivers_committed_events_only(tmp_path):
+    import events
+    from events import on, ExpenseAdded
+    from app import create_app
+    from writequeue import write
+    app = create_app(config={
+        "TESTING": True, "WRITE_QUEUE": True,
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'events.db'}",
+    })
+    bus = app.extensions["events"]
+    seen, batches = [], []
+    sync = on(ExpenseAdded)(lambda evs: seen.extend(e.expense_id for e in evs))
+    background = on(ExpenseAdded, background=True, coalesce=lambda e: e.date.month)(batches.append)
+    try:
+        with app.app_context():
+            write(lambda: add_expense(date(2025, 1, 1), Decimal("5"), get_or_create_category("Food"), "a"))
+            write(lambda: add_expense(date(2025, 1, 2), Decimal("6"), get_or_create_category("Food"), "b"))
+            with pytest.raises(ZeroDivisionError):
+                # the job's savepoint is rolled back, and its event with it
+                write(lambda: (add_expense(date(2025, 2, 1), Decimal("7"), get_or_create_category("Food"), "c"), 1 / 0))
+            events.emit(ExpenseAdded(99, date(2025, 3, 1), 1, Decimal("8")))
+            db.session.rollback()
+            assert bus.wait_idle()
+            assert Expense.query.count() == 2
+        assert len(seen) == 2 and 99 not in seen
+        # January events reaching a worker together are coalesced to one
+        assert batches and all(len(b) == 1 and b[0].date.month == 1 for b in batches)
+        stats = bus.stats()
+        assert stats["published"] == 2 and stats["errors"] == 0 and stats["queued"] == 0
+    finally:
+        events._handlers.remove(next(h for h in events._handlers if h.fn is sync))
+        events._handlers.remove(next(h for h in events._handlers if h.fn is background))
+
+
+def test_event_stats_api(client_routes, app_routes):
+    login_as_admin(client_routes)
+    with app_routes.app_context():
+        add_expense(date(2025, 2, 3), Decimal("7"), get_or_create_category("Food"), "snack")
+    app_routes.extensions["events"].wait_idle()
+    stats = client_routes.get("/api/v1/events/stats").json
+    assert stats["published"] >= 1 and stats["errors"] == 0 and "queued" in stats
+
+
+def test_each_user_gets_their_own_database(tmp_path):
+    import os
+    from app import create_app
+    from shards import use_shard
+    app = create_app(config={
+        "TESTING": True, "WRITE_QUEUE": True, "SHARD_ENGINES": 1, "SHARD_DIR": str(tmp_path / "users"),
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'main.db'}",
+    })
+    admin = app.test_client()
+    login_as_admin(admin)
+    for name in ("alice", "bob"):
+        resp = admin.post("/users", data={"username": name, "password": "pw"}, follow_redirects=True)
+        assert f"User {name} created.".encode() in resp.data
+    assert b"already exists" in admin.post("/users", data={"username": "bob", "password": "x"},
+                                           follow_redirects=True).data
+
+    clients = {}
+    for name in ("alice", "bob"):
+        clients[name] = app.test_client()
+        clients[name].post("/login", data={"username": name, "password": "pw"})
+    body = {"date": "2025-06-02", "amount": "40", "category": "Travel"}
+    assert clients["alice"].post("/api/v1/expenses", json=body).status_code == 201
+    assert admin.post("/api/v1/expenses", json={**body, "amount": "7"}).status_code == 201
+
+    def amounts(client):
+        return [t["amount"] for t in client.get("/api/v1/transactions?kind=expense").json["items"]]
+    assert amounts(clients["alice"]) == [40]
+    assert amounts(clients["bob"]) == []
+    assert amounts(admin) == [7]
+    # only the administrator manages users
+    assert clients["bob"].get("/users").status_code == 302
+    assert b"Invalid username or password." in app.test_client().post(
+        "/login", data={"username": "bob", "password": "nope"}).data
+
+    assert sorted(f for f in os.listdir(tmp_path / "users") if f.endswith(".db")) == ["user-2.db", "user-3.db"]
+    shards = app.extensions["shards"]
+    assert shards.stats["evicted"] >= 1  # one engine open at a time
+    with app.app_context(), use_shard("user-2.db"):
+        assert [e.amount for e in Expense.query] == [Decimal("40.00")]
+        assert Category.query.one().name == "Travel"
+
+
+def test_user_databases_are_backed_up_and_plan_guarded(tmp_path):
+    import os
+    from app import create_app
+    from sqlalchemy import func
+    from backup import list_backups
+    from queryplan import FullScanError
+    from shards import use_shard
+    app = create_app(config={
+        "TESTING": True, "QUERY_PLAN_GUARD": True, "QUERY_PLAN_MAX_SCAN_ROWS": 0,
+        "BACKUP_INTERVAL_MINUTES": 60, "BACKUP_DIR": str(tmp_path / "backups"),
+        "SHARD_ENGINES": 1, "SHARD_DIR": str(tmp_path / "users"),
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'main.db'}",
+    })
+    admin = app.test_client()
+    login_as_admin(admin)
+    # passwords are taken as typed, surrounding spaces included
+    admin.post("/users", data={"username": "alice", "password": " pw "})
+    alice = app.test_client()
+    assert alice.post("/login", data={"username": "alice", "password": "pw"}).status_code == 200
+    assert alice.post("/login", data={"username": "alice", "password": " pw "}).status_code == 302
+    assert alice.post("/api/v1/expenses", json={"date": "2025-06-02", "amount": "4",
+                                                "category": "Food"}).status_code == 201
+
+    made = app.extensions["backups"].run_once()
+    assert len(made) == 2 and list_backups(str(tmp_path / "backups" / "users" / "user-2"))
+    assert app.extensions["backups"].run_once() == []  # nothing due yet
+
+    recorder = app.extensions["query_plans"]
+    assert len(recorder.engines) == 2  # the main database and alice's
+    with app.app_context(), use_shard("user-2.db"):
+        Expense.query.filter(func.strftime("%Y", Expense.date) == "2025").all()
+        with pytest.raises(FullScanError, match="SCAN expense"):
+            recorder.assert_no_full_scans()
+    recorder.close()
+    app.extensions["backups"].stop()
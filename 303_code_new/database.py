@@ -1,10 +1,123 @@
-
+from flask import current_app, g, has_app_context
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session
+from sqlalchemy import Table, event, inspect, text
+from sqlalchemy.sql.dml import UpdateBase
+
+# tables that only live in the main database; every other table is per user (see shards.py)
+DIRECTORY_TABLES = ("users",)
+
+
+def current_shard() -> str | None:
+    """The per-user database the session is routed to; None is the main database."""
+    return g.get("shard") if has_app_context() else None
+
+def _table_of(mapper, clause):
+    if mapper is not None:
+        return inspect(mapper).local_table
+    if isinstance(clause, Table):
+        return clause
+    if isinstance(clause, UpdateBase) and isinstance(clause.table, Table):
+        return clause.table
+    return None
+
+class ShardSession(Session):
+    """Sends everything but the directory tables to the current user's database."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        engine = super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+        shard = current_shard()
+        if shard is None or bind is not None:
+            return engine
+        table = _table_of(mapper, clause)
+        if table is not None and table.name in DIRECTORY_TABLES:
+            return engine
+        return current_app.extensions["shards"].engine(shard)
+
+db = SQLAlchemy(session_options={"class_": ShardSession})
+
+# Bump this whenever models.py changes. On startup a SQLite database whose
+# PRAGMA user_version already matches is used as-is; anything else gets
+# create_all() plus any missing columns/indexes, then the version is stamped.
+SCHEMA_VERSION = 17
 
-db = SQLAlchemy()
+# callables run after the schema was created/upgraded, e.g. to backfill a new column
+_after_sync = []
+
+def after_schema_sync(fn):
+    _after_sync.append(fn)
+    return fn
+
+def commit() -> None:
+    """Commit the session, or just flush it inside a write-queue batch (the writer commits)."""
+    if db.session.info.get("group_commit"):
+        db.session.flush()
+    else:
+        db.session.commit()
 
 def init_db(app):
     db.init_app(app)
     with app.app_context():
-        from models import Category, Expense, Income, Budget  # noqa
-        db.create_all()
+        if app.config.get("SQLITE_WAL", True) and is_sqlite_file(db.engine):
+            event.listen(db.engine, "connect", _use_wal)
+        import models  # noqa: F401  (registers every table on db.metadata)
+        if not schema_is_current():
+            sync_schema()
+
+def is_sqlite_file(engine) -> bool:
+    return engine.dialect.name == "sqlite" and engine.url.database not in (None, "", ":memory:")
+
+def _use_wal(dbapi_conn, record):
+    # readers (and online backups, see backup.py) no longer block the writer
+    dbapi_conn.execute("PRAGMA journal_mode = WAL")
+
+def schema_tables(main: bool = True) -> list:
+    """Tables of the main database, or (main=False) of a per-user one."""
+    return [t for t in db.metadata.sorted_tables if main or t.name not in DIRECTORY_TABLES]
+
+def schema_is_current(engine=None) -> bool:
+    main = engine is None
+    engine = engine if engine is not None else db.engine
+    if engine.dialect.name != "sqlite":
+        return False
+    with engine.connect() as conn:
+        version = conn.exec_driver_sql("PRAGMA user_version").scalar()
+        if version != SCHEMA_VERSION:
+            return False
+        tables = {row[0] for row in conn.exec_driver_sql(
+            "SELECT name FROM sqlite_master WHERE type = 'table'"
+        )}
+    # the tests drop_all() without resetting the version, so check tables too
+    return {t.name for t in schema_tables(main)} <= tables
+
+def sync_schema(engine=None) -> None:
+    """Create/upgrade the main database, or the per-user database behind `engine`."""
+    main = engine is None
+    engine = engine if engine is not None else db.engine
+    db.metadata.create_all(engine, tables=schema_tables(main))
+    if engine.dialect.name != "sqlite":
+        return
+    with engine.begin() as conn:
+        insp = inspect(conn)
+        for table in schema_tables(main):
+            existing = {c["name"] for c in insp.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    _add_column(conn, table.name, column)
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
+        for fn in _after_sync:
+            fn(conn)
+        conn.exec_driver_sql(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+def _add_column(conn, table_name, column) -> None:
+    col_type = column.type.compile(dialect=conn.dialect)
+    ddl = f'ALTER TABLE "{table_name}" ADD COLUMN "{column.name}" {col_type}'
+    if column.server_default is not None:
+        default = column.server_default.arg
+        if isinstance(default, str):
+            default = "'" + default.replace("'", "''") + "'"
+        else:
+            default = default.text
+        ddl += f" DEFAULT {default}"
+    conn.execute(text(ddl))
@@ -0,0 +1,183 @@
+"""
+Envelope budgeting.
+
+A category can be run as an envelope from a start month on: its available
+balance is everything budgeted for it since then minus everything spent in
+it (subcategories included), so unspent money rolls over and overspending
+reduces the months after.
+
+Balances are not summed at read time. envelope_months holds one row per
+envelope and month from its start through the current month (and any later
+month that has activity), carrying the month's budget and spend and the
+running sums through it. Writes keep it current:
+
+- an expense or budget change in month M adds its delta to that month's
+  row and to the running sums of M and every later row, one indexed
+  UPDATE each (usually just the current month's row);
+- bulk changes (category moves, recategorization, FX re-conversion) rebuild
+  the envelopes from the transactions and archive rollups.
+
+So every envelope's balance for a month is one range read of the
+(month_key, category_id) index.
+"""
+from collections import namedtuple
+from datetime import date
+from decimal import Decimal
+from sqlalchemy import delete, func, insert, select, update
+from database import db, commit
+from models import Budget, Category, CategoryClosure, Envelope, EnvelopeMonth, Expense, MonthRollup
+
+EnvelopeRow = namedtuple("EnvelopeRow", "category_id category start_month carried budgeted spent available")
+
+
+def _key(d: date) -> str:
+    return f"{d.year:04d}-{d.month:02d}"
+
+def _months(first: str, last: str) -> list:
+    """Month keys from `first` through `last`."""
+    y, m = map(int, first.split("-"))
+    keys = []
+    while (key := f"{y:04d}-{m:02d}") <= last:
+        keys.append(key)
+        y, m = (y + 1, 1) if m == 12 else (y, m + 1)
+    return keys
+
+
+def _covering(category_id: int, month_key: str) -> list:
+    """Envelopes that count spending in `category_id` during `month_key`."""
+    return list(db.session.scalars(
+        select(Envelope.category_id)
+        .join(CategoryClosure, CategoryClosure.ancestor_id == Envelope.category_id)
+        .where(CategoryClosure.descendant_id == category_id, Envelope.start_month <= month_key)
+    ))
+
+def _extend(envelope_id: int, through: str) -> None:
+    """Add zero-activity rows carrying the running sums up to `through`."""
+    last = db.session.execute(
+        select(EnvelopeMonth.month_key, EnvelopeMonth.cum_budgeted, EnvelopeMonth.cum_spent)
+        .where(EnvelopeMonth.category_id == envelope_id)
+        .order_by(EnvelopeMonth.month_key.desc())
+        .limit(1)
+    ).first()
+    if last is None or last.month_key >= through:
+        return
+    db.session.execute(insert(EnvelopeMonth), [
+        {"category_id": envelope_id, "month_key": key, "budgeted": 0, "spent": 0,
+         "cum_budgeted": last.cum_budgeted, "cum_spent": last.cum_spent}
+        for key in _months(last.month_key, through)[1:]
+    ])
+
+def _apply(envelope_ids, month_key: str, budgeted=0, spent=0) -> None:
+    for envelope_id in envelope_ids:
+        _extend(envelope_id, month_key)
+    rows = EnvelopeMonth.category_id.in_(envelope_ids)
+    db.session.execute(
+        update(EnvelopeMonth).where(rows, EnvelopeMonth.month_key == month_key)
+        .values(budgeted=EnvelopeMonth.budgeted + budgeted, spent=EnvelopeMonth.spent + spent),
+        execution_options={"synchronize_session": False},
+    )
+    db.session.execute(
+        update(EnvelopeMonth).where(rows, EnvelopeMonth.month_key >= month_key)
+        .values(cum_budgeted=EnvelopeMonth.cum_budgeted + budgeted, cum_spent=EnvelopeMonth.cum_spent + spent),
+        execution_options={"synchronize_session": False},
+    )
+
+def record_spend(rows) -> None:
+    """Fold (category_id, date, base_amount) rows into the envelopes covering them; negative undoes."""
+    by_month = {}
+    for category_id, when, amount in rows:
+        key = (category_id, _key(when))
+        by_month[key] = by_month.get(key, Decimal(0)) + Decimal(amount)
+    for (category_id, month_key), amount in by_month.items():
+        envelope_ids = _covering(category_id, month_key)
+        if envelope_ids and amount:
+            _apply(envelope_ids, month_key, spent=amount)
+
+def record_budget(category_id: int, month_key: str, delta) -> None:
+    """A category's budget for `month_key` changed by `delta`."""
+    start = db.session.scalar(select(Envelope.start_month).where(Envelope.category_id == category_id))
+    if start is not None and start <= month_key and delta:
+        _apply([category_id], month_key, budgeted=Decimal(delta))
+
+
+def rebuild_envelopes(category_ids=None) -> None:
+    """Recompute the running totals of the given envelopes (default: all) from scratch."""
+    query = Envelope.query
+    if category_ids is not None:
+        query = query.filter(Envelope.category_id.in_(list(category_ids)))
+    for env in query.all():
+        cid, start = env.category_id, env.start_month
+        db.session.execute(delete(EnvelopeMonth).where(EnvelopeMonth.category_id == cid))
+        budgeted = dict(db.session.execute(
+            select(Budget.month_key, Budget.amount).where(Budget.category_id == cid, Budget.month_key >= start)
+        ).all())
+        spent = {}
+        month = func.strftime("%Y-%m", Expense.date)
+        live = (
+            select(month, func.sum(Expense.base_amount))
+            .join(CategoryClosure, CategoryClosure.descendant_id == Expense.category_id)
+            .where(CategoryClosure.ancestor_id == cid, Expense.date >= date.fromisoformat(start + "-01"))
+            .group_by(month)
+        )
+        archived = (
+            select(MonthRollup.month_key, func.sum(MonthRollup.total))
+            .join(CategoryClosure, CategoryClosure.descendant_id == MonthRollup.category_id)
+            .where(CategoryClosure.ancestor_id == cid, MonthRollup.kind == "expense", MonthRollup.month_key >= start)
+            .group_by(MonthRollup.month_key)
+        )
+        for stmt in (live, archived):
+            for key, total in db.session.execute(stmt):
+                spent[key] = spent.get(key, Decimal(0)) + Decimal(str(total or 0))
+
+        last = max([_key(date.today()), start, *budgeted, *spent])
+        rows, cum_b, cum_s = [], Decimal(0), Decimal(0)
+        for key in _months(start, last):
+            b, s = Decimal(budgeted.get(key, 0)), spent.get(key, Decimal(0))
+            cum_b, cum_s = cum_b + b, cum_s + s
+            rows.append({"category_id": cid, "month_key": key, "budgeted": b, "spent": s,
+                         "cum_budgeted": cum_b, "cum_spent": cum_s})
+        db.session.execute(insert(EnvelopeMonth), rows)
+
+def start_envelope(category_id: int, start_month: str) -> None:
+    env = db.session.get(Envelope, category_id)
+    if env is None:
+        env = Envelope(category_id=category_id, start_month=start_month)
+        db.session.add(env)
+    env.start_month = start_month
+    db.session.flush()
+    rebuild_envelopes([category_id])
+    commit()
+
+def stop_envelope(category_id: int) -> None:
+    db.session.execute(delete(EnvelopeMonth).where(EnvelopeMonth.category_id == category_id))
+    db.session.execute(delete(Envelope).where(Envelope.category_id == category_id))
+    commit()
+
+
+def envelope_balances(month_key: str) -> list:
+    """EnvelopeRow per envelope started by `month_key`, by category name."""
+    columns = (EnvelopeMonth.category_id, Category.name, Envelope.start_month,
+               EnvelopeMonth.budgeted, EnvelopeMonth.spent, EnvelopeMonth.cum_budgeted, EnvelopeMonth.cum_spent)
+    base = (
+        select(*columns)
+        .join(Envelope, Envelope.category_id == EnvelopeMonth.category_id)
+        .join(Category, Category.id == EnvelopeMonth.category_id)
+    )
+    found = db.session.execute(base.where(EnvelopeMonth.month_key == month_key)).all()
+    rows = [(cid, name, start, b, s, cb - cs) for cid, name, start, b, s, cb, cs in found]
+
+    # months past an envelope's last row (no activity yet) carry its last balance
+    seen = {r[0] for r in found}
+    behind = select(EnvelopeMonth.category_id, func.max(EnvelopeMonth.month_key).label("month_key")) \
+        .where(EnvelopeMonth.month_key < month_key, EnvelopeMonth.category_id.not_in(seen)) \
+        .group_by(EnvelopeMonth.category_id).subquery()
+    for cid, name, start, _, _, cb, cs in db.session.execute(
+        base.join(behind, (behind.c.category_id == EnvelopeMonth.category_id)
+                  & (behind.c.month_key == EnvelopeMonth.month_key))
+    ):
+        rows.append((cid, name, start, Decimal(0), Decimal(0), cb - cs))
+
+    return [
+        EnvelopeRow(cid, name, start, carried=available - b + s, budgeted=b, spent=s, available=available)
+        for cid, name, start, b, s, available in sorted(rows, key=lambda r: r[1].lower())
+    ]
@@ -0,0 +1,203 @@
+"""
+Domain events, delivered after commit.
+
+Write helpers in functions.py describe what they changed with emit(), e.g.
+emit(ExpenseAdded(...)). Events are held on the session and only delivered
+once the transaction has committed; a rollback (or, in the write queue, a
+job's savepoint rollback) drops them. So a handler never sees a change that
+did not happen, and the write itself never waits for derived data.
+
+Handlers subscribe with @on(EventType, ...) and always get a list of events:
+
+- synchronous handlers (the default) run in the committing thread, inside
+  the after_commit hook. They must be cheap and must not use the session;
+  use them for things like cache invalidation;
+- background=True handlers run on the bus's worker threads (EVENT_WORKERS)
+  with an app context. Each worker takes everything queued (up to
+  EVENT_BATCH_MAX events) and calls each handler once with the events it
+  subscribed to. With coalesce=fn, events with the same fn(event) key are
+  collapsed to the last one, so a burst of writes to one month costs one
+  recomputation. With EVENT_WORKERS = 0 they run synchronously instead.
+  They run on the user database (shards.py) the events were committed in.
+
+bus.stats() reports queue depth and counters (GET /api/v1/events/stats).
+"""
+import os
+import queue
+import threading
+import time
+from collections import namedtuple
+from flask import current_app, g, has_app_context
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from database import db, current_shard
+
+ExpenseAdded = namedtuple("ExpenseAdded", "expense_id date category_id base_amount")
+ExpenseDeleted = namedtuple("ExpenseDeleted", "expense_id date category_id base_amount")
+IncomeAdded = namedtuple("IncomeAdded", "income_id date base_amount")
+BudgetSet = namedtuple("BudgetSet", "month_key category_id amount")
+RecurringPosted = namedtuple("RecurringPosted", "item_id kind date")
+
+Handler = namedtuple("Handler", "fn types background coalesce")
+
+_handlers = []
+_PENDING = "pending_events"
+
+
+def on(*types, background: bool = False, coalesce=None):
+    """Register fn(events) for the given event types."""
+    def register(fn):
+        _handlers.append(Handler(fn, types, background, coalesce))
+        return fn
+    return register
+
+def emit(ev) -> None:
+    """Queue an event on the current session, to be delivered after it commits."""
+    db.session.info.setdefault(_PENDING, []).append(ev)
+
+def pending_mark(session) -> int:
+    return len(session.info.get(_PENDING, ()))
+
+def discard_since(session, mark: int) -> None:
+    """Drop events emitted after `mark` (their savepoint was rolled back)."""
+    del session.info.get(_PENDING, [])[mark:]
+
+
+# SQLAlchemy fires both of these for SAVEPOINTs too (one per write-queue
+# job); only the outermost transaction delivers or drops the batch's events
+@event.listens_for(Session, "after_commit")
+def _deliver(session):
+    if session.in_nested_transaction():
+        return
+    events = session.info.pop(_PENDING, None)
+    if events and has_app_context():
+        bus = current_app.extensions.get("events")
+        if bus is not None:
+            bus.publish(events)
+
+@event.listens_for(Session, "after_rollback")
+def _drop(session):
+    # a rolled-back job's own events are dropped by discard_since()
+    if not session.in_nested_transaction():
+        session.info.pop(_PENDING, None)
+
+
+def _dispatch(handlers, events) -> dict:
+    """Run each handler on its events; returns the counters to add to the bus's stats."""
+    counts = {"handled": 0, "coalesced": 0, "errors": 0}
+    for h in handlers:
+        mine = [e for e in events if isinstance(e, h.types)]
+        if not mine:
+            continue
+        if h.coalesce is not None:
+            latest = {h.coalesce(e): e for e in mine}
+            counts["coalesced"] += len(mine) - len(latest)
+            mine = list(latest.values())
+        try:
+            h.fn(mine)
+            counts["handled"] += 1
+        except Exception as e:
+            counts["errors"] += 1
+            counts["last_error"] = repr(e)
+    return counts
+
+
+class EventBus:
+    def __init__(self, app, workers: int = 1, batch_max: int = 500):
+        self.app = app
+        self.workers = workers
+        self.batch_max = batch_max
+        self._stats = {"published": 0, "batches": 0, "handled": 0, "coalesced": 0, "errors": 0,
+                       "max_depth": 0, "last_error": None}
+        self._queue = queue.Queue()
+        self._busy = 0
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def publish(self, events) -> None:
+        self._count(published=len(events))
+        self._count(**_dispatch([h for h in _handlers if not h.background], events))
+        if not any(h.background for h in _handlers):
+            return
+        shard = current_shard()
+        if not self.workers:
+            self._run_batch(shard, events)
+            return
+        self._ensure_running()
+        for ev in events:
+            self._queue.put((shard, ev))
+        depth = self._queue.qsize()
+        with self._lock:
+            self._stats["max_depth"] = max(self._stats["max_depth"], depth)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self._stats, "queued": self._queue.qsize(), "in_flight": self._busy,
+                    "workers": self.workers}
+
+    def _count(self, last_error=None, **counts) -> None:
+        # request threads and workers all update these
+        with self._lock:
+            for name, n in counts.items():
+                self._stats[name] += n
+            if last_error is not None:
+                self._stats["last_error"] = last_error
+
+    def wait_idle(self, timeout: float = 5.0) -> bool:
+        """Block until every queued event has been handled (tests, shutdown)."""
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if time.monotonic() > deadline:
+                return False
+            time.sleep(0.005)
+        return True
+
+    def _ensure_running(self):
+        # threads do not survive fork(), so a forked worker starts its own
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._queue = queue.Queue()
+                for i in range(self.workers):
+                    threading.Thread(target=self._run, name=f"events-{i}", daemon=True).start()
+                self._pid = os.getpid()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_max:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            with self._lock:
+                self._busy += 1
+            by_shard = {}
+            for shard, ev in batch:
+                by_shard.setdefault(shard, []).append(ev)
+            try:
+                for shard, events in by_shard.items():
+                    self._run_batch(shard, events)
+            finally:
+                with self._lock:
+                    self._busy -= 1
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _run_batch(self, shard, events):
+        self._count(batches=1)
+        with self.app.app_context():
+            g.shard = shard
+            try:
+                self._count(**_dispatch([h for h in _handlers if h.background], events))
+            finally:
+                db.session.remove()
+
+
+def init_events(app):
+    app.extensions["events"] = EventBus(
+        app,
+        workers=app.config.get("EVENT_WORKERS", 1),
+        batch_max=app.config.get("EVENT_BATCH_MAX", 500),
+    )
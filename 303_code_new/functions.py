@@ -1,9 +1,27 @@
 
-from datetime import date, timedelta
-from decimal import Decimal
-from sqlalchemy import func
-from database import db
-from models import Category, Expense, Budget, Income, SavingsGoal
+import csv
+import io
+from datetime import date, datetime, timedelta
+from decimal import Decimal, InvalidOperation
+from sqlalchemy import func, select, union_all, insert, update, delete
+from sqlalchemy.orm import aliased
+from database import db, commit
+from models import (
+    Category, CategoryClosure, Expense, Budget, Income, SavingsGoal, Anomaly,
+    ArchivedExpense, ArchivedIncome, MonthRollup, CategoryRule,
+    expense_tags, income_tags,
+    expense_fingerprint,
+)
+from categorize import load_rule_matcher, rules_changed, validate_rule
+from tags import get_or_create_tags, matching_ids, tag_names
+from queries import where_clause
+from fx import RateTable, normalize_currency, to_base
+from changes import log_changes
+from anomalies import observe_expenses
+from envelopes import record_spend, record_budget, rebuild_envelopes
+from accounts import check_account, record_flow, record_flows
+from attachments import delete_attachments_of
+from events import emit, ExpenseAdded, ExpenseDeleted, IncomeAdded, BudgetSet, RecurringPosted
 
 
 def month_bounds(year: int, month: int):
@@ -24,50 +42,187 @@ def all_categories():
 # =========================
 # US2: Categorization
 # =========================
-def get_or_create_category(name: str) -> Category:
-    name = (name or "").strip()
-    cat = Category.query.filter_by(name=name).first()
-    if not cat:
-        cat = Category(name=name)
-        db.session.add(cat)
-        db.session.commit()
+def get_or_create_category(name: str, parent: Category | None = None) -> Category:
+    """
+    "Groceries" or a path like "Food > Groceries". Missing categories are
+    created under the previous path element (the first one under `parent`).
+    Names are unique, so an existing category is reused wherever it sits.
+    """
+    cat = parent
+    for part in (name or "").split(">"):
+        part = part.strip()
+        found = Category.query.filter_by(name=part).first()
+        if not found:
+            found = Category(name=part, parent=cat)
+            db.session.add(found)
+            commit()
+        cat = found
     return cat
 
+def set_category_parent(category: Category, parent: Category | None) -> Category:
+    """Move a category (with its whole subtree) under `parent`, or to the top level."""
+    cc = CategoryClosure
+    if parent is not None and db.session.get(cc, (category.id, parent.id)):
+        raise ValueError("A category cannot be moved under itself or one of its subcategories")
+    subtree = select(cc.descendant_id).where(cc.ancestor_id == category.id)
+    # unlink the subtree from its old ancestors, then link it to the new ones
+    db.session.execute(
+        delete(cc).where(cc.descendant_id.in_(subtree), cc.ancestor_id.not_in(subtree)),
+        execution_options={"synchronize_session": False},
+    )
+    if parent is not None:
+        up, down = aliased(cc), aliased(cc)
+        db.session.execute(insert(cc).from_select(
+            ["ancestor_id", "descendant_id", "depth"],
+            select(up.ancestor_id, down.descendant_id, up.depth + down.depth + 1)
+            .where(up.descendant_id == parent.id, down.ancestor_id == category.id),
+        ))
+    shift = (parent.level + 1 if parent is not None else 0) - category.level
+    if shift:
+        db.session.execute(
+            update(Category).where(Category.id.in_(subtree)).values(level=Category.level + shift),
+            execution_options={"synchronize_session": "fetch"},
+        )
+        log_changes(Category, "update", select(Category.id).where(Category.id.in_(subtree), Category.id != category.id))
+    category.parent = parent
+    db.session.flush()
+    rebuild_envelopes()
+    commit()
+    return category
+
+def category_paths() -> dict:
+    """{category id: "Food > Groceries > Costco"} for every category."""
+    ancestor = aliased(Category)
+    rows = (
+        db.session.query(CategoryClosure.descendant_id, ancestor.name)
+        .join(ancestor, ancestor.id == CategoryClosure.ancestor_id)
+        .order_by(CategoryClosure.descendant_id, CategoryClosure.depth.desc())
+    )
+    paths = {}
+    for cid, name in rows:
+        paths.setdefault(cid, []).append(name)
+    return {cid: " > ".join(names) for cid, names in paths.items()}
+
 # =========================
 # US1: Expense Tracking
 # =========================
-def add_expense(when: date, amount: Decimal, category: Category, description: str = "") -> Expense:
-    e = Expense(date=when, amount=amount, category=category, description=description)
+class DuplicateExpenseError(ValueError):
+    pass
+
+def find_duplicate_expense(fingerprint: str) -> Expense|None:
+    return Expense.query.filter_by(fingerprint=fingerprint).first()
+
+def add_expense(when: date, amount: Decimal, category: Category, description: str = "",
+                allow_duplicate: bool = False, tags=None, currency: str | None = None,
+                account_id: int | None = None) -> Expense:
+    """`currency` defaults to the base currency; other currencies need a rate on or before `when`."""
+    check_account(account_id)
+    currency = normalize_currency(currency)
+    base_amount = to_base(amount, currency, when)
+    if category.id is None:
+        db.session.flush()
+    fp = expense_fingerprint(when, amount, description, category.id, currency)
+    if not allow_duplicate:
+        dup = find_duplicate_expense(fp)
+        if dup:
+            raise DuplicateExpenseError(
+                f"same date, amount, description and category as expense #{dup.id}"
+            )
+    e = Expense(date=when, amount=amount, currency=currency, base_amount=base_amount, category=category,
+                description=description, fingerprint=fp, tags=get_or_create_tags(tags), account_id=account_id)
     db.session.add(e)
-    db.session.commit()
+    db.session.flush()
+    observe_expenses([(e.id, when, category.id, description, base_amount)])
+    record_spend([(category.id, when, base_amount)])
+    record_flow(account_id, when, -base_amount)
+    emit(ExpenseAdded(e.id, when, category.id, base_amount))
+    commit()
     return e
 
+def set_tags(item, tags) -> None:
+    """Replace the tags of an Expense or Income."""
+    item.tags = get_or_create_tags(tags)
+    commit()
+
 def delete_expense(expense_id: int):
     e = Expense.query.get(expense_id)
     if e:
+        record_spend([(e.category_id, e.date, -e.base_amount)])
+        record_flow(e.account_id, e.date, e.base_amount)
+        delete_attachments_of(expense_id=e.id)
+        emit(ExpenseDeleted(e.id, e.date, e.category_id, e.base_amount))
         db.session.delete(e)
-        db.session.commit()
+        commit()
+
+def _live_rows(model, start: date, end: date, tag_filter=None):
+    cond = (model.date >= start) & (model.date <= end)
+    if tag_filter:
+        cond &= model.id.in_(matching_ids(model, tag_filter))
+    return cond
 
-def monthly_spend_by_category(year: int, month: int):
+def _month_spend(year: int, month: int, tag_filter=None):
+    """
+    (category_id, amount) rows of a month: live expenses plus archived rollups.
+    Archived rows carry no tags, so a tag filter leaves the rollups out.
+    """
     start, end = month_bounds(year, month)
-    rows = (
-        db.session.query(
-            Category.name.label("category"),
-            func.coalesce(func.sum(Expense.amount), 0).label("spent")
+    live = select(Expense.category_id.label("category_id"), Expense.base_amount.label("amount")).where(
+        _live_rows(Expense, start, end, tag_filter)
+    )
+    if tag_filter:
+        return live.subquery()
+    return union_all(
+        live,
+        select(MonthRollup.category_id, MonthRollup.total)
+        .where(MonthRollup.month_key == month_key_from_date(start), MonthRollup.kind == "expense"),
+    ).subquery()
+
+def monthly_spend_by_category(year: int, month: int, level: int | None = None, tag_filter=None):
+    """
+    Spend per category. With `level`, spend is rolled up to the ancestor at
+    that level (0 = top-level categories); shallower categories keep their own.
+    """
+    spend = _month_spend(year, month, tag_filter)
+    columns = (Category.name.label("category"), func.coalesce(func.sum(spend.c.amount), 0).label("spent"))
+    if level is None:
+        query = db.session.query(*columns).join(spend, spend.c.category_id == Category.id)
+    else:
+        own = aliased(Category)
+        query = (
+            db.session.query(*columns)
+            .select_from(spend)
+            .join(own, own.id == spend.c.category_id)
+            .join(CategoryClosure, (CategoryClosure.descendant_id == spend.c.category_id)
+                  & (CategoryClosure.depth == func.max(own.level - level, 0)))
+            .join(Category, Category.id == CategoryClosure.ancestor_id)
         )
-        .join(Expense, Expense.category_id == Category.id)
-        .filter((Expense.date >= start) & (Expense.date <= end))
-        .group_by(Category.name)
-        .order_by(func.sum(Expense.amount).desc())
-        .all()
+    return query.group_by(Category.name).order_by(func.sum(spend.c.amount).desc()).all()
+
+def spend_by_subtree(year: int, month: int, category_ids) -> dict:
+    """{category id: spend in that category and all of its subcategories}."""
+    if not category_ids:
+        return {}
+    spend = _month_spend(year, month)
+    rows = (
+        db.session.query(CategoryClosure.ancestor_id, func.sum(spend.c.amount))
+        .join(spend, spend.c.category_id == CategoryClosure.descendant_id)
+        .filter(CategoryClosure.ancestor_id.in_(list(category_ids)))
+        .group_by(CategoryClosure.ancestor_id)
+    )
+    return {cid: float(total or 0.0) for cid, total in rows}
+
+def _archived_total(kind: str, start: date):
+    return (
+        select(func.sum(MonthRollup.total))
+        .where(MonthRollup.month_key == month_key_from_date(start), MonthRollup.kind == kind)
+        .scalar_subquery()
     )
-    return rows
 
-def monthly_total_spend(year: int, month: int) -> float:
+def monthly_total_spend(year: int, month: int, tag_filter=None) -> float:
     start, end = month_bounds(year, month)
-    total = db.session.query(func.coalesce(func.sum(Expense.amount), 0)).filter(
-        (Expense.date >= start) & (Expense.date <= end)
-    ).scalar()
+    live = select(func.sum(Expense.base_amount)).where(_live_rows(Expense, start, end, tag_filter)).scalar_subquery()
+    archived = 0 if tag_filter else func.coalesce(_archived_total("expense", start), 0)
+    total = db.session.query(func.coalesce(live, 0) + archived).scalar()
     return float(total or 0.0)
 
 # =========================
@@ -75,33 +230,114 @@ def monthly_total_spend(year: int, month: int) -> float:
 # =========================
 def set_budget(month_key: str, amount: Decimal, category: Category | None):
     b = Budget.query.filter_by(month_key=month_key, category=category).first()
+    old = Decimal(b.amount) if b else Decimal(0)
     if not b:
         b = Budget(month_key=month_key, amount=amount, category=category)
         db.session.add(b)
     else:
         b.amount = amount
-    db.session.commit()
+    if category is not None:
+        db.session.flush()
+        record_budget(category.id, month_key, Decimal(amount) - old)
+    emit(BudgetSet(month_key, category.id if category is not None else None, Decimal(amount)))
+    commit()
     return b
 
+def budget_actuals(budgets) -> dict:
+    """{budget id: spend in its month}; a category budget includes its subcategories."""
+    by_month = {}
+    for b in budgets:
+        by_month.setdefault(b.month_key, []).append(b)
+    actuals = {}
+    for key, items in by_month.items():
+        year, month = map(int, key.split("-"))
+        spent = spend_by_subtree(year, month, [b.category_id for b in items if b.category_id])
+        for b in items:
+            actuals[b.id] = spent.get(b.category_id, 0.0) if b.category_id else monthly_total_spend(year, month)
+    return actuals
+
 # =========================
 # US3: Income Tracking
 # =========================
-def add_income(amount: Decimal, when: date, source: str = "Other"):
-    i = Income(amount=amount, date=when, source=source.strip() or "Other")
+def add_income(amount: Decimal, when: date, source: str = "Other", tags=None, currency: str | None = None,
+               account_id: int | None = None):
+    check_account(account_id)
+    currency = normalize_currency(currency)
+    i = Income(amount=amount, currency=currency, base_amount=to_base(amount, currency, when), date=when,
+               source=source.strip() or "Other", tags=get_or_create_tags(tags), account_id=account_id)
     db.session.add(i)
-    db.session.commit()
+    record_flow(account_id, when, i.base_amount)
+    db.session.flush()
+    emit(IncomeAdded(i.id, when, i.base_amount))
+    commit()
     return i
 
-def monthly_total_income(year: int, month: int) -> float:
+def monthly_total_income(year: int, month: int, tag_filter=None) -> float:
     start, end = month_bounds(year, month)
-    total = db.session.query(func.coalesce(func.sum(Income.amount), 0)).filter(
-        (Income.date >= start) & (Income.date <= end)
-    ).scalar()
+    live = select(func.sum(Income.base_amount)).where(_live_rows(Income, start, end, tag_filter)).scalar_subquery()
+    archived = 0 if tag_filter else func.coalesce(_archived_total("income", start), 0)
+    total = db.session.query(func.coalesce(live, 0) + archived).scalar()
     return float(total or 0.0)
 
 # Net flow ties US3 (income) with US1 (spend)
 def monthly_net_flow(year: int, month: int) -> float:
     return monthly_total_income(year, month) - monthly_total_spend(year, month)
+
+def daily_totals(year: int, kind: str = "expense", category_id: int | None = None) -> list:
+    """
+    Total per day of `year` (index 0 = Jan 1), live and archived rows, for the
+    calendar heatmap. `category_id` (expenses only) includes subcategories.
+    One grouped query per table, each answered from a (date, base_amount)
+    covering index; a union of the two would have to be materialized first.
+    """
+    start, end = date(year, 1, 1), date(year, 12, 31)
+    models = (Expense, ArchivedExpense) if kind == "expense" else (Income, ArchivedIncome)
+    days = [0.0] * ((end - start).days + 1)
+    for model in models:
+        stmt = select(model.date, func.total(model.base_amount)).where(model.date.between(start, end))
+        if category_id is not None:
+            # a join (not IN) lets SQLite drive from the subtree into the (category_id, date) index
+            stmt = stmt.join(CategoryClosure, CategoryClosure.descendant_id == model.category_id) \
+                .where(CategoryClosure.ancestor_id == category_id)
+        for day, total in db.session.execute(stmt.group_by(model.date)):
+            days[(day - start).days] = round(days[(day - start).days] + total, 2)
+    return days
+
+def monthly_trend(year: int, month: int, months: int = 6, tag_filter=None) -> list:
+    """Spend and income for the `months` months ending at year/month, oldest first."""
+    periods = []
+    for i in range(months - 1, -1, -1):
+        index = year * 12 + (month - 1) - i
+        periods.append((index // 12, index % 12 + 1))
+    start, _ = month_bounds(*periods[0])
+    _, end = month_bounds(*periods[-1])
+
+    # one grouped query per table instead of two queries per month
+    totals = {}
+    for model, kind in ((Expense, "expense"), (Income, "income")):
+        month_col = func.strftime("%Y-%m", model.date)
+        rows = select(month_col.label("month_key"), model.base_amount.label("amount")).where(
+            _live_rows(model, start, end, tag_filter)
+        )
+        if not tag_filter:
+            rows = union_all(
+                rows,
+                select(MonthRollup.month_key, MonthRollup.total)
+                .where(MonthRollup.kind == kind,
+                       MonthRollup.month_key.between(month_key_from_date(start), month_key_from_date(end))),
+            )
+        rows = rows.subquery()
+        for key, total in db.session.query(rows.c.month_key, func.sum(rows.c.amount)).group_by(rows.c.month_key):
+            totals[(kind, key)] = float(total or 0.0)
+
+    return [
+        {
+            "month": date(y, m, 1).strftime("%b %Y"),
+            "spend": totals.get(("expense", f"{y:04d}-{m:02d}"), 0.0),
+            "income": totals.get(("income", f"{y:04d}-{m:02d}"), 0.0),
+        }
+        for y, m in periods
+    ]
     # =========================
 # US5: Savings Goal helpers
 # =========================
@@ -109,7 +345,7 @@ def create_savings_goal(name: str, target_amount: Decimal) -> SavingsGoal:
     """Create and store a new savings goal."""
     goal = SavingsGoal(name=name.strip(), target_amount=target_amount)
     db.session.add(goal)
-    db.session.commit()
+    commit()
     return goal
 
 def get_active_goal() -> SavingsGoal | None:
@@ -157,7 +393,7 @@ from datetime import date, timedelta
 from calendar import monthrange
 from decimal import Decimal
 from models import RecurringItem, Category
-from database import db
+from database import db, commit
 
 def _advance_date(d: date, freq: str, every_n_days: int|None, day_of_month: int|None) -> date:
     if freq == "weekly":
@@ -176,7 +412,7 @@ def _advance_date(d: date, freq: str, every_n_days: int|None, day_of_month: int|
 def add_recurring_item(**kwargs) -> RecurringItem:
     item = RecurringItem(**kwargs)
     db.session.add(item)
-    db.session.commit()
+    commit()
     return item
 
 def update_recurring_item(item_id: int, **kwargs) -> RecurringItem|None:
@@ -185,23 +421,25 @@ def update_recurring_item(item_id: int, **kwargs) -> RecurringItem|None:
         return None
     for k, v in kwargs.items():
         setattr(item, k, v)
-    db.session.commit()
+    commit()
     return item
 
 def delete_recurring_item(item_id: int) -> None:
     obj = RecurringItem.query.get(item_id)
     if obj:
         db.session.delete(obj)
-        db.session.commit()
+        commit()
 
 def _post_single(item: RecurringItem, when: date) -> None:
+    emit(RecurringPosted(item.id, item.kind, when))
     # Use existing helpers to create real transactions
     if item.kind == "expense":
-        cat = item.category or get_or_create_category("General")
-        add_expense(when=when, amount=Decimal(item.amount), category=cat, description=f"[Recurring] {item.name}")
+        cat = item.category or _rule_category(item.name, item.amount) or get_or_create_category("General")
+        add_expense(when=when, amount=Decimal(item.amount), category=cat,
+                    description=f"[Recurring] {item.name}", allow_duplicate=True, account_id=item.account_id)
     else:
         src = (item.income_source or "Recurring").strip()
-        add_income(amount=Decimal(item.amount), when=when, source=src)
+        add_income(amount=Decimal(item.amount), when=when, source=src, account_id=item.account_id)
 
 def post_due_recurring(today: date|None = None) -> int:
     """Post all due items (active, auto_post, next_run_date <= today)."""
@@ -219,7 +457,7 @@ def post_due_recurring(today: date|None = None) -> int:
         _post_single(it, when=it.next_run_date)
         it.next_run_date = _advance_date(it.next_run_date, it.freq, it.every_n_days, it.day_of_month)
         posted += 1
-    db.session.commit()
+    commit()
     return posted
 
 def predicted_totals_for_month(year: int, month: int) -> dict:
@@ -241,3 +479,309 @@ def predicted_totals_for_month(year: int, month: int) -> dict:
             steps += 1
     return {"predicted_expense": float(expense_sum), "predicted_income": float(income_sum)}
 
+
+
+# =========================
+# Archival (cold storage)
+# =========================
+def archive_cutoff(months: int, today: date|None = None) -> date:
+    """First day of the month that is `months` months before today's month."""
+    today = today or date.today()
+    index = today.year * 12 + (today.month - 1) - months
+    return date(index // 12, index % 12 + 1, 1)
+
+def _add_to_rollup(month_key: str, kind: str, total, count: int,
+                   category_id: int|None = None, source: str|None = None) -> None:
+    r = MonthRollup.query.filter_by(
+        month_key=month_key, kind=kind, category_id=category_id, source=source
+    ).first()
+    if not r:
+        r = MonthRollup(month_key=month_key, kind=kind, category_id=category_id,
+                        source=source, total=0, count=0)
+        db.session.add(r)
+    r.total = Decimal(r.total or 0) + Decimal(total)
+    r.count = (r.count or 0) + count
+
+def archive_transactions(cutoff: date) -> dict:
+    """
+    Move expenses and income dated before `cutoff` into the archive tables
+    and fold them into the month rollups. Only whole months are archived,
+    so the cutoff is rounded down to the first of its month.
+    """
+    cutoff = date(cutoff.year, cutoff.month, 1)
+
+    exp_month = func.strftime("%Y-%m", Expense.date)
+    for key, cat_id, total, count in (
+        db.session.query(exp_month, Expense.category_id, func.sum(Expense.base_amount), func.count(Expense.id))
+        .filter(Expense.date < cutoff)
+        .group_by(exp_month, Expense.category_id)
+    ):
+        _add_to_rollup(key, "expense", total, count, category_id=cat_id)
+
+    inc_month = func.strftime("%Y-%m", Income.date)
+    for key, source, total, count in (
+        db.session.query(inc_month, Income.source, func.sum(Income.base_amount), func.count(Income.id))
+        .filter(Income.date < cutoff)
+        .group_by(inc_month, Income.source)
+    ):
+        _add_to_rollup(key, "income", total, count, source=source)
+
+    db.session.execute(insert(ArchivedExpense).from_select(
+        ["id", "date", "amount", "description", "category_id", "currency", "base_amount", "account_id"],
+        select(Expense.id, Expense.date, Expense.amount, Expense.description, Expense.category_id,
+               Expense.currency, Expense.base_amount, Expense.account_id)
+        .where(Expense.date < cutoff),
+    ))
+    db.session.execute(insert(ArchivedIncome).from_select(
+        ["id", "date", "amount", "source", "currency", "base_amount", "account_id"],
+        select(Income.id, Income.date, Income.amount, Income.source, Income.currency, Income.base_amount,
+               Income.account_id)
+        .where(Income.date < cutoff),
+    ))
+    # archived rows keep no tags
+    db.session.execute(delete(expense_tags).where(
+        expense_tags.c.expense_id.in_(select(Expense.id).where(Expense.date < cutoff))))
+    db.session.execute(delete(income_tags).where(
+        income_tags.c.income_id.in_(select(Income.id).where(Income.date < cutoff))))
+    log_changes(Expense, "delete", select(Expense.id).where(Expense.date < cutoff))
+    db.session.execute(delete(Anomaly).where(Anomaly.expense_id.in_(select(Expense.id).where(Expense.date < cutoff))))
+    log_changes(Income, "delete", select(Income.id).where(Income.date < cutoff))
+    moved_expenses = db.session.execute(
+        delete(Expense).where(Expense.date < cutoff),
+        execution_options={"synchronize_session": False},
+    ).rowcount
+    moved_income = db.session.execute(
+        delete(Income).where(Income.date < cutoff),
+        execution_options={"synchronize_session": False},
+    ).rowcount
+    commit()
+    return {"cutoff": cutoff, "expenses": moved_expenses, "income": moved_income}
+
+
+# =========================
+# Auto-categorization rules
+# =========================
+def add_category_rule(category: Category, pattern: str|None = None, match_type: str = "substring",
+                      min_amount: Decimal|None = None, max_amount: Decimal|None = None,
+                      source: str|None = None, priority: int = 100) -> CategoryRule:
+    pattern = (pattern or "").strip() or None
+    source = (source or "").strip() or None
+    validate_rule(match_type, pattern)
+    if not (pattern or source or min_amount is not None or max_amount is not None):
+        raise ValueError("A rule needs a pattern, an amount range or a source.")
+    rule = CategoryRule(
+        category=category, match_type=match_type, pattern=pattern,
+        min_amount=min_amount, max_amount=max_amount, source=source, priority=priority,
+    )
+    db.session.add(rule)
+    rules_changed()
+    commit()
+    return rule
+
+def delete_category_rule(rule_id: int) -> None:
+    rule = db.session.get(CategoryRule, rule_id)
+    if rule:
+        db.session.delete(rule)
+        rules_changed()
+        commit()
+
+def _rule_category(description: str, amount) -> Category|None:
+    category_id = load_rule_matcher().classify(description, float(amount))
+    return db.session.get(Category, category_id) if category_id else None
+
+def _category_ids(names) -> dict:
+    """Map category names to ids, creating the missing ones (no commit)."""
+    names = set(names)
+    ids = {c.name: c.id for c in Category.query.filter(Category.name.in_(names))} if names else {}
+    missing = [Category(name=n) for n in names if n not in ids]
+    if missing:
+        db.session.add_all(missing)
+        db.session.flush()
+        ids.update({c.name: c.id for c in missing})
+    return ids
+
+def import_expenses(rows, skip_duplicates: bool = True, account_id: int | None = None) -> dict:
+    """
+    Bulk-insert expenses from dicts with date, amount, description and optional
+    category/source/currency, all paid from `account_id` if given. Rows without a category go through the rules, then fall
+    back to "General". Rows whose fingerprint already exists (in the table or
+    earlier in the batch) are skipped. One commit for the whole batch.
+    """
+    check_account(account_id)
+    rows = list(rows)
+    pending = [r for r in rows if not (r.get("category") or "").strip()]
+    guesses = load_rule_matcher().classify_many(
+        (r.get("description") or "", float(r["amount"]), r.get("source")) for r in pending
+    )
+    guessed = {id(r): g for r, g in zip(pending, guesses)}
+
+    names = {(r.get("category") or "").strip() for r in rows} - {""}
+    if None in guesses:
+        names.add("General")
+    ids = _category_ids(names)
+    row_currencies = [normalize_currency(r.get("currency")) for r in rows]
+    rates = RateTable(set(row_currencies))
+
+    mappings = []
+    for r, currency in zip(rows, row_currencies):
+        name = (r.get("category") or "").strip()
+        category_id = ids[name] if name else (guessed[id(r)] or ids["General"])
+        description = (r.get("description") or "").strip()
+        mappings.append({
+            "date": r["date"],
+            "amount": r["amount"],
+            "currency": currency,
+            "base_amount": rates.to_base(r["amount"], currency, r["date"]),
+            "description": description,
+            "category_id": category_id,
+            "fingerprint": expense_fingerprint(r["date"], r["amount"], description, category_id, currency),
+            "account_id": account_id,
+        })
+
+    duplicates = 0
+    if skip_duplicates:
+        seen = _existing_fingerprints({m["fingerprint"] for m in mappings})
+        unique = []
+        for m in mappings:
+            if m["fingerprint"] in seen:
+                duplicates += 1
+            else:
+                seen.add(m["fingerprint"])
+                unique.append(m)
+        mappings = unique
+
+    if mappings:
+        ids = db.session.scalars(insert(Expense).returning(Expense.id), mappings).all()
+        log_changes(Expense, "insert", ids)
+        observe_expenses(sorted(
+            ((i, m["date"], m["category_id"], m["description"], m["base_amount"]) for i, m in zip(ids, mappings)),
+            key=lambda row: (row[1], row[0]),
+        ))
+        record_spend((m["category_id"], m["date"], m["base_amount"]) for m in mappings)
+        record_flows((account_id, m["date"], -m["base_amount"]) for m in mappings)
+        for i, m in zip(ids, mappings):
+            emit(ExpenseAdded(i, m["date"], m["category_id"], m["base_amount"]))
+    commit()
+    return {
+        "imported": len(mappings),
+        "auto_categorized": sum(1 for g in guesses if g),
+        "duplicates": duplicates,
+    }
+
+def _existing_fingerprints(fingerprints, chunk: int = 500) -> set:
+    fingerprints = list(fingerprints)
+    found = set()
+    for i in range(0, len(fingerprints), chunk):
+        found.update(
+            fp for (fp,) in db.session.query(Expense.fingerprint)
+            .filter(Expense.fingerprint.in_(fingerprints[i:i + chunk]))
+        )
+    return found
+
+def import_expenses_csv(stream, source: str|None = None, account_id: int | None = None) -> dict:
+    """Import a CSV with date (YYYY-MM-DD) and amount columns, plus optional description, category, source and currency."""
+    rows = []
+    for line_no, rec in enumerate(csv.DictReader(stream), start=2):
+        try:
+            rows.append({
+                "date": datetime.strptime(rec["date"].strip(), "%Y-%m-%d").date(),
+                "amount": Decimal(rec["amount"].strip()),
+                "description": rec.get("description") or "",
+                "category": rec.get("category") or "",
+                "source": (rec.get("source") or source or "").strip() or None,
+                "currency": rec.get("currency") or "",
+            })
+        except (KeyError, AttributeError, ValueError, InvalidOperation) as e:
+            raise ValueError(f"line {line_no}: {e!r}") from e
+    return import_expenses(rows, account_id=account_id)
+
+def recategorize_uncategorized(batch_size: int = 5000) -> int:
+    """Run the rules over expenses filed under "General"; returns how many moved."""
+    general = Category.query.filter_by(name="General").first()
+    if not general:
+        return 0
+    matcher = load_rule_matcher()
+    moved = 0
+    last_id = 0
+    while True:
+        batch = (
+            db.session.query(Expense.id, Expense.date, Expense.description, Expense.amount, Expense.currency)
+            .filter(Expense.category_id == general.id, Expense.id > last_id)
+            .order_by(Expense.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not batch:
+            break
+        last_id = batch[-1].id
+        guesses = matcher.classify_many((row.description or "", float(row.amount), None) for row in batch)
+        changes = [
+            {"id": row.id, "category_id": cid,
+             "fingerprint": expense_fingerprint(row.date, row.amount, row.description, cid, row.currency)}
+            for row, cid in zip(batch, guesses)
+            if cid and cid != general.id
+        ]
+        if changes:
+            db.session.execute(update(Expense), changes)
+            log_changes(Expense, "update", [c["id"] for c in changes])
+            moved += len(changes)
+    if moved:
+        rebuild_envelopes()
+    commit()
+    return moved
+
+
+# =========================
+# Duplicate detection
+# =========================
+def find_duplicate_clusters() -> list:
+    """Groups of expenses sharing a fingerprint, found with one grouped query."""
+    dup_fps = (
+        select(Expense.fingerprint)
+        .where(Expense.fingerprint.is_not(None))
+        .group_by(Expense.fingerprint)
+        .having(func.count(Expense.id) > 1)
+        .subquery()
+    )
+    rows = (
+        Expense.query
+        .join(dup_fps, dup_fps.c.fingerprint == Expense.fingerprint)
+        .order_by(Expense.date.desc(), Expense.fingerprint, Expense.id)
+        .all()
+    )
+    clusters = {}
+    for e in rows:
+        clusters.setdefault(e.fingerprint, []).append(e)
+    return list(clusters.values())
+
+
+# =========================
+# Export
+# =========================
+def export_csv(filters, chunk: int = 1000):
+    """
+    CSV text of the expenses (date, amount, currency, description, category, tags)
+    or income (date, amount, currency, source, tags) matching a queries.TransactionFilter,
+    oldest first, yielded in chunks so large exports stream. Expense exports
+    can be re-imported (tags are ignored there).
+    """
+    model = filters.model
+    tag_list = tag_names(model)
+    if model is Expense:
+        header = ["date", "amount", "currency", "description", "category", "tags"]
+        stmt = select(Expense.date, Expense.amount, Expense.currency, Expense.description, Category.name, tag_list) \
+            .join(Expense.category)
+    else:
+        header = ["date", "amount", "currency", "source", "tags"]
+        stmt = select(Income.date, Income.amount, Income.currency, Income.source, tag_list)
+    stmt = stmt.where(where_clause(filters)).order_by(model.date, model.id)
+
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(header)
+    for rows in db.session.execute(stmt.execution_options(yield_per=chunk)).partitions():
+        writer.writerows((d.isoformat(), f"{amount:.2f}", *rest[:-1], rest[-1] or "") for d, amount, *rest in rows)
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+    yield buf.getvalue()
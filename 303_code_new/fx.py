@@ -0,0 +1,171 @@
+"""
+Multi-currency amounts.
+
+Every expense and income row keeps the amount as entered plus its currency,
+and base_amount: the same amount in BASE_CURRENCY, converted once when the
+row is written. Reports, budgets and totals SUM(base_amount) and never look
+at rates, so aggregates stay one-column scans.
+
+Rates live in the fx_rate table (units of base currency per unit of the
+foreign currency, valid from their date until the next rate), imported from a
+"date,currency,rate" CSV; nothing is fetched over the network. A row is
+converted at the latest rate on or before its date. When rates are corrected,
+reconvert() rewrites the affected base_amounts with one UPDATE per table;
+archived months keep the totals they were rolled up with.
+"""
+import csv
+from bisect import bisect_right
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from sqlalchemy import func, or_, select, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from database import db, commit
+from models import Expense, Income, FxRate, base_currency
+from changes import log_changes
+from envelopes import rebuild_envelopes
+from accounts import rebuild_account_balances
+
+CENT = Decimal("0.01")
+
+
+def normalize_currency(code) -> str:
+    """" eur" -> "EUR"; empty means the base currency."""
+    code = (code or "").strip().upper()
+    if not code:
+        return base_currency()
+    if len(code) != 3 or not code.isalpha():
+        raise ValueError(f"Invalid currency code: {code}")
+    return code
+
+def currencies() -> list:
+    """The base currency, then every currency that has rates."""
+    base = base_currency()
+    loaded = db.session.scalars(select(FxRate.currency).distinct().order_by(FxRate.currency))
+    return [base] + [c for c in loaded if c != base]
+
+def rate_on(currency: str, when) -> Decimal:
+    """Latest rate of `currency` on or before `when`; ValueError if there is none."""
+    if currency == base_currency():
+        return Decimal(1)
+    rate = db.session.scalar(
+        select(FxRate.rate)
+        .where(FxRate.currency == currency, FxRate.date <= when)
+        .order_by(FxRate.date.desc())
+        .limit(1)
+    )
+    if rate is None:
+        raise ValueError(f"No {currency} rate on or before {when.isoformat()}")
+    return Decimal(rate)
+
+def to_base(amount, currency: str, when) -> Decimal:
+    return (Decimal(amount) * rate_on(currency, when)).quantize(CENT)
+
+
+class RateTable:
+    """Rates of some currencies loaded once, for converting many rows (imports)."""
+
+    def __init__(self, currencies):
+        self.base = base_currency()
+        self.dates, self.rates = {}, {}
+        wanted = set(currencies) - {self.base}
+        if wanted:
+            rows = db.session.execute(
+                select(FxRate.currency, FxRate.date, FxRate.rate)
+                .where(FxRate.currency.in_(wanted))
+                .order_by(FxRate.currency, FxRate.date)
+            )
+            for cur, d, rate in rows:
+                self.dates.setdefault(cur, []).append(d)
+                self.rates.setdefault(cur, []).append(Decimal(rate))
+
+    def to_base(self, amount, currency: str, when) -> Decimal:
+        if currency == self.base:
+            return Decimal(amount)
+        i = bisect_right(self.dates.get(currency, ()), when)
+        if i == 0:
+            raise ValueError(f"No {currency} rate on or before {when.isoformat()}")
+        return (Decimal(amount) * self.rates[currency][i - 1]).quantize(CENT)
+
+
+def import_fx_rates(stream) -> dict:
+    """Upsert rates from a CSV with date (YYYY-MM-DD), currency and rate columns."""
+    return save_fx_rates(csv.DictReader(stream))
+
+def set_fx_rate(currency: str, when, rate) -> dict:
+    return save_fx_rates([{"date": when.isoformat(), "currency": currency, "rate": str(rate)}], first_line=1)
+
+def save_fx_rates(records, first_line: int = 2) -> dict:
+    """
+    Upsert rates from dicts of strings (date, currency, rate). Returns the
+    number of rates and, per currency, the earliest date touched, which is
+    what reconvert() needs.
+    """
+    rows, earliest = {}, {}
+    for line_no, rec in enumerate(records, start=first_line):
+        try:
+            when = datetime.strptime(rec["date"].strip(), "%Y-%m-%d").date()
+            cur = normalize_currency(rec["currency"])
+            rate = Decimal(rec["rate"].strip())
+            if rate <= 0:
+                raise ValueError("rate must be positive")
+        except (KeyError, AttributeError, ValueError, InvalidOperation) as e:
+            raise ValueError(f"line {line_no}: {e!r}") from e
+        if cur == base_currency():
+            continue
+        rows[(cur, when)] = {"currency": cur, "date": when, "rate": rate}
+        earliest[cur] = min(when, earliest.get(cur, when))
+    if rows:
+        stmt = sqlite_insert(FxRate)
+        db.session.execute(
+            stmt.on_conflict_do_update(index_elements=["currency", "date"], set_={"rate": stmt.excluded.rate}),
+            list(rows.values()),
+        )
+    commit()
+    return {"rates": len(rows), "since": earliest}
+
+
+def reconvert(since: dict | None = None) -> dict:
+    """
+    Recompute base_amount of foreign-currency rows from the current rates:
+    one UPDATE per table with a correlated latest-rate lookup. `since` limits
+    it to {currency: first date whose rate changed}; None redoes every foreign
+    row. Rows with no rate on or before their date keep their base_amount.
+    Envelopes and account balances are rebuilt when anything changed.
+    """
+    base = base_currency()
+    updated = {}
+    for model in (Expense, Income):
+        latest_rate = (
+            select(FxRate.rate)
+            .where(FxRate.currency == model.currency, FxRate.date <= model.date)
+            .order_by(FxRate.date.desc())
+            .limit(1)
+            .scalar_subquery()
+        )
+        if since is None:
+            scope = model.currency != base
+        elif since:
+            scope = or_(*((model.currency == cur) & (model.date >= d) for cur, d in since.items()))
+        else:
+            updated[model.__tablename__] = 0
+            continue
+        log_changes(model, "update", select(model.id).where(scope))
+        result = db.session.execute(
+            update(model)
+            .where(scope)
+            .values(base_amount=func.coalesce(func.round(model.amount * latest_rate, 2), model.base_amount)),
+            execution_options={"synchronize_session": False},
+        )
+        updated[model.__tablename__] = result.rowcount
+    if updated["expense"]:
+        rebuild_envelopes()
+    if updated["expense"] or updated["income"]:
+        rebuild_account_balances()
+    commit()
+    return updated
+
+
+def init_fx(app):
+    @app.context_processor
+    def inject_base_currency():
+        return {"base_currency": app.config["BASE_CURRENCY"]}
@@ -0,0 +1,199 @@
+"""
+Idempotency keys for write endpoints.
+
+A client that retries a request (a double-clicked or re-sent form, a JSON
+client after a timeout) sends the same key again: the Idempotency-Key header,
+or an `idempotency_key` form field / query parameter. Forms and "run now"
+links get a fresh key each time the page is rendered (idempotency_field() and
+idempotency_key() in templates).
+
+@idempotent views handle a keyed request like this:
+
+1. claim the key: INSERT a pending row into idempotency_keys (primary key
+   lookup; an expired row with the same key is taken over);
+2. if the key was already there, do not run the view. A finished request
+   with the same method, path and form/JSON body gets its stored status,
+   body and Location back; a different request under that key is a 422, and
+   one still running is a 409;
+3. otherwise run the view and store its response on the row.
+
+Rows expire after IDEMPOTENCY_TTL_HOURS. Once a key has been stored, a
+background thread deletes expired rows SWEEP_BATCH at a time, every
+IDEMPOTENCY_SWEEP_MINUTES, through the write queue, in every user database
+(shards.py).
+
+Requests without a key behave as before.
+"""
+import hashlib
+import json
+import threading
+import time
+import uuid
+from collections import namedtuple
+from datetime import datetime, timedelta
+from functools import wraps
+from flask import current_app, jsonify, request
+from markupsafe import Markup
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from database import db, commit
+from models import IdempotencyKey
+from writequeue import write
+from shards import all_shards, use_shard
+
+HEADER = "Idempotency-Key"
+FIELD = "idempotency_key"
+MAX_KEY_LENGTH = 255
+SWEEP_BATCH = 500
+
+StoredResponse = namedtuple("StoredResponse", "request_hash status body content_type location")
+
+
+def new_key() -> str:
+    return uuid.uuid4().hex
+
+def request_key() -> str | None:
+    return request.headers.get(HEADER) or request.form.get(FIELD) or request.args.get(FIELD) or None
+
+def request_hash() -> str:
+    """What the key stands for: method, path and the form or JSON body (minus the key)."""
+    form = sorted((k, v) for k, v in request.form.items(multi=True) if k != FIELD)
+    args = sorted((k, v) for k, v in request.args.items(multi=True) if k != FIELD)
+    files = sorted((k, f.filename or "") for k, f in request.files.items(multi=True))
+    payload = [request.method, request.path, form, args, files, request.get_data(cache=True).decode("utf-8", "replace")
+               if request.is_json else ""]
+    return hashlib.sha256(json.dumps(payload).encode()).hexdigest()
+
+
+def claim_key(key: str, req_hash: str, ttl: timedelta) -> StoredResponse | None:
+    """Take `key` for this request; None if claimed, else what is stored under it."""
+    now = datetime.now()
+    stmt = sqlite_insert(IdempotencyKey).values(key=key, request_hash=req_hash, expires_at=now + ttl)
+    claimed = db.session.execute(stmt.on_conflict_do_update(
+        index_elements=["key"],
+        set_={"request_hash": req_hash, "status": None, "body": None, "content_type": None, "location": None,
+              "expires_at": now + ttl},
+        where=IdempotencyKey.expires_at < now,
+    )).rowcount
+    commit()
+    if claimed:
+        return None
+    return StoredResponse(*db.session.execute(
+        select(IdempotencyKey.request_hash, IdempotencyKey.status, IdempotencyKey.body,
+               IdempotencyKey.content_type, IdempotencyKey.location)
+        .where(IdempotencyKey.key == key)
+    ).one())
+
+def store_response(key: str, status: int, body: bytes, content_type: str | None, location: str | None) -> None:
+    row = db.session.get(IdempotencyKey, key)
+    if row:
+        row.status, row.body, row.content_type, row.location = status, body, content_type, location
+        commit()
+
+def release_key(key: str) -> None:
+    """Forget a claim whose request failed, so a retry runs again."""
+    db.session.execute(delete(IdempotencyKey).where(IdempotencyKey.key == key, IdempotencyKey.status.is_(None)))
+    commit()
+
+def sweep_expired(batch: int = SWEEP_BATCH) -> int:
+    """Delete up to `batch` expired keys; returns how many."""
+    expired = select(IdempotencyKey.key).where(IdempotencyKey.expires_at < datetime.now()).limit(batch)
+    removed = db.session.execute(delete(IdempotencyKey).where(IdempotencyKey.key.in_(expired))).rowcount
+    commit()
+    return removed
+
+
+def _replay(stored: StoredResponse, req_hash: str):
+    if stored.request_hash != req_hash:
+        return jsonify(error=f"{HEADER} was already used for a different request"), 422
+    if stored.status is None:
+        return jsonify(error="a request with this key is still in progress"), 409
+    resp = current_app.response_class(stored.body, status=stored.status, content_type=stored.content_type)
+    if stored.location:
+        resp.headers["Location"] = stored.location
+    resp.headers["Idempotent-Replayed"] = "true"
+    return resp
+
+def idempotent(view):
+    """Run the view at most once per idempotency key; replays get the first response back."""
+    @wraps(view)
+    def wrapped(*args, **kwargs):
+        key = request_key()
+        if key is None or (request.method in ("GET", "HEAD") and FIELD not in request.args):
+            return view(*args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            return jsonify(error=f"{HEADER} is longer than {MAX_KEY_LENGTH} characters"), 400
+        req_hash = request_hash()
+        ttl = timedelta(hours=current_app.config.get("IDEMPOTENCY_TTL_HOURS", 24))
+        stored = write(claim_key, key, req_hash, ttl)
+        if stored is not None:
+            return _replay(stored, req_hash)
+        try:
+            resp = current_app.make_response(view(*args, **kwargs))
+        except BaseException:
+            db.session.rollback()
+            write(release_key, key)
+            raise
+        if resp.status_code >= 400:
+            # whatever a rejected request flushed must not ride along with the key
+            db.session.rollback()
+        if resp.status_code >= 500 or resp.is_streamed:
+            write(release_key, key)
+        else:
+            write(store_response, key, resp.status_code, resp.get_data(), resp.content_type,
+                  resp.headers.get("Location"))
+            sweeper = current_app.extensions.get("idempotency_sweeper")
+            if sweeper:
+                sweeper.ensure_running()
+        return resp
+    return wrapped
+
+
+class KeySweeper:
+    """Daemon thread deleting expired keys in small batches, started on first use (and again after fork)."""
+
+    def __init__(self, app, interval: float):
+        self.app = app
+        self.interval = interval
+        self.last_error = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def ensure_running(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="idempotency-sweeper", daemon=True)
+                self._thread.start()
+
+    def run_once(self) -> int:
+        removed = 0
+        with self.app.app_context():
+            for shard in all_shards():
+                with use_shard(shard):
+                    while (n := write(sweep_expired)) > 0:
+                        removed += n
+                        if n < SWEEP_BATCH:
+                            break
+                        time.sleep(0.01)  # let other writers in between batches
+                    db.session.remove()
+        return removed
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.run_once()
+                self.last_error = None
+            except Exception as e:
+                self.last_error = e
+
+
+def init_idempotency(app):
+    app.jinja_env.globals["idempotency_key"] = new_key
+    app.jinja_env.globals["idempotency_field"] = \
+        lambda: Markup(f'<input type="hidden" name="{FIELD}" value="{new_key()}">')
+    minutes = app.config.get("IDEMPOTENCY_SWEEP_MINUTES", 10)
+    if minutes:
+        app.extensions["idempotency_sweeper"] = KeySweeper(app, minutes * 60)
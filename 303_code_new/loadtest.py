@@ -0,0 +1,262 @@
+"""
+Concurrent HTTP load test.
+
+Starts the app on a throwaway SQLite database in a separate process (a
+forking or threaded Werkzeug server), then drives it from client threads
+with a weighted mix of report views, expense/income posts, listings and
+recurring runs. Prints throughput, p50/p95/p99 latency per scenario, and
+counts server errors and "database is locked" failures.
+
+    python loadtest.py --clients 16 --duration 20 --server forking
+    python loadtest.py --server threaded --write-queue
+    python loadtest.py --json results.json     # keep numbers for comparison
+"""
+import argparse
+import http.cookiejar
+import json
+import math
+import multiprocessing
+import os
+import random
+import secrets
+import socket
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import defaultdict
+from datetime import date, timedelta
+
+LOCKED = b"database is locked"
+FAILED = b"Failed to "
+
+# scenario -> weight
+DEFAULT_MIX = {
+    "view_report": 30,
+    "list_expenses": 15,
+    "post_expense": 30,
+    "post_income": 10,
+    "set_budget": 5,
+    "run_recurring": 10,
+}
+
+
+# =========================
+# Server
+# =========================
+def _serve(db_path, port, server, ready, config):
+    import logging
+    from werkzeug.serving import make_server
+    from app import create_app
+
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+
+    app = create_app(config={"SQLALCHEMY_DATABASE_URI": f"sqlite:///{db_path}",
+                             "SECRET_KEY": secrets.token_hex(32), **config})
+    _seed(app)
+    with app.app_context():
+        from database import db
+        # forked request handlers must not share the parent's connections
+        db.engine.dispose()
+    forking = server == "forking"
+    srv = make_server("127.0.0.1", port, app, threaded=not forking, processes=64 if forking else 1)
+    ready.set()
+    srv.serve_forever()
+
+def _seed(app):
+    from decimal import Decimal
+    from functions import get_or_create_category, add_expense, add_income, add_recurring_item
+
+    with app.app_context():
+        cats = [get_or_create_category(n) for n in ("Food", "Rent", "Transport", "Fun")]
+        start = date.today() - timedelta(days=180)
+        for i in range(500):
+            add_expense(start + timedelta(days=i % 180), Decimal(5 + i % 40), cats[i % 4], f"seed {i}")
+        for i in range(12):
+            add_income(amount=Decimal("2000"), when=start + timedelta(days=15 * i), source="Salary")
+        add_recurring_item(
+            name="Gym", kind="expense", amount=Decimal("30"), category_id=cats[3].id,
+            income_source=None, freq="every_n_days", every_n_days=1, day_of_month=None,
+            start_date=start, next_run_date=start, end_date=None,
+            auto_post=True, active=True, notes="",
+        )
+
+def start_server(server="forking", config=None):
+    """Start the app in a child process; returns (base_url, process, db_path)."""
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    db_path = os.path.join(tempfile.mkdtemp(prefix="pfm-load-"), "load.db")
+    ready = multiprocessing.Event()
+    proc = multiprocessing.Process(target=_serve, args=(db_path, port, server, ready, config or {}), daemon=True)
+    proc.start()
+    if not ready.wait(60):
+        proc.terminate()
+        raise RuntimeError("server did not start")
+    return f"http://127.0.0.1:{port}", proc, db_path
+
+
+# =========================
+# Client
+# =========================
+class Client:
+    def __init__(self, base_url, seed):
+        self.base = base_url
+        self.rng = random.Random(seed)
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar())
+        )
+        self.counter = 0
+
+    def request(self, path, data=None):
+        body = urllib.parse.urlencode(data).encode() if data is not None else None
+        try:
+            with self.opener.open(self.base + path, data=body, timeout=60) as resp:
+                return resp.status, resp.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+    def login(self):
+        self.request("/login", {"username": "admin", "password": "1234"})
+
+    # each scenario returns a list of (status, body) for the requests it made
+    def view_report(self):
+        today = date.today()
+        q = f"?year={today.year}&month={today.month}"
+        out = [self.request("/report" + q)]
+        for panel in ("summary", "categories", "trends", "budgets"):
+            out.append(self.request(f"/report/data/{panel}" + q))
+        return out
+
+    def list_expenses(self):
+        return [self.request("/expenses")]
+
+    def post_expense(self):
+        self.counter += 1
+        when = date.today() - timedelta(days=self.rng.randrange(60))
+        return [self.request("/expenses", {
+            "date": when.isoformat(),
+            "amount": f"{self.rng.uniform(1, 200):.2f}",
+            "category": self.rng.choice(["Food", "Transport", "Fun"]),
+            "description": f"load {id(self)} {self.counter}",
+        })]
+
+    def post_income(self):
+        return [self.request("/income", {
+            "date": date.today().isoformat(),
+            "amount": f"{self.rng.uniform(10, 500):.2f}",
+            "source": "Side job",
+        })]
+
+    def set_budget(self):
+        return [self.request("/budgets", {
+            "month": date.today().strftime("%Y-%m"),
+            "amount": f"{self.rng.uniform(100, 900):.2f}",
+            "category_id": "",
+        })]
+
+    def run_recurring(self):
+        return [self.request("/tasks/run-recurring")]
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    k = max(0, math.ceil(p / 100 * len(sorted_values)) - 1)
+    return sorted_values[k]
+
+def run_load(base_url, clients=8, duration=10.0, mix=None, seed=1):
+    """Drive base_url from `clients` threads for `duration` seconds; returns stats."""
+    mix = mix or DEFAULT_MIX
+    names, weights = zip(*mix.items())
+    samples = defaultdict(list)     # scenario -> latencies (s)
+    errors = defaultdict(int)       # scenario -> HTTP >= 500 or failed mutation
+    locked = defaultdict(int)       # scenario -> "database is locked"
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def worker(n):
+        client = Client(base_url, seed + n)
+        client.login()
+        while time.perf_counter() < deadline:
+            name = client.rng.choices(names, weights)[0]
+            t0 = time.perf_counter()
+            results = getattr(client, name)()
+            elapsed = time.perf_counter() - t0
+            with lock:
+                samples[name].append(elapsed)
+                for status, body in results:
+                    if LOCKED in body:
+                        locked[name] += 1
+                    if status >= 500 or FAILED in body:
+                        errors[name] += 1
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(clients)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - started
+
+    stats = {"clients": clients, "seconds": round(wall, 2), "scenarios": {}}
+    everything = []
+    for name in names:
+        lat = sorted(samples[name])
+        everything.extend(lat)
+        stats["scenarios"][name] = _summary(lat, wall, errors[name], locked[name])
+    stats["total"] = _summary(sorted(everything), wall, sum(errors.values()), sum(locked.values()))
+    return stats
+
+def _summary(lat, wall, errors, locked):
+    return {
+        "requests": len(lat),
+        "throughput": round(len(lat) / wall, 1) if wall else 0.0,
+        "p50_ms": round(percentile(lat, 50) * 1000, 1),
+        "p95_ms": round(percentile(lat, 95) * 1000, 1),
+        "p99_ms": round(percentile(lat, 99) * 1000, 1),
+        "errors": errors,
+        "locked": locked,
+    }
+
+def print_stats(stats):
+    print(f"{stats['clients']} clients, {stats['seconds']} s")
+    print(f"{'scenario':<15}{'reqs':>7}{'req/s':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'errors':>8}{'locked':>8}")
+    rows = list(stats["scenarios"].items()) + [("TOTAL", stats["total"])]
+    for name, s in rows:
+        print(f"{name:<15}{s['requests']:>7}{s['throughput']:>8}{s['p50_ms']:>9}"
+              f"{s['p95_ms']:>9}{s['p99_ms']:>9}{s['errors']:>8}{s['locked']:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--server", choices=("forking", "threaded"), default="forking")
+    parser.add_argument("--write-queue", action="store_true", help="enable the single-writer write path")
+    parser.add_argument("--url", help="drive an already running server instead of starting one")
+    parser.add_argument("--json", help="also write the stats to this file")
+    args = parser.parse_args()
+
+    proc = None
+    base_url = args.url
+    if not base_url:
+        base_url, proc, db_path = start_server(args.server, {"WRITE_QUEUE": args.write_queue})
+        print(f"serving {db_path} with a {args.server} server at {base_url}")
+    try:
+        stats = run_load(base_url, clients=args.clients, duration=args.duration)
+    finally:
+        if proc:
+            proc.terminate()
+    stats["server"] = args.server if proc else base_url
+    print_stats(stats)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(stats, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,30 +1,168 @@
 
-from database import db
+import hashlib
+import re
+from database import db, after_schema_sync
 from datetime import date
+from decimal import Decimal
+from flask import current_app, has_app_context
+from sqlalchemy import bindparam, event, insert, literal, select, text, update
 
 # US2: Categorization
 class Category(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(64), unique=True, nullable=False)
+    # optional parent, e.g. Food > Groceries > Costco; level is 0 for top-level categories
+    parent_id = db.Column(db.Integer, db.ForeignKey("category.id"), nullable=True, index=True)
+    level = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    parent = db.relationship("Category", remote_side="Category.id", backref="children")
 
     expenses = db.relationship("Expense", back_populates="category")
     budgets = db.relationship("Budget", back_populates="category")
 
+# Closure table: one row per (ancestor, descendant) pair at any depth, including
+# (c, c) at depth 0, so a whole subtree is one indexed join away.
+class CategoryClosure(db.Model):
+    __tablename__ = "category_closure"
+    ancestor_id = db.Column(db.Integer, db.ForeignKey("category.id"), primary_key=True)
+    descendant_id = db.Column(db.Integer, db.ForeignKey("category.id"), primary_key=True)
+    depth = db.Column(db.Integer, nullable=False)
+
+    __table_args__ = (
+        db.Index("ix_category_closure_descendant", "descendant_id", "ancestor_id", "depth"),
+    )
+
+@event.listens_for(Category, "before_insert")
+def _set_category_level(mapper, connection, target):
+    target.level = target.parent.level + 1 if target.parent is not None else 0
+
+@event.listens_for(Category, "after_insert")
+def _add_closure_rows(mapper, connection, target):
+    t = CategoryClosure.__table__
+    rows = [select(literal(target.id), literal(target.id), literal(0))]
+    if target.parent_id is not None:
+        rows.append(
+            select(t.c.ancestor_id, literal(target.id), t.c.depth + 1)
+            .where(t.c.descendant_id == target.parent_id)
+        )
+    for q in rows:
+        connection.execute(insert(t).from_select(["ancestor_id", "descendant_id", "depth"], q))
+
+@after_schema_sync
+def _backfill_category_closure(conn):
+    # categories that predate the closure table are all top-level
+    conn.exec_driver_sql(
+        "INSERT INTO category_closure (ancestor_id, descendant_id, depth) "
+        "SELECT id, id, 0 FROM category "
+        "WHERE id NOT IN (SELECT descendant_id FROM category_closure)"
+    )
+
 # US1: Expense Tracking
 class Expense(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    date = db.Column(db.Date, nullable=False)
+    date = db.Column(db.Date, nullable=False, index=True)
     amount = db.Column(db.Numeric(12, 2), nullable=False)
     description = db.Column(db.String(255))
-    category_id = db.Column(db.Integer, db.ForeignKey("category.id"), nullable=False)
+    category_id = db.Column(db.Integer, db.ForeignKey("category.id"), nullable=False, index=True)
     category = db.relationship("Category", back_populates="expenses")
+    # hash of (date, amount, normalized description, category); see expense_fingerprint()
+    fingerprint = db.Column(db.String(40), nullable=True, index=True)
+    tags = db.relationship("Tag", secondary="expense_tags", lazy="selectin", order_by="Tag.name")
+    # amount is in `currency`; base_amount is the same amount in the base currency (see fx.py)
+    currency = db.Column(db.String(3), nullable=False, default=lambda: base_currency(), server_default="USD")
+    base_amount = db.Column(db.Numeric(12, 2), nullable=True, default=lambda ctx: _same_amount(ctx))
+    anomaly = db.relationship("Anomaly", uselist=False, back_populates="expense", cascade="all, delete-orphan")
+    # optional; see accounts.py
+    account_id = db.Column(db.Integer, db.ForeignKey("accounts.id"), nullable=True, index=True)
+
+    __table_args__ = (
+        # daily totals (calendar heatmap) read only the index
+        db.Index("ix_expense_date_base_amount", "date", "base_amount"),
+        db.Index("ix_expense_category_date", "category_id", "date", "base_amount"),
+    )
+
+def normalize_description(text: str | None) -> str:
+    """Lower-case, drop apostrophes, turn other punctuation into spaces, collapse whitespace."""
+    text = re.sub(r"['\u2019]", "", (text or "").lower())
+    return " ".join(re.sub(r"[^\w\s]", " ", text).split())
+
+def expense_fingerprint(when: date, amount, description: str | None, category_id: int,
+                        currency: str | None = None) -> str:
+    key = f"{when.isoformat()}|{Decimal(amount):.2f}|{normalize_description(description)}|{category_id}"
+    if currency and currency != base_currency():
+        # base-currency fingerprints keep their pre-currency form
+        key += f"|{currency}"
+    return hashlib.sha1(key.encode()).hexdigest()
+
+@after_schema_sync
+def _backfill_expense_fingerprints(conn):
+    t = Expense.__table__
+    rows = conn.execute(
+        select(t.c.id, t.c.date, t.c.amount, t.c.description, t.c.category_id)
+        .where(t.c.fingerprint.is_(None))
+    ).all()
+    if rows:
+        conn.execute(
+            update(t).where(t.c.id == bindparam("b_id")).values(fingerprint=bindparam("b_fp")),
+            [{"b_id": r.id, "b_fp": expense_fingerprint(r.date, r.amount, r.description, r.category_id)} for r in rows],
+        )
 
 # US3: Income Tracking
 class Income(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    date = db.Column(db.Date, nullable=False)
+    date = db.Column(db.Date, nullable=False, index=True)
     amount = db.Column(db.Numeric(12, 2), nullable=False)
     source = db.Column(db.String(128), default="Other")
+    tags = db.relationship("Tag", secondary="income_tags", lazy="selectin", order_by="Tag.name")
+    currency = db.Column(db.String(3), nullable=False, default=lambda: base_currency(), server_default="USD")
+    base_amount = db.Column(db.Numeric(12, 2), nullable=True, default=lambda ctx: _same_amount(ctx))
+    account_id = db.Column(db.Integer, db.ForeignKey("accounts.id"), nullable=True, index=True)
+
+    __table_args__ = (
+        db.Index("ix_income_date_base_amount", "date", "base_amount"),
+    )
+
+def base_currency() -> str:
+    return current_app.config.get("BASE_CURRENCY", "USD") if has_app_context() else "USD"
+
+def _same_amount(ctx):
+    # inserts that don't give base_amount are in the base currency
+    return ctx.get_current_parameters()["amount"]
+
+# Units of the base currency per unit of `currency`, valid from `date` until the
+# next row of that currency. Loaded from CSV on the FX page (see fx.py).
+class FxRate(db.Model):
+    __tablename__ = "fx_rate"
+    id = db.Column(db.Integer, primary_key=True)
+    currency = db.Column(db.String(3), nullable=False)
+    date = db.Column(db.Date, nullable=False)
+    rate = db.Column(db.Numeric(18, 8), nullable=False)
+
+    __table_args__ = (
+        db.UniqueConstraint("currency", "date", name="uq_fx_rate_currency_date"),
+    )
+
+# Tags (see tags.py). The link tables are clustered by tag, so each tag's rows
+# are one sorted id range; the second index serves "tags of this row".
+class Tag(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    # lower-case, no spaces, e.g. "vacation-2026"
+    name = db.Column(db.String(64), unique=True, nullable=False)
+
+expense_tags = db.Table(
+    "expense_tags",
+    db.Column("tag_id", db.Integer, db.ForeignKey("tag.id"), primary_key=True),
+    db.Column("expense_id", db.Integer, db.ForeignKey("expense.id"), primary_key=True),
+    db.Index("ix_expense_tags_expense", "expense_id", "tag_id"),
+    sqlite_with_rowid=False,
+)
+
+income_tags = db.Table(
+    "income_tags",
+    db.Column("tag_id", db.Integer, db.ForeignKey("tag.id"), primary_key=True),
+    db.Column("income_id", db.Integer, db.ForeignKey("income.id"), primary_key=True),
+    db.Index("ix_income_tags_income", "income_id", "tag_id"),
+    sqlite_with_rowid=False,
+)
 
 # US4: Budgeting
 class Budget(db.Model):
@@ -40,6 +178,33 @@ class Budget(db.Model):
         db.UniqueConstraint("month_key", "category_id", name="uq_budget_month_category"),
     )
 
+# Envelope budgeting (see envelopes.py): from start_month on, a category's
+# unspent budget carries over to the next month and overspending is taken
+# out of it.
+class Envelope(db.Model):
+    __tablename__ = "envelopes"
+    category_id = db.Column(db.Integer, db.ForeignKey("category.id"), primary_key=True)
+    start_month = db.Column(db.String(7), nullable=False)
+    category = db.relationship("Category")
+
+# Maintained running totals: one row per envelope and month from its start,
+# with that month's budget and spend (subcategories included) and the
+# cumulative sums through it. Available = cum_budgeted - cum_spent.
+class EnvelopeMonth(db.Model):
+    __tablename__ = "envelope_months"
+    category_id = db.Column(db.Integer, db.ForeignKey("envelopes.category_id"), primary_key=True)
+    month_key = db.Column(db.String(7), primary_key=True)
+    budgeted = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+    spent = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+    cum_budgeted = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+    cum_spent = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+
+    __table_args__ = (
+        # all envelopes of one month in one index range
+        db.Index("ix_envelope_months_month", "month_key", "category_id"),
+        {"sqlite_with_rowid": False},
+    )
+
 # US5: Savings Goal
 class SavingsGoal(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -49,6 +214,51 @@ class SavingsGoal(db.Model):
     is_active = db.Column(db.Boolean, nullable=False, default=True)
 
 
+# Accounts (see accounts.py). balance is maintained by the write helpers:
+# opening_balance plus every income, minus every expense, plus/minus transfers.
+class Account(db.Model):
+    __tablename__ = "accounts"
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(64), unique=True, nullable=False)
+    # "checking", "savings", "credit" or "cash"
+    kind = db.Column(db.String(16), nullable=False, default="checking")
+    opening_balance = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+    balance = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+
+class Transfer(db.Model):
+    __tablename__ = "transfers"
+    id = db.Column(db.Integer, primary_key=True)
+    date = db.Column(db.Date, nullable=False, index=True)
+    amount = db.Column(db.Numeric(12, 2), nullable=False)
+    from_account_id = db.Column(db.Integer, db.ForeignKey("accounts.id"), nullable=False, index=True)
+    to_account_id = db.Column(db.Integer, db.ForeignKey("accounts.id"), nullable=False, index=True)
+    note = db.Column(db.String(255))
+
+# Daily balance checkpoints: for each account and each day it had activity,
+# the net flow of that day and the closing balance (opening balance included).
+class AccountDay(db.Model):
+    __tablename__ = "account_days"
+    account_id = db.Column(db.Integer, db.ForeignKey("accounts.id"), primary_key=True)
+    date = db.Column(db.Date, primary_key=True)
+    flow = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+    balance = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+
+    __table_args__ = ({"sqlite_with_rowid": False},)
+
+# Receipts and pay stubs (see attachments.py). The file lives in the content-
+# addressed store under its SHA-256; rows with the same content share it.
+# expense_id / income_id are plain ids: archived rows keep theirs.
+class Attachment(db.Model):
+    __tablename__ = "attachments"
+    id = db.Column(db.Integer, primary_key=True)
+    sha256 = db.Column(db.String(64), nullable=False, index=True)
+    size = db.Column(db.Integer, nullable=False)
+    filename = db.Column(db.String(255), nullable=False)
+    content_type = db.Column(db.String(128), nullable=False, default="application/octet-stream")
+    expense_id = db.Column(db.Integer, nullable=True, index=True)
+    income_id = db.Column(db.Integer, nullable=True, index=True)
+    uploaded_at = db.Column(db.DateTime, nullable=False, server_default=db.func.current_timestamp())
+
 # US8: Recurring Items
 class RecurringItem(db.Model):
     __tablename__ = "recurring_items"
@@ -77,3 +287,159 @@ class RecurringItem(db.Model):
     active = db.Column(db.Boolean, nullable=False, default=True)
 
     notes = db.Column(db.String(280), nullable=True)
+    # posted transactions go to this account (optional)
+    account_id = db.Column(db.Integer, db.ForeignKey("accounts.id"), nullable=True)
+
+    __table_args__ = (
+        # due-item lookups: active = 1 AND next_run_date <= ?
+        db.Index("ix_recurring_items_active_next_run", "active", "next_run_date"),
+    )
+
+
+# Archival (cold storage): old transactions are moved out of the hot tables
+class ArchivedExpense(db.Model):
+    __tablename__ = "expense_archive"
+    # keeps the original expense id
+    id = db.Column(db.Integer, primary_key=True)
+    date = db.Column(db.Date, nullable=False)
+    amount = db.Column(db.Numeric(12, 2), nullable=False)
+    description = db.Column(db.String(255))
+    category_id = db.Column(db.Integer, db.ForeignKey("category.id"), nullable=False)
+    currency = db.Column(db.String(3), nullable=False, server_default="USD")
+    base_amount = db.Column(db.Numeric(12, 2), nullable=True)
+    account_id = db.Column(db.Integer, nullable=True)
+
+    __table_args__ = (
+        db.Index("ix_expense_archive_date", "date", "category_id", "base_amount"),
+    )
+
+class ArchivedIncome(db.Model):
+    __tablename__ = "income_archive"
+    id = db.Column(db.Integer, primary_key=True)
+    date = db.Column(db.Date, nullable=False)
+    amount = db.Column(db.Numeric(12, 2), nullable=False)
+    source = db.Column(db.String(128), default="Other")
+    currency = db.Column(db.String(3), nullable=False, server_default="USD")
+    base_amount = db.Column(db.Numeric(12, 2), nullable=True)
+    account_id = db.Column(db.Integer, nullable=True)
+
+    __table_args__ = (
+        db.Index("ix_income_archive_date", "date", "base_amount"),
+    )
+
+@after_schema_sync
+def _backfill_base_amounts(conn):
+    # rows from before multi-currency support are all in the base currency
+    for table in ("expense", "income", "expense_archive", "income_archive"):
+        conn.execute(
+            text(f'UPDATE "{table}" SET currency = :base, base_amount = amount WHERE base_amount IS NULL'),
+            {"base": base_currency()},
+        )
+
+# One row per (month, kind, category/source) of archived transactions
+class MonthRollup(db.Model):
+    __tablename__ = "month_rollup"
+    id = db.Column(db.Integer, primary_key=True)
+    month_key = db.Column(db.String(7), nullable=False, index=True)
+    # "expense" or "income"
+    kind = db.Column(db.String(20), nullable=False)
+    category_id = db.Column(db.Integer, db.ForeignKey("category.id"), nullable=True)
+    source = db.Column(db.String(128), nullable=True)
+    total = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        db.UniqueConstraint("month_key", "kind", "category_id", "source", name="uq_rollup_month_kind"),
+    )
+
+# Running spend statistics for anomaly detection (see anomalies.py): one row
+# per category ("category", "<id>") and per normalized description
+# ("description", "<text>"). n/mean/m2 are Welford's running count, mean
+# and sum of squared deviations of base_amount.
+class SpendStat(db.Model):
+    __tablename__ = "spend_stats"
+    scope = db.Column(db.String(16), primary_key=True)
+    key = db.Column(db.String(255), primary_key=True)
+    n = db.Column(db.Integer, nullable=False, default=0)
+    mean = db.Column(db.Float, nullable=False, default=0.0)
+    m2 = db.Column(db.Float, nullable=False, default=0.0)
+    # description baselines also track how often the charge comes
+    last_date = db.Column(db.Date, nullable=True)
+    gap_n = db.Column(db.Integer, nullable=False, default=0)
+    gap_mean = db.Column(db.Float, nullable=False, default=0.0)
+
+class Anomaly(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    expense_id = db.Column(db.Integer, db.ForeignKey("expense.id"), nullable=False, unique=True)
+    expense = db.relationship("Expense", back_populates="anomaly")
+    score = db.Column(db.Float, nullable=False)
+    reason = db.Column(db.String(255), nullable=False)
+    flagged_at = db.Column(db.DateTime, nullable=False, server_default=db.func.current_timestamp())
+    dismissed = db.Column(db.Boolean, nullable=False, default=False)
+
+# Append-only log of inserts/updates/deletes of the synced tables; its id is
+# the cursor of GET /api/v1/changes (see changes.py).
+class ChangeLog(db.Model):
+    __tablename__ = "change_log"
+    id = db.Column(db.Integer, primary_key=True)
+    table_name = db.Column(db.String(32), nullable=False)
+    row_id = db.Column(db.Integer, nullable=False)
+    # "insert", "update" or "delete"
+    op = db.Column(db.String(6), nullable=False)
+    changed_at = db.Column(db.DateTime, nullable=False, server_default=db.func.current_timestamp())
+
+SYNCED_MODELS = (Category, Expense, Income, Budget, SavingsGoal, RecurringItem)
+
+@after_schema_sync
+def _seed_change_log(conn):
+    # rows that predate the log show up as inserts, so since=0 is a full sync
+    if conn.execute(select(ChangeLog.id).limit(1)).first() is None:
+        t = ChangeLog.__table__
+        for model in SYNCED_MODELS:
+            conn.execute(insert(t).from_select(
+                ["table_name", "row_id", "op"],
+                select(literal(model.__tablename__), model.id, literal("insert")).order_by(model.id),
+            ))
+
+# Idempotency keys of write requests and the response each one got (see
+# idempotency.py). status is NULL while the first request is still running.
+class IdempotencyKey(db.Model):
+    __tablename__ = "idempotency_keys"
+    key = db.Column(db.String(255), primary_key=True)
+    request_hash = db.Column(db.String(64), nullable=False)
+    status = db.Column(db.Integer, nullable=True)
+    body = db.Column(db.LargeBinary, nullable=True)
+    content_type = db.Column(db.String(128), nullable=True)
+    location = db.Column(db.String(512), nullable=True)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+    __table_args__ = ({"sqlite_with_rowid": False},)
+
+# Auto-categorization rules (see categorize.py). Every condition that is set
+# must hold; among matching rules the lowest priority number wins.
+class CategoryRule(db.Model):
+    __tablename__ = "category_rules"
+    id = db.Column(db.Integer, primary_key=True)
+    category_id = db.Column(db.Integer, db.ForeignKey("category.id"), nullable=False)
+    category = db.relationship("Category")
+
+    # "substring" or "regex" (matched case-insensitively against the description)
+    match_type = db.Column(db.String(20), nullable=False, default="substring")
+    pattern = db.Column(db.String(255), nullable=True)
+    min_amount = db.Column(db.Numeric(12, 2), nullable=True)
+    max_amount = db.Column(db.Numeric(12, 2), nullable=True)
+    # import source, e.g. the bank the statement came from
+    source = db.Column(db.String(128), nullable=True)
+
+    priority = db.Column(db.Integer, nullable=False, default=100)
+
+# Login accounts (see shards.py). Lives in the main database only; db_file is
+# the user's own database under SHARD_DIR, NULL for the bootstrap admin, whose
+# data is the main database.
+class User(db.Model):
+    __tablename__ = "users"
+    id = db.Column(db.Integer, primary_key=True)
+    username = db.Column(db.String(64), unique=True, nullable=False)
+    password_hash = db.Column(db.String(255), nullable=False)
+    db_file = db.Column(db.String(64), nullable=True, unique=True)
+    created_at = db.Column(db.DateTime, nullable=False, server_default=db.func.current_timestamp())
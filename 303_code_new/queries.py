@@ -0,0 +1,254 @@
+"""
+Filtered transaction queries for the expense/income listings, their CSV
+exports and /api/v1/transactions.
+
+A TransactionFilter combines a date range, a category set (each category
+includes its subcategories through the closure table), an amount range,
+an income source, a text search and a tag filter. Amount bounds and totals
+are in the base currency (base_amount, see fx.py). Predicates are split in two:
+
+- indexed: date range and categories, which SQLite answers from
+  ix_expense_date / ix_expense_category_id;
+- residual: amount, source, text and tags, checked on the rows the index
+  found.
+
+Pages are fetched with LIMIT/OFFSET ordered by (date, id) descending, one row
+past the page to know whether there is a next one. Listings only read, so
+rows come back as slotted tuples (ExpenseRow, IncomeRow, BudgetRow) from
+column-projected queries that join in the category name and the row's tags,
+not as ORM objects with identity-map and lazy-load state; writes still go
+through the models. Counting is capped: up to
+COUNT_CAP matching rows are counted exactly. Beyond that the count is
+estimated as (rows matching the indexed predicates) x (share of a
+COUNT_SAMPLE-row sample of them that also passes the residual ones), so a
+filter over millions of rows never counts them one by one.
+"""
+from collections import namedtuple
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from sqlalchemy import and_, case, func, select, true
+from database import db
+from models import Budget, Category, CategoryClosure, Expense, Income
+from tags import TagFilter, NO_TAG_FILTER, matching_ids, tag_names
+
+MODELS = {"expense": Expense, "income": Income}
+COUNT_CAP = 10_000
+COUNT_SAMPLE = 2_000
+MAX_PER_PAGE = 500
+
+Page = namedtuple("Page", "items page per_page count count_exact total has_next")
+
+# read-side rows; `category` is the category name, `tags` a sorted tuple of tag names
+class ExpenseRow(namedtuple(
+    "ExpenseRow", "id date amount currency base_amount description category_id category tags"
+)):
+    __slots__ = ()
+
+class IncomeRow(namedtuple("IncomeRow", "id date amount currency base_amount source tags")):
+    __slots__ = ()
+
+class BudgetRow(namedtuple("BudgetRow", "id month_key amount category_id category")):
+    __slots__ = ()
+
+
+class TransactionFilter(namedtuple(
+    "TransactionFilter", "kind start end categories min_amount max_amount source text tags"
+)):
+    __slots__ = ()
+
+    @classmethod
+    def from_args(cls, args, kind: str = "expense"):
+        """
+        Build from query args: start, end (YYYY-MM-DD), category (repeatable,
+        id or name), min, max, source, q, tag_all/tag_any/tag_none.
+        Raises ValueError on malformed values.
+        """
+        kind = args.get("kind", kind)
+        if kind not in MODELS:
+            raise ValueError(f"Unknown kind: {kind}")
+        return cls(
+            kind=kind,
+            start=_date(args.get("start")),
+            end=_date(args.get("end")),
+            categories=_category_ids(args.getlist("category")) if kind == "expense" else (),
+            min_amount=_amount(args.get("min")),
+            max_amount=_amount(args.get("max")),
+            source=(args.get("source") or "").strip() or None,
+            text=(args.get("q") or "").strip() or None,
+            tags=TagFilter.from_args(args),
+        )
+
+    @property
+    def model(self):
+        return MODELS[self.kind]
+
+    def query_args(self) -> dict:
+        """Query args that rebuild this filter (for pager and export links)."""
+        args = {
+            "start": self.start.isoformat() if self.start else None,
+            "end": self.end.isoformat() if self.end else None,
+            "category": list(self.categories) or None,
+            "min": str(self.min_amount) if self.min_amount is not None else None,
+            "max": str(self.max_amount) if self.max_amount is not None else None,
+            "source": self.source,
+            "q": self.text,
+            **self.tags.query_args(),
+        }
+        return {k: v for k, v in args.items() if v}
+
+    def __bool__(self):
+        return any(v for k, v in zip(self._fields, self) if k != "kind")
+
+def empty_filter(kind: str = "expense") -> TransactionFilter:
+    return TransactionFilter(kind, None, None, (), None, None, None, None, NO_TAG_FILTER)
+
+
+def _date(value):
+    return datetime.strptime(value, "%Y-%m-%d").date() if value else None
+
+def _amount(value):
+    if not value:
+        return None
+    try:
+        return Decimal(value)
+    except InvalidOperation:
+        raise ValueError(f"Invalid amount: {value}")
+
+def _category_ids(values) -> tuple:
+    ids, names = [], []
+    for v in values:
+        v = v.strip()
+        if v.isdigit():
+            ids.append(int(v))
+        elif v:
+            names.append(v)
+    if names:
+        found = dict(db.session.query(Category.name, Category.id).filter(Category.name.in_(names)))
+        missing = [n for n in names if n not in found]
+        if missing:
+            raise ValueError(f"Unknown category: {', '.join(missing)}")
+        ids += found.values()
+    return tuple(sorted(set(ids)))
+
+
+def conditions(f: TransactionFilter):
+    """(indexed, residual) lists of WHERE clauses for the filter."""
+    model = f.model
+    indexed, residual = [], []
+    if f.start:
+        indexed.append(model.date >= f.start)
+    if f.end:
+        indexed.append(model.date <= f.end)
+    if f.categories and model is Expense:
+        subtree = select(CategoryClosure.descendant_id).where(CategoryClosure.ancestor_id.in_(f.categories))
+        indexed.append(Expense.category_id.in_(subtree))
+    if f.min_amount is not None:
+        residual.append(model.base_amount >= f.min_amount)
+    if f.max_amount is not None:
+        residual.append(model.base_amount <= f.max_amount)
+    if f.source and model is Income:
+        residual.append(func.lower(Income.source) == f.source.lower())
+    if f.text:
+        column = Expense.description if model is Expense else Income.source
+        pattern = "%" + f.text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        residual.append(column.like(pattern, escape="\\"))
+    if f.tags:
+        residual.append(model.id.in_(matching_ids(model, f.tags)))
+    return indexed, residual
+
+def where_clause(f: TransactionFilter):
+    indexed, residual = conditions(f)
+    return and_(true(), *indexed, *residual)
+
+
+def count_transactions(f: TransactionFilter, cap: int = COUNT_CAP) -> tuple:
+    """(count, exact): exact up to `cap` matches, estimated beyond that."""
+    model = f.model
+    indexed, residual = conditions(f)
+    capped = db.session.scalar(
+        select(func.count()).select_from(
+            select(model.id).where(*indexed, *residual).limit(cap + 1).subquery()
+        )
+    )
+    if capped <= cap:
+        return capped, True
+
+    base = db.session.scalar(select(func.count(model.id)).where(*indexed))
+    if not residual:
+        return base, True
+    sample = select(case((and_(*residual), 1), else_=0).label("hit")).where(*indexed) \
+        .order_by(model.date.desc(), model.id.desc()).limit(COUNT_SAMPLE).subquery()
+    hits, seen = db.session.execute(select(func.sum(sample.c.hit), func.count())).one()
+    estimate = round(base * (hits or 0) / seen) if seen else 0
+    return max(estimate, cap + 1), False
+
+
+def query_transactions(f: TransactionFilter, page: int = 1, per_page: int = 50,
+                       with_totals: bool = True, exact_count: bool = False) -> Page:
+    """One page of matching rows (newest first), plus count and, optionally, the amount total."""
+    model = f.model
+    page = max(1, page)
+    per_page = max(1, min(per_page, MAX_PER_PAGE))
+    where = where_clause(f)
+
+    stmt = _row_select(model).where(where).order_by(model.date.desc(), model.id.desc())
+    rows = _rows(model, db.session.execute(stmt.limit(per_page + 1).offset((page - 1) * per_page)))
+
+    if exact_count or with_totals:
+        # one aggregate pass gives the exact count along with the total
+        count, total = db.session.execute(select(func.count(model.id), func.sum(model.base_amount)).where(where)).one()
+        exact = True
+    else:
+        (count, exact), total = count_transactions(f), None
+    return Page(
+        items=rows[:per_page], page=page, per_page=per_page, count=count, count_exact=exact,
+        total=(total or Decimal("0")) if with_totals else None, has_next=len(rows) > per_page,
+    )
+
+
+def _row_select(model):
+    tag_list = tag_names(model)
+    if model is Expense:
+        return select(Expense.id, Expense.date, Expense.amount, Expense.currency, Expense.base_amount,
+                      Expense.description, Expense.category_id, Category.name, tag_list).join(Expense.category)
+    return select(Income.id, Income.date, Income.amount, Income.currency, Income.base_amount,
+                  Income.source, tag_list)
+
+def _rows(model, result) -> list:
+    make = ExpenseRow if model is Expense else IncomeRow
+    return [make(*row[:-1], tuple(sorted(row[-1].split(","))) if row[-1] else ()) for row in result]
+
+def transaction_row(model, row_id: int):
+    """One ExpenseRow / IncomeRow by id, or None."""
+    found = _rows(model, db.session.execute(_row_select(model).where(model.id == row_id)))
+    return found[0] if found else None
+
+def recent_expenses(start, end, limit: int = 5) -> list:
+    """Newest ExpenseRows dated in [start, end]."""
+    stmt = _row_select(Expense).where(Expense.date >= start, Expense.date <= end) \
+        .order_by(Expense.date.desc(), Expense.id.desc()).limit(limit)
+    return _rows(Expense, db.session.execute(stmt))
+
+def budget_rows(month_key: str | None = None) -> list:
+    """BudgetRows, newest month first (or just `month_key`'s)."""
+    stmt = select(Budget.id, Budget.month_key, Budget.amount, Budget.category_id, Category.name) \
+        .outerjoin(Category, Category.id == Budget.category_id) \
+        .order_by(Budget.month_key.desc(), Budget.id)
+    if month_key is not None:
+        stmt = stmt.where(Budget.month_key == month_key)
+    return [BudgetRow(*row) for row in db.session.execute(stmt)]
+
+
+def transaction_json(row) -> dict:
+    if isinstance(row, ExpenseRow):
+        return {
+            "id": row.id, "kind": "expense", "date": row.date.isoformat(), "amount": float(row.amount),
+            "currency": row.currency, "base_amount": float(row.base_amount),
+            "description": row.description or "", "category_id": row.category_id,
+            "category": row.category, "tags": list(row.tags),
+        }
+    return {
+        "id": row.id, "kind": "income", "date": row.date.isoformat(), "amount": float(row.amount),
+        "currency": row.currency, "base_amount": float(row.base_amount),
+        "source": row.source, "tags": list(row.tags),
+    }
@@ -0,0 +1,123 @@
+"""
+Query-plan guard (test mode, config QUERY_PLAN_GUARD = True).
+
+Every SELECT/UPDATE/DELETE sent to SQLite (the main database and each user
+database opened while the guard is on, see shards.py) is also run through
+EXPLAIN QUERY PLAN on the same connection, and the plan is recorded under the
+current endpoint (or, outside a request, the helper in this package that
+issued it). A plan line "SCAN <table>" on one of the guarded tables whose row
+count exceeds QUERY_PLAN_MAX_SCAN_ROWS is a violation; tests call
+assert_no_full_scans() and get the per-endpoint plan report when it fails.
+
+Pages that browse or analyse a whole table on purpose are listed in ALLOWED_SCANS.
+"""
+import os
+import re
+import sys
+from flask import current_app, has_request_context, request
+from sqlalchemy import event
+
+GUARDED_TABLES = ("expense", "income", "recurring_items")
+
+# endpoint -> tables it may scan on purpose
+ALLOWED_SCANS = {
+    # unfiltered pages walk the date index newest first
+    "expenses.expenses": {"expense"},
+    "income.income": {"income"},
+    "api.transactions": {"expense", "income"},
+    "recurring.recurring": {"recurring_items"},
+    "expenses.duplicates": {"expense"},       # groups all fingerprints
+    "recurring.recurring_suggestions": {"expense", "income", "recurring_items"},
+}
+
+_SCAN = re.compile(r"^SCAN (\w+)")
+_EXPLAINABLE = ("SELECT", "UPDATE", "DELETE", "WITH")
+_HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+class FullScanError(AssertionError):
+    pass
+
+
+class PlanRecorder:
+    def __init__(self, engine, tables=GUARDED_TABLES, max_scan_rows: int = 1000):
+        self.engines = []
+        self.tables = set(tables)
+        self.max_scan_rows = max_scan_rows
+        self.plans = {}         # where -> {sql: [plan line, ...]}
+        self.violations = []    # (where, table, rows, plan line, sql)
+        self.watch(engine)
+
+    def watch(self, engine):
+        self.engines.append(engine)
+        event.listen(engine, "before_cursor_execute", self._explain)
+
+    def unwatch(self, engine):
+        if engine in self.engines:
+            self.engines.remove(engine)
+            event.remove(engine, "before_cursor_execute", self._explain)
+
+    def close(self):
+        for engine in list(self.engines):
+            self.unwatch(engine)
+
+    def reset(self):
+        self.plans.clear()
+        self.violations.clear()
+
+    def _explain(self, conn, cursor, statement, parameters, context, executemany):
+        if executemany or not statement.lstrip().upper().startswith(_EXPLAINABLE):
+            return
+        raw = cursor.connection
+        lines = [row[3] for row in raw.execute("EXPLAIN QUERY PLAN " + statement, parameters or ())]
+        where = _caller()
+        self.plans.setdefault(where, {})[statement] = lines
+        allowed = ALLOWED_SCANS.get(where, ())
+        for line in lines:
+            m = _SCAN.match(line)
+            if not m or m.group(1) not in self.tables or m.group(1) in allowed:
+                continue
+            rows = raw.execute(f'SELECT count(*) FROM "{m.group(1)}"').fetchone()[0]
+            if rows > self.max_scan_rows:
+                self.violations.append((where, m.group(1), rows, line, statement))
+
+    def report(self) -> str:
+        out = []
+        for where in sorted(self.plans):
+            out.append(f"== {where}")
+            for sql, lines in self.plans[where].items():
+                out.append("  " + " ".join(sql.split()))
+                out.extend(f"    {line}" for line in lines)
+        return "\n".join(out)
+
+    def assert_no_full_scans(self):
+        if self.violations:
+            found = "\n".join(f"{w}: {line} ({rows} rows)\n  {' '.join(sql.split())}"
+                              for w, _, rows, line, sql in self.violations)
+            raise FullScanError(f"full table scans:\n{found}\n\nplans:\n{self.report()}")
+
+
+def _caller() -> str:
+    if has_request_context() and request.endpoint:
+        return request.endpoint
+    # innermost frame in this package, e.g. "functions.monthly_trend"
+    frame = sys._getframe(2)
+    while frame:
+        path = frame.f_code.co_filename
+        if path.startswith(_HERE) and path != __file__ and "site-packages" not in path:
+            module = os.path.splitext(os.path.relpath(path, _HERE))[0].replace(os.sep, ".")
+            return f"{module}.{frame.f_code.co_name}"
+        frame = frame.f_back
+    return "?"
+
+
+def init_query_plans(app):
+    if app.config.get("QUERY_PLAN_GUARD"):
+        from database import db
+        with app.app_context():
+            app.extensions["query_plans"] = PlanRecorder(
+                db.engine, max_scan_rows=app.config.get("QUERY_PLAN_MAX_SCAN_ROWS", 1000),
+            )
+
+def plan_recorder() -> PlanRecorder:
+    return current_app.extensions["query_plans"]
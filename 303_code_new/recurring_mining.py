@@ -0,0 +1,142 @@
+"""
+US8: mine the transaction history for recurring charges and paychecks.
+
+Expenses are grouped by normalized description and category, income by
+source. Each group is split into amount clusters (consecutive sorted amounts
+within AMOUNT_TOLERANCE of each other) so two plans from the same merchant are
+kept apart. For every cluster the gaps between dates are classified as
+weekly, biweekly, monthly or every N days. The cluster is then scored on how
+regular the gaps are and how stable the amount is, scaled down for few
+occurrences and for patterns that have stopped.
+
+Only the needed columns are loaded, in one query per table, so years of
+history take well under a second.
+"""
+import statistics
+from collections import defaultdict
+from datetime import date, timedelta
+from decimal import Decimal
+from database import db
+from models import Expense, Income, RecurringItem, normalize_description
+from functions import _advance_date, add_recurring_item
+
+AMOUNT_TOLERANCE = 0.15
+MIN_OCCURRENCES = 3
+# share of gaps within max(2 days, 10%) of the median gap
+MIN_REGULARITY = 0.5
+MAX_EVERY_N_DAYS = 366
+
+# (freq, nominal days, allowed deviation of the median gap)
+PERIODS = (
+    ("weekly", 7, 1),
+    ("biweekly", 14, 2),
+    ("monthly", 30.4, 3),
+)
+PERIOD_DAYS = {freq: days for freq, days, _ in PERIODS}
+
+
+def _amount_clusters(rows):
+    """Split (date, amount, label) rows into clusters of similar amounts."""
+    rows = sorted(rows, key=lambda r: r[1])
+    clusters = [[rows[0]]]
+    for row in rows[1:]:
+        # compare with the cluster's smallest amount so clusters cannot drift
+        low = clusters[-1][0][1]
+        if low and (row[1] - low) / low <= AMOUNT_TOLERANCE:
+            clusters[-1].append(row)
+        else:
+            clusters.append([row])
+    return clusters
+
+def _classify_period(gaps):
+    """(freq, every_n_days, regularity 0..1) for a list of day gaps, or None."""
+    median = statistics.median(gaps)
+    if median < 1:
+        return None
+    tolerance = max(2.0, 0.1 * median)
+    regularity = sum(1 for g in gaps if abs(g - median) <= tolerance) / len(gaps)
+    if regularity < MIN_REGULARITY:
+        return None
+    for freq, days, slack in PERIODS:
+        if abs(median - days) <= slack:
+            return freq, None, regularity
+    if regularity >= 0.8 and median <= MAX_EVERY_N_DAYS:
+        return "every_n_days", int(round(median)), regularity
+    return None
+
+def _score(cluster, today, min_occurrences):
+    cluster.sort(key=lambda r: r[0])
+    dates = sorted({r[0] for r in cluster})
+    if len(dates) < min_occurrences:
+        return None
+    gaps = [(b - a).days for a, b in zip(dates, dates[1:])]
+    period = _classify_period(gaps)
+    if not period:
+        return None
+    freq, every_n_days, regularity = period
+
+    amounts = [r[1] for r in cluster]
+    mean = statistics.fmean(amounts)
+    stability = max(0.0, 1.0 - statistics.pstdev(amounts) / mean) if mean else 0.0
+    # three sightings can be chance; six or more is a pattern
+    volume = min(1.0, (len(dates) - 1) / 5)
+
+    last = dates[-1]
+    next_run = _advance_date(last, freq, every_n_days, None)
+    while next_run < today - timedelta(days=3):
+        next_run = _advance_date(next_run, freq, every_n_days, None)
+    # missed more than one cycle: probably cancelled
+    cycle = every_n_days or PERIOD_DAYS[freq]
+    current = 1.0 if (today - last).days <= 1.5 * cycle + 3 else 0.5
+
+    confidence = (0.6 * regularity + 0.4 * stability) * volume * current
+    return {
+        "name": cluster[-1][2],
+        "amount": Decimal(str(round(statistics.median(amounts), 2))),
+        "freq": freq,
+        "every_n_days": every_n_days,
+        "occurrences": len(dates),
+        "last_date": last,
+        "next_run_date": next_run,
+        "confidence": round(confidence, 3),
+    }
+
+def mine_recurring_candidates(today: date | None = None, min_occurrences: int = MIN_OCCURRENCES,
+                              min_confidence: float = 0.0) -> list:
+    """Proposed RecurringItem values, best first. Skips patterns already tracked."""
+    today = today or date.today()
+    tracked = {normalize_description(n) for (n,) in db.session.query(RecurringItem.name)}
+
+    groups = defaultdict(list)
+    for when, amount, desc, category_id in db.session.query(
+        Expense.date, Expense.amount, Expense.description, Expense.category_id
+    ):
+        # rows posted by the recurring job itself
+        if (desc or "").startswith("[Recurring] "):
+            continue
+        groups[("expense", normalize_description(desc), category_id)].append((when, float(amount), desc))
+    for when, amount, source in db.session.query(Income.date, Income.amount, Income.source):
+        groups[("income", normalize_description(source), None)].append((when, float(amount), source))
+
+    candidates = []
+    for (kind, key, category_id), rows in groups.items():
+        if not key or key in tracked or len(rows) < min_occurrences:
+            continue
+        for cluster in _amount_clusters(rows):
+            found = _score(cluster, today, min_occurrences)
+            if found and found["confidence"] >= min_confidence:
+                found.update(kind=kind, category_id=category_id,
+                             income_source=found["name"] if kind == "income" else None)
+                candidates.append(found)
+    candidates.sort(key=lambda c: c["confidence"], reverse=True)
+    return candidates
+
+def accept_recurring_candidate(candidate: dict, auto_post: bool = False) -> RecurringItem:
+    return add_recurring_item(
+        name=candidate["name"], kind=candidate["kind"], amount=candidate["amount"],
+        category_id=candidate.get("category_id"), income_source=candidate.get("income_source"),
+        freq=candidate["freq"], every_n_days=candidate.get("every_n_days"), day_of_month=None,
+        start_date=candidate["next_run_date"], next_run_date=candidate["next_run_date"],
+        end_date=None, auto_post=auto_post, active=True,
+        notes=f"Detected from {candidate['occurrences']} past transactions",
+    )
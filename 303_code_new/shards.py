@@ -0,0 +1,165 @@
+"""
+Per-user databases.
+
+Each user's expenses, budgets, accounts and so on live in a SQLite file of
+their own under SHARD_DIR (default instance/users). One household's tables
+and indexes never grow another's, and a heavy user's queries and writes only
+lock their own file. The directory itself (the `users` table: name, password
+hash, database file) lives in the main database. The bootstrap user
+admin/1234 keeps the main database as their data, so an existing site.db
+simply carries on as admin's.
+
+Routing: db.session is a database.ShardSession. Its get_bind() sends every
+table except the directory's to the engine of the current shard, g.shard,
+which a request takes from its login session and a background thread sets
+with use_shard(). g and the session both belong to the app context, so one
+request never sees another's shard.
+
+Engines are opened on first use, creating or upgrading the schema the way
+init_db does for the main database, and kept in an LRU of SHARD_ENGINES. The
+least recently used engine is disposed when another one is needed;
+connections still checked out of it finish normally. With QUERY_PLAN_GUARD
+on, each engine is watched by the query-plan recorder too.
+
+Background work keeps the shard it was started from: the write queue commits
+each shard's jobs in a transaction of their own, and event handlers run on
+the shard their events were committed in.
+"""
+import os
+import re
+import threading
+from collections import OrderedDict, namedtuple
+from contextlib import contextmanager
+from functools import lru_cache
+from flask import g, session
+from sqlalchemy import create_engine, event
+from werkzeug.security import check_password_hash, generate_password_hash
+from database import db, commit, schema_is_current, sync_schema, _use_wal
+from models import User
+
+BOOTSTRAP_USERNAME = "admin"
+BOOTSTRAP_PASSWORD = "1234"
+
+_DB_FILE = re.compile(r"^[\w-]+\.db$")
+
+UserRow = namedtuple("UserRow", "id username db_file created_at")
+
+
+# ==============================
+# Directory
+# ==============================
+
+@lru_cache(maxsize=1)
+def _bootstrap_hash() -> str:
+    # hashing is slow on purpose; a fresh database should not pay for it twice
+    return generate_password_hash(BOOTSTRAP_PASSWORD)
+
+def ensure_bootstrap_user() -> None:
+    """Create admin/1234 on the main database while there are no users at all."""
+    if User.query.first() is None:
+        db.session.add(User(username=BOOTSTRAP_USERNAME, password_hash=_bootstrap_hash()))
+        commit()
+
+def authenticate(username: str, password: str) -> UserRow | None:
+    ensure_bootstrap_user()
+    user = User.query.filter_by(username=username).first()
+    if user is None or not check_password_hash(user.password_hash, password):
+        return None
+    return UserRow(user.id, user.username, user.db_file, user.created_at)
+
+def create_user(username: str, password: str) -> UserRow:
+    """Add a login with a database of its own (created on first use)."""
+    username = (username or "").strip()
+    if not username or not password:
+        raise ValueError("Username and password are required.")
+    if User.query.filter_by(username=username).first():
+        raise ValueError(f"User {username} already exists.")
+    user = User(username=username, password_hash=generate_password_hash(password))
+    db.session.add(user)
+    db.session.flush()
+    user.db_file = f"user-{user.id}.db"
+    commit()
+    return UserRow(user.id, user.username, user.db_file, user.created_at)
+
+def all_users() -> list[UserRow]:
+    return [UserRow(u.id, u.username, u.db_file, u.created_at) for u in User.query.order_by(User.username)]
+
+def all_shards() -> list:
+    """Every user's database, the main one (None) first."""
+    return [None] + [f for (f,) in db.session.query(User.db_file).filter(User.db_file.isnot(None))]
+
+
+# ==============================
+# Routing
+# ==============================
+
+@contextmanager
+def use_shard(shard: str | None):
+    """Route db.session to `shard` inside the block; use it between transactions."""
+    previous = g.get("shard")
+    g.shard = shard
+    try:
+        yield
+    finally:
+        g.shard = previous
+
+
+class ShardEngines:
+    """LRU of per-user engines, opened (and their schema synced) on first use."""
+
+    def __init__(self, app, directory: str, capacity: int = 16):
+        self.app = app
+        self.directory = directory
+        self.capacity = max(1, capacity)
+        self.stats = {"opened": 0, "evicted": 0}
+        self._engines = OrderedDict()
+        self._lock = threading.Lock()
+
+    def path(self, shard: str) -> str:
+        if not _DB_FILE.match(shard):
+            raise ValueError(f"Not a user database: {shard!r}")
+        return os.path.join(self.directory, shard)
+
+    def engine(self, shard: str):
+        with self._lock:
+            engine = self._engines.get(shard)
+            if engine is not None:
+                self._engines.move_to_end(shard)
+                return engine
+            engine = self._engines[shard] = self._open(shard)
+            self.stats["opened"] += 1
+            while len(self._engines) > self.capacity:
+                _, oldest = self._engines.popitem(last=False)
+                if "query_plans" in self.app.extensions:
+                    self.app.extensions["query_plans"].unwatch(oldest)
+                oldest.dispose()
+                self.stats["evicted"] += 1
+            return engine
+
+    def _open(self, shard: str):
+        os.makedirs(self.directory, exist_ok=True)
+        engine = create_engine(f"sqlite:///{self.path(shard)}",
+                               **self.app.config.get("SQLALCHEMY_ENGINE_OPTIONS", {}))
+        if self.app.config.get("SQLITE_WAL", True):
+            event.listen(engine, "connect", _use_wal)
+        if not schema_is_current(engine):
+            sync_schema(engine)
+        if "query_plans" in self.app.extensions:
+            self.app.extensions["query_plans"].watch(engine)
+        return engine
+
+
+def init_shards(app):
+    app.extensions["shards"] = ShardEngines(
+        app,
+        app.config.get("SHARD_DIR") or os.path.join(app.instance_path, "users"),
+        capacity=app.config.get("SHARD_ENGINES", 16),
+    )
+
+    @app.before_request
+    def route_to_user_database():
+        if session.get("logged_in"):
+            g.shard = session.get("shard")
+
+    with app.app_context():
+        ensure_bootstrap_user()
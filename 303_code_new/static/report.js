@@ -29,8 +29,41 @@ const colorArray = [
 Chart.defaults.color = '#dee2e6';
 Chart.defaults.borderColor = '#495057';
 
+// Fetch one panel's JSON. The server answers with an ETag, so a repeat
+// visit only revalidates (304) instead of recomputing and re-downloading.
+function loadPanel(name) {
+    return fetch(panelUrls[name], { credentials: 'same-origin' })
+        .then(resp => {
+            if (!resp.ok) throw new Error(`${name} panel failed: ${resp.status}`);
+            return resp.json();
+        });
+}
+
+function showEmpty(canvasId, emptyId) {
+    document.getElementById(canvasId).parentElement.classList.add('d-none');
+    document.getElementById(emptyId).classList.remove('d-none');
+}
+
+function money(value) {
+    return (value < 0 ? '-$' : '$') + Math.abs(value).toFixed(2);
+}
+
+// 0. KPI cards
+function drawSummary(summary) {
+    document.getElementById('kpiIncome').textContent = money(summary.total_income);
+    document.getElementById('kpiSpend').textContent = money(summary.total_spend);
+    const net = document.getElementById('kpiNet');
+    net.textContent = money(summary.net);
+    net.classList.add(summary.net >= 0 ? 'positive' : 'negative');
+    document.getElementById('kpiNetIcon').className = 'bi bi-graph-' + (summary.net >= 0 ? 'up' : 'down');
+}
+
 // 1. Category Pie Chart
-if (document.getElementById('categoryPieChart') && spendData && spendData.length > 0) {
+function drawCategoryPie(spendData) {
+    if (!spendData || spendData.length === 0) {
+        showEmpty('categoryPieChart', 'categoryPieEmpty');
+        return;
+    }
     const ctx = document.getElementById('categoryPieChart').getContext('2d');
     new Chart(ctx, {
         type: 'pie',
@@ -72,7 +105,9 @@ if (document.getElementById('categoryPieChart') && spendData && spendData.length
 }
 
 // 2. Income vs Expense Bar Chart
-if (document.getElementById('incomeExpenseChart')) {
+function drawIncomeExpense(summary) {
+    const totalIncome = summary.total_income;
+    const totalSpend = summary.total_spend;
     const ctx = document.getElementById('incomeExpenseChart').getContext('2d');
     new Chart(ctx, {
         type: 'bar',
@@ -139,7 +174,8 @@ if (document.getElementById('incomeExpenseChart')) {
 }
 
 // 3. Monthly Trend Line Chart
-if (document.getElementById('monthlyTrendChart') && monthlyTrends && monthlyTrends.length > 0) {
+function drawTrends(monthlyTrends) {
+    if (!monthlyTrends || monthlyTrends.length === 0) return;
     const ctx = document.getElementById('monthlyTrendChart').getContext('2d');
     new Chart(ctx, {
         type: 'line',
@@ -216,7 +252,11 @@ if (document.getElementById('monthlyTrendChart') && monthlyTrends && monthlyTren
 }
 
 // 4. Budget Status Chart
-if (document.getElementById('budgetChart') && budgetData && budgetData.length > 0) {
+function drawBudgets(budgetData) {
+    if (!budgetData || budgetData.length === 0) {
+        showEmpty('budgetChart', 'budgetEmpty');
+        return;
+    }
     const ctx = document.getElementById('budgetChart').getContext('2d');
     
     const categories = budgetData.map(d => d.category);
@@ -289,3 +329,86 @@ if (document.getElementById('budgetChart') && budgetData && budgetData.length >
         }
     });
 }
+
+// 5. Spending by tag
+function drawTags(tagData) {
+    if (!tagData || tagData.length === 0) {
+        document.getElementById('tagTable').classList.add('d-none');
+        document.getElementById('tagEmpty').classList.remove('d-none');
+        return;
+    }
+    const body = document.querySelector('#tagTable tbody');
+    tagData.forEach(row => {
+        const tr = document.createElement('tr');
+        [row.tag, row.count, money(row.spent)].forEach(value => {
+            const td = document.createElement('td');
+            td.textContent = value;
+            tr.appendChild(td);
+        });
+        body.appendChild(tr);
+    });
+}
+
+// 6. Daily calendar heatmap: one column per week, one row per weekday.
+// The server sends plain per-day arrays; cells are built here.
+let heatmapData = null;
+
+function drawHeatmap() {
+    const series = document.getElementById('heatmapSeries').value;
+    const values = (heatmapData && heatmapData[series]) || [];
+    const grid = document.getElementById('heatmap');
+    const empty = document.getElementById('heatmapEmpty');
+    grid.replaceChildren();
+    const max = Math.max(0, ...values);
+    grid.classList.toggle('d-none', max === 0);
+    empty.classList.toggle('d-none', max > 0);
+    if (max === 0) return;
+
+    const start = new Date(heatmapData.start + 'T00:00:00');
+    const color = series === 'spend' ? '220, 53, 69' : '25, 135, 84';
+    const fragment = document.createDocumentFragment();
+    for (let i = 0; i < start.getDay(); i++) {
+        fragment.appendChild(document.createElement('div'));  // pad the first week
+    }
+    values.forEach((value, i) => {
+        const day = new Date(start.getFullYear(), 0, i + 1);
+        const cell = document.createElement('div');
+        cell.className = 'heatmap-cell';
+        // square-root scale so a few large days do not wash out the rest
+        const level = value > 0 ? 0.15 + 0.85 * Math.sqrt(value / max) : 0;
+        cell.style.backgroundColor = level ? `rgba(${color}, ${level.toFixed(2)})` : '#343a40';
+        cell.title = `${day.toDateString()}: ${money(value)}`;
+        fragment.appendChild(cell);
+    });
+    grid.appendChild(fragment);
+}
+
+function loadHeatmap() {
+    const category = document.getElementById('heatmapCategory').value;
+    const series = document.getElementById('heatmapSeries');
+    // income has no categories
+    series.disabled = category !== '';
+    if (category) series.value = 'spend';
+    const url = panelUrls.heatmap + (category ? `&category_id=${category}` : '');
+    fetch(url, { credentials: 'same-origin' })
+        .then(resp => {
+            if (!resp.ok) throw new Error(`heatmap failed: ${resp.status}`);
+            return resp.json();
+        })
+        .then(data => { heatmapData = data; drawHeatmap(); })
+        .catch(console.error);
+}
+
+document.getElementById('heatmapCategory').addEventListener('change', loadHeatmap);
+document.getElementById('heatmapSeries').addEventListener('change', drawHeatmap);
+
+// All panels load in parallel; each chart draws as soon as its data arrives
+loadPanel('summary').then(summary => {
+    drawSummary(summary);
+    drawIncomeExpense(summary);
+}).catch(console.error);
+loadPanel('categories').then(drawCategoryPie).catch(console.error);
+loadPanel('trends').then(drawTrends).catch(console.error);
+loadPanel('budgets').then(drawBudgets).catch(console.error);
+loadPanel('tags').then(drawTags).catch(console.error);
+loadHeatmap();
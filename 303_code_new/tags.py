@@ -0,0 +1,122 @@
+"""
+Tags on expenses and income.
+
+Each link table (expense_tags, income_tags) is a WITHOUT ROWID table keyed by
+(tag_id, row id), so the rows of one tag are a sorted id list stored
+contiguously in the primary-key b-tree. A filter like "vacation-2026 AND
+reimbursable AND NOT refunded" becomes
+
+    ids of tag A  INTERSECT  ids of tag B  EXCEPT  ids of tag C
+
+which SQLite answers by walking those id ranges, without touching the
+expense table, before joining back for amounts. Tag filters and tag totals
+cover live rows; archived transactions keep no tags.
+"""
+import re
+from collections import namedtuple
+from sqlalchemy import except_, false, func, intersect, select
+from database import db
+from models import Tag, Expense, Income, expense_tags, income_tags
+
+LINKS = {Expense: (expense_tags, expense_tags.c.expense_id), Income: (income_tags, income_tags.c.income_id)}
+
+
+def parse_tags(text) -> list:
+    """"Vacation 2026, reimbursable" -> ["vacation-2026", "reimbursable"] (unique, in order)."""
+    if isinstance(text, str):
+        text = text.split(",")
+    names = []
+    for raw in text or ():
+        name = re.sub(r"\s+", "-", raw.strip().lower())
+        if name and name not in names:
+            names.append(name)
+    return names
+
+def get_or_create_tags(names) -> list:
+    names = parse_tags(names)
+    found = {t.name: t for t in Tag.query.filter(Tag.name.in_(names))} if names else {}
+    for name in names:
+        if name not in found:
+            found[name] = Tag(name=name)
+            db.session.add(found[name])
+    return [found[n] for n in names]
+
+def all_tags():
+    return Tag.query.order_by(Tag.name).all()
+
+
+class TagFilter(namedtuple("TagFilter", "all any none")):
+    """Rows having every tag in `all`, at least one in `any` (if given), none in `none`."""
+    __slots__ = ()
+
+    @classmethod
+    def from_args(cls, args):
+        return cls(*(tuple(parse_tags(args.get(f"tag_{k}", ""))) for k in cls._fields))
+
+    def __bool__(self):
+        return any((self.all, self.any, self.none))
+
+    def query_args(self) -> dict:
+        return {f"tag_{k}": ",".join(v) for k, v in zip(self._fields, self) if v}
+
+NO_TAG_FILTER = TagFilter((), (), ())
+
+
+def matching_ids(model, tag_filter: TagFilter):
+    """SELECT of the ids of `model` rows matching the filter."""
+    link, id_col = LINKS[model]
+    names = set(tag_filter.all) | set(tag_filter.any) | set(tag_filter.none)
+    ids = dict(db.session.query(Tag.name, Tag.id).filter(Tag.name.in_(names))) if names else {}
+    if any(n not in ids for n in tag_filter.all):
+        return select(model.id).where(false())
+
+    def tagged(*tag_ids):
+        return select(id_col).where(link.c.tag_id.in_(tag_ids) if len(tag_ids) > 1 else link.c.tag_id == tag_ids[0])
+
+    sets = [tagged(ids[n]) for n in tag_filter.all]
+    any_ids = [ids[n] for n in tag_filter.any if n in ids]
+    if tag_filter.any:
+        if not any_ids:
+            return select(model.id).where(false())
+        sets.append(tagged(*any_ids))
+    result = (intersect(*sets) if len(sets) > 1 else sets[0]) if sets else select(model.id)
+    none_ids = [ids[n] for n in tag_filter.none if n in ids]
+    if none_ids:
+        # SQLite rejects parenthesized compounds, so nest the left side as a subquery
+        if len(sets) > 1:
+            left = result.subquery()
+            result = select(left.c[0])
+        result = except_(result, tagged(*none_ids))
+    return result
+
+def tag_names(model):
+    """Correlated subquery: the row's tag names joined with commas (unordered), or NULL."""
+    link, id_col = LINKS[model]
+    return (
+        select(func.group_concat(Tag.name, ","))
+        .join(link, link.c.tag_id == Tag.id)
+        .where(id_col == model.id)
+        .scalar_subquery()
+    )
+
+def filter_by_tags(query, model, tag_filter: TagFilter):
+    if not tag_filter:
+        return query
+    return query.filter(model.id.in_(matching_ids(model, tag_filter)))
+
+def tag_totals(model, start=None, end=None, tag_filter: TagFilter = NO_TAG_FILTER) -> list:
+    """[(tag, total, count)] over `model` rows in [start, end], biggest first."""
+    link, id_col = LINKS[model]
+    query = (
+        db.session.query(Tag.name, func.sum(model.base_amount), func.count(model.id))
+        .select_from(link)
+        .join(Tag, Tag.id == link.c.tag_id)
+        .join(model, model.id == id_col)
+    )
+    if start is not None:
+        query = query.filter(model.date >= start)
+    if end is not None:
+        query = query.filter(model.date <= end)
+    query = filter_by_tags(query, model, tag_filter)
+    return [(name, float(total or 0), count)
+            for name, total, count in query.group_by(Tag.name).order_by(func.sum(model.base_amount).desc())]
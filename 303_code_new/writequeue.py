@@ -0,0 +1,167 @@
+"""
+Optional single-writer write path (config WRITE_QUEUE = True).
+
+SQLite has one write lock. With several request threads each doing its own
+small commit, writers queue on the lock and, past the busy timeout, fail with
+"database is locked". In queue mode every mutation is handed to one writer
+thread per process instead. The writer collects whatever arrives within
+WRITE_QUEUE_WINDOW_MS (up to WRITE_QUEUE_MAX_BATCH jobs), runs each job in its
+own SAVEPOINT inside a single BEGIN IMMEDIATE transaction, and commits once.
+A job that raises only rolls back its own savepoint. If the transaction hits
+a lock it is rolled back and the whole batch retried with exponential backoff,
+at most WRITE_QUEUE_RETRIES times.
+
+Callers use write(fn, *args) and block until their job's batch has committed,
+getting fn's return value or its exception as if they had called it directly.
+Jobs can be re-run on retry, so they should take plain values (ids, names,
+amounts), not ORM objects loaded in the request's session. Functions that
+would normally commit call database.commit(), which only flushes inside a
+batch.
+
+Each job runs on the user database (shards.py) of the thread that submitted
+it; a batch holding jobs for several users commits each user's jobs in a
+transaction of their own.
+
+Without WRITE_QUEUE, write(fn, *args) simply calls fn(*args), rolling the
+session back if it raises.
+"""
+import os
+import queue
+import random
+import threading
+import time
+from concurrent.futures import Future
+from flask import current_app, g
+from sqlalchemy.exc import OperationalError
+from database import db, current_shard
+from events import pending_mark, discard_since
+
+
+def is_lock_error(exc: BaseException) -> bool:
+    text = str(exc).lower()
+    return isinstance(exc, OperationalError) and ("locked" in text or "busy" in text)
+
+
+class WriteQueue:
+    def __init__(self, app, window: float = 0.005, max_batch: int = 64,
+                 retries: int = 5, backoff: float = 0.01):
+        self.app = app
+        self.window = window
+        self.max_batch = max_batch
+        self.retries = retries
+        self.backoff = backoff
+        self.stats = {"jobs": 0, "batches": 0, "retries": 0, "failed_batches": 0}
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        self._ensure_running()
+        future = Future()
+        self._queue.put((current_shard(), fn, args, kwargs, future))
+        return future
+
+    def _ensure_running(self):
+        # threads do not survive fork(), so a forked worker starts its own writer
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._queue = queue.Queue()
+                threading.Thread(target=self._run, name="write-queue", daemon=True).start()
+                self._pid = os.getpid()
+
+    def _next_batch(self) -> list:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        with self.app.app_context():
+            session = db.session()
+            session.info["group_commit"] = True
+            # results handed back to other threads must stay readable
+            session.expire_on_commit = False
+            while True:
+                by_shard = {}
+                for shard, *job in self._next_batch():
+                    by_shard.setdefault(shard, []).append(job)
+                for shard, batch in by_shard.items():
+                    g.shard = shard
+                    self._commit_batch(session, batch)
+                    session.expunge_all()
+
+    def _commit_batch(self, session, batch):
+        self.stats["batches"] += 1
+        self.stats["jobs"] += len(batch)
+        for attempt in range(self.retries + 1):
+            try:
+                outcomes = self._execute(session, batch)
+                session.commit()
+            except Exception as e:
+                session.rollback()
+                if is_lock_error(e) and attempt < self.retries:
+                    self.stats["retries"] += 1
+                    time.sleep(self.backoff * 2 ** attempt * (1 + random.random()))
+                    continue
+                self.stats["failed_batches"] += 1
+                for *_, future in batch:
+                    future.set_exception(e)
+                return
+            for (*_, future), (ok, value) in zip(batch, outcomes):
+                if ok:
+                    future.set_result(value)
+                else:
+                    future.set_exception(value)
+            return
+
+    def _execute(self, session, batch) -> list:
+        # take the write lock up front instead of upgrading from a read lock,
+        # which SQLite cannot wait for
+        session.connection().exec_driver_sql("BEGIN IMMEDIATE")
+        outcomes = []
+        for fn, args, kwargs, _ in batch:
+            savepoint = session.begin_nested()
+            mark = pending_mark(session)
+            try:
+                value = fn(*args, **kwargs)
+                savepoint.commit()
+                outcomes.append((True, value))
+            except Exception as e:
+                savepoint.rollback()
+                # its events describe changes that were just undone
+                discard_since(session, mark)
+                if is_lock_error(e):
+                    raise
+                outcomes.append((False, e))
+        return outcomes
+
+
+def init_write_queue(app):
+    if app.config.get("WRITE_QUEUE"):
+        app.extensions["write_queue"] = WriteQueue(
+            app,
+            window=app.config.get("WRITE_QUEUE_WINDOW_MS", 5) / 1000,
+            max_batch=app.config.get("WRITE_QUEUE_MAX_BATCH", 64),
+            retries=app.config.get("WRITE_QUEUE_RETRIES", 5),
+        )
+
+def write(fn, *args, **kwargs):
+    """Run a mutation through the app's write queue, or directly when it is off."""
+    wq = current_app.extensions.get("write_queue")
+    if wq is None:
+        try:
+            return fn(*args, **kwargs)
+        except Exception:
+            # like a queued job's savepoint: a failed job leaves nothing behind
+            db.session.rollback()
+            raise
+    return wq.submit(fn, *args, **kwargs).result()